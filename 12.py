@@ -1,33 +1,2270 @@
 # ZYNAPSE CLI with Firebase Integration - Complete Fixed Version
 # Requirements: pip install google-genai firebase-admin
 
+import time
+STARTUP_STARTED = time.perf_counter()
+
 import os
+import base64
+import contextlib
+import copy
+import gzip
+import io
+import itertools
+import math
+import hashlib
+import sqlite3
 import subprocess
 import json
 import sys
-import time
 import threading
+import queue
+import signal
+import atexit
 import uuid
-from typing import Dict, Any, Tuple
-from datetime import datetime
+from collections import deque, OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Tuple, Callable
+from datetime import datetime, timedelta
 import logging
+import argparse
+import importlib.util
+
+# google-genai and firebase-admin are imported on first use: they make up most
+# of the import time and the prompt does not need them
+genai = None
+types = None
+firebase_admin = None
+credentials = None
+firestore = None
+db = None
+_google_imports_lock = threading.Lock()
+
+MISSING_PACKAGES_MESSAGE = ("Missing required packages. Please install them using:\n"
+                            "pip install google-genai firebase-admin")
+
+def missing_packages() -> list:
+    """Required packages that are not installed, checked without importing them"""
+    required = {'google-genai': 'google.genai', 'firebase-admin': 'firebase_admin'}
+    missing = []
+    for package, module in required.items():
+        try:
+            if importlib.util.find_spec(module) is None:
+                missing.append(package)
+        except ImportError:
+            missing.append(package)
+    return missing
+
+def import_genai():
+    """Import google-genai on first use"""
+    global genai, types
+    with _google_imports_lock:
+        if types is None:
+            try:
+                from google import genai as genai_module
+                from google.genai import types as types_module
+            except ImportError as e:
+                raise ImportError(MISSING_PACKAGES_MESSAGE) from e
+            genai, types = genai_module, types_module
+
+def import_firebase():
+    """Import firebase-admin on first use"""
+    global firebase_admin, credentials, firestore, db
+    with _google_imports_lock:
+        if firebase_admin is None:
+            try:
+                import firebase_admin as firebase_admin_module
+                from firebase_admin import credentials as credentials_module
+                from firebase_admin import firestore as firestore_module
+                from firebase_admin import db as db_module
+            except ImportError as e:
+                raise ImportError(MISSING_PACKAGES_MESSAGE) from e
+            credentials, firestore, db = credentials_module, firestore_module, db_module
+            firebase_admin = firebase_admin_module
+
+IMPORT_SECONDS = time.perf_counter() - STARTUP_STARTED
+
+# Scheduling classes, most urgent first. Emergency and interactive work never
+# waits for a worker slot; remote and batch commands share the worker pool
+PRIORITY_CLASSES = ('emergency', 'interactive', 'remote', 'batch')
+QUEUED_PRIORITIES = ('interactive', 'remote', 'batch')
+REMOTE_PRIORITIES = ('remote', 'batch')
+EMERGENCY_STOP_COMMAND = 'EMERGENCY_STOP'
+# active_processes key of the command typed at the prompt (remote ones use their command_id)
+LOCAL_PROCESS_KEY = 'interactive'
+
+class CommandTicket:
+    """A command waiting for, or holding, a worker slot"""
+
+    def __init__(self, command_id: str, command_text: str, handler: Callable, source: str = 'remote',
+                 priority: str = 'remote', submitter: str = None, owner: str = None,
+                 schedule: str = None, structured: bool = None, broadcast_id: str = None):
+        self.command_id = command_id
+        self.command_text = command_text
+        self.handler = handler
+        self.source = source
+        self.priority = priority
+        self.submitter = submitter or 'unknown'
+        self.owner = owner
+        # Set when the request's code should become a scheduled job after this run
+        self.schedule = schedule
+        # Output mode requested with the command; None uses the agent's setting
+        self.structured = structured
+        # Fan-out command this ticket runs on behalf of, if any
+        self.broadcast_id = broadcast_id
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.cancelled = threading.Event()
+
+class CommandQueue:
+    """Bounded worker pool between the Firebase listener and process_request
+
+    Queued tickets are dispatched by priority class, and round-robin across
+    submitters within a class, so one busy console cannot starve the others.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue_size: int = 50, logger: logging.Logger = None):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self.logger = logger or logging.getLogger(__name__)
+        # priority -> submitter -> tickets; submitters rotate to the back after each dispatch
+        self.pending = {priority: OrderedDict() for priority in QUEUED_PRIORITIES}
+        self.pending_count = 0
+        self.running = {}
+        self.completed_count = 0
+        self.cancelled_count = 0
+        self.rejected_count = 0
+        self._cond = threading.Condition()
+        self._workers = []
+        self._shutdown = False
+
+    def submit(self, ticket: CommandTicket) -> int:
+        """Queue a ticket and return its estimated 1-based position; raises queue.Full when saturated
+        
+        Emergency tickets start at once on their own thread and return position 0.
+        """
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Command queue is shut down")
+            if ticket.priority == 'emergency':
+                self._start(ticket)
+                threading.Thread(target=self._run_ticket, args=(ticket,), daemon=True,
+                                 name="zynapse-emergency").start()
+                return 0
+            if self.pending_count >= self.max_queue_size:
+                self.rejected_count += 1
+                raise queue.Full(f"Command queue is full ({self.max_queue_size} pending)")
+            
+            submitters = self.pending[ticket.priority]
+            ahead = sum(len(tickets) for priority in QUEUED_PRIORITIES[:QUEUED_PRIORITIES.index(ticket.priority)]
+                        for tickets in self.pending[priority].values())
+            own = submitters.setdefault(ticket.submitter, deque())
+            # Round-robin: one ticket of every other submitter per ticket of ours already queued
+            ahead += sum(min(len(tickets), len(own) + 1) for submitter, tickets in submitters.items()
+                         if submitter != ticket.submitter)
+            position = ahead + len(own) + 1
+            own.append(ticket)
+            self.pending_count += 1
+            self._ensure_workers()
+            self._cond.notify()
+            return position
+
+    def run_now(self, ticket: CommandTicket):
+        """Run a ticket on the calling thread, outside the worker limit (interactive input)"""
+        with self._cond:
+            self._start(ticket)
+        self._run_ticket(ticket)
+
+    def queued_tickets(self) -> list:
+        """Queued tickets, most urgent class first"""
+        with self._cond:
+            return [ticket for priority in QUEUED_PRIORITIES
+                    for tickets in self.pending[priority].values() for ticket in tickets]
+
+    def cancel(self, command_id: str):
+        """Cancel a command; returns the ticket and whether it was still queued"""
+        queued, running = self.cancel_matching(lambda ticket: ticket.command_id == command_id)
+        if queued:
+            return queued[0], True
+        if running:
+            return running[0], False
+        return None, False
+
+    def cancel_matching(self, predicate: Callable[[CommandTicket], bool]) -> Tuple[list, list]:
+        """Cancel every queued and running ticket the predicate selects"""
+        with self._cond:
+            queued = []
+            for submitters in self.pending.values():
+                for submitter, tickets in list(submitters.items()):
+                    matches = [ticket for ticket in tickets if predicate(ticket)]
+                    for ticket in matches:
+                        tickets.remove(ticket)
+                    if not tickets:
+                        del submitters[submitter]
+                    queued.extend(matches)
+            self.pending_count -= len(queued)
+            running = [ticket for ticket in self.running.values()
+                       if predicate(ticket) and not ticket.cancelled.is_set()]
+            for ticket in queued + running:
+                ticket.cancelled.set()
+            self.cancelled_count += len(queued) + len(running)
+            return queued, running
+
+    def is_cancelled(self, command_id: str) -> bool:
+        with self._cond:
+            ticket = self.running.get(command_id)
+            return bool(ticket and ticket.cancelled.is_set())
+
+    def set_workers(self, max_workers: int):
+        """Resize the pool; surplus workers exit once their current command finishes"""
+        with self._cond:
+            self.max_workers = max(1, max_workers)
+            self._ensure_workers()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'queued': self.pending_count,
+                'queued_by_priority': {
+                    priority: sum(len(tickets) for tickets in submitters.values())
+                    for priority, submitters in self.pending.items()
+                },
+                'submitters': len({submitter for submitters in self.pending.values() for submitter in submitters}),
+                'running': len(self.running),
+                'completed': self.completed_count,
+                'cancelled': self.cancelled_count,
+                'rejected': self.rejected_count
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            for submitters in self.pending.values():
+                for tickets in submitters.values():
+                    for ticket in tickets:
+                        ticket.cancelled.set()
+                submitters.clear()
+            self.pending_count = 0
+            self._cond.notify_all()
+
+    def _ensure_workers(self):
+        # Caller holds self._cond
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, daemon=True,
+                                      name=f"zynapse-worker-{len(self._workers) + 1}")
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_ticket(self) -> CommandTicket:
+        # Caller holds self._cond and has checked pending_count
+        for priority in QUEUED_PRIORITIES:
+            submitters = self.pending[priority]
+            if submitters:
+                submitter, tickets = next(iter(submitters.items()))
+                ticket = tickets.popleft()
+                del submitters[submitter]
+                if tickets:
+                    submitters[submitter] = tickets
+                self.pending_count -= 1
+                return ticket
+
+    def _start(self, ticket: CommandTicket):
+        # Caller holds self._cond
+        ticket.started_at = time.monotonic()
+        self.running[ticket.command_id] = ticket
+
+    def _run_ticket(self, ticket: CommandTicket):
+        try:
+            ticket.handler(ticket)
+        except Exception as e:
+            self.logger.error(f"Worker failed on command {ticket.command_id}: {str(e)}")
+        finally:
+            with self._cond:
+                self.running.pop(ticket.command_id, None)
+                self.completed_count += 1
+
+    def _worker_loop(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                while not self.pending_count and not self._shutdown and me in self._workers[:self.max_workers]:
+                    self._cond.wait()
+                if self._shutdown or me not in self._workers[:self.max_workers]:
+                    # Pool was shut down or shrunk below this worker's slot
+                    if me in self._workers:
+                        self._workers.remove(me)
+                    return
+                ticket = self._next_ticket()
+                self._start(ticket)
+            
+            self._run_ticket(ticket)
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * pct / 100) - 1)]
+
+class Tracer:
+    """Monotonic-clock spans aggregated into in-memory histograms, one per span name"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, sample_size: int = 1000):
+        self.sample_size = sample_size
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        start = time.monotonic()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.observe(name, time.monotonic() - start, failed)
+
+    def observe(self, name: str, seconds: float, failed: bool = False):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {
+                    'buckets': [0] * len(self.BUCKETS),
+                    'count': 0,
+                    'sum': 0.0,
+                    'errors': 0,
+                    'samples': deque(maxlen=self.sample_size)
+                }
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            if failed:
+                histogram['errors'] += 1
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['samples'].append(seconds)
+
+    def register_gauge(self, name: str, help_text: str, func: Callable):
+        """Expose the current value of func() as a Prometheus gauge"""
+        self._gauges[name] = (help_text, func)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, errors, mean and percentiles of recent samples per span"""
+        with self._lock:
+            histograms = {name: dict(h, samples=list(h['samples'])) for name, h in self._histograms.items()}
+        return {
+            name: {
+                'count': h['count'],
+                'errors': h['errors'],
+                'mean': h['sum'] / h['count'] if h['count'] else 0.0,
+                'p50': percentile(h['samples'], 50),
+                'p95': percentile(h['samples'], 95),
+                'p99': percentile(h['samples'], 99)
+            }
+            for name, h in sorted(histograms.items())
+        }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render_prometheus(self) -> str:
+        """Histograms and gauges in the Prometheus text exposition format"""
+        lines = [
+            "# HELP zynapse_span_seconds Duration of traced operations",
+            "# TYPE zynapse_span_seconds histogram"
+        ]
+        errors = []
+        with self._lock:
+            for name, h in sorted(self._histograms.items()):
+                for bound, count in zip(self.BUCKETS, h['buckets']):
+                    lines.append(f'zynapse_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'zynapse_span_seconds_bucket{{span="{name}",le="+Inf"}} {h["count"]}')
+                lines.append(f'zynapse_span_seconds_sum{{span="{name}"}} {h["sum"]:.6f}')
+                lines.append(f'zynapse_span_seconds_count{{span="{name}"}} {h["count"]}')
+                errors.append(f'zynapse_span_errors_total{{span="{name}"}} {h["errors"]}')
+        lines.append("# HELP zynapse_span_errors_total Traced operations that failed")
+        lines.append("# TYPE zynapse_span_errors_total counter")
+        lines.extend(errors)
+        
+        for name, (help_text, func) in sorted(self._gauges.items()):
+            try:
+                value = float(func())
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Serves a Tracer in Prometheus text format on http://127.0.0.1:<port>/metrics"""
+
+    def __init__(self, tracer: Tracer, port: int, host: str = '127.0.0.1'):
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = tracer.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="zynapse-metrics")
+        self._thread.start()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class BackgroundWriter:
+    """Single thread that performs fire-and-forget Firebase writes in submission order"""
+
+    def __init__(self, max_pending: int = 1000, logger: logging.Logger = None, tracer: Tracer = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.tracer = tracer
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.written_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="zynapse-writer")
+        self._thread.start()
+
+    def submit(self, label: str, func: Callable, *args, **kwargs) -> bool:
+        """Queue a write; returns False if the backlog is full and the write was dropped"""
+        try:
+            self.pending.put_nowait((label, func, args, kwargs))
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            self.logger.warning(f"Background writer full, dropped write: {label}")
+            return False
+
+    def flush(self, timeout: float = 10) -> bool:
+        """Wait until every queued write has been attempted"""
+        deadline = time.monotonic() + timeout
+        while self.pending.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'pending': self.pending.qsize(),
+            'written': self.written_count,
+            'failed': self.failed_count,
+            'dropped': self.dropped_count
+        }
+
+    def _run(self):
+        while True:
+            label, func, args, kwargs = self.pending.get()
+            start = time.monotonic()
+            failed = False
+            try:
+                func(*args, **kwargs)
+                self.written_count += 1
+            except Exception as e:
+                failed = True
+                self.failed_count += 1
+                self.logger.error(f"Background write failed ({label}): {str(e)}")
+            finally:
+                if self.tracer:
+                    self.tracer.observe(label.split(':')[0], time.monotonic() - start, failed)
+                self.pending.task_done()
+
+def add_counters(target: Dict, deltas: Dict):
+    """Sum nested counter deltas into target"""
+    for key, value in deltas.items():
+        if isinstance(value, dict):
+            add_counters(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+def merge_fields(target: Dict, fields: Dict):
+    """Merge nested maps into target the way a Firestore merge-write does"""
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_fields(target[key], value)
+        else:
+            target[key] = value
+
+def increment_transforms(deltas: Dict, increment: Callable) -> Dict:
+    """Nested counter deltas as increment(value) transforms, dropping zeros"""
+    transforms = {}
+    for key, value in deltas.items():
+        if isinstance(value, dict):
+            nested = increment_transforms(value, increment)
+            if nested:
+                transforms[key] = nested
+        elif value:
+            transforms[key] = increment(value)
+    return transforms
+
+def increment_factory(client) -> Callable:
+    """The Increment transform for a Firestore client
+
+    An injected client (such as the benchmark fakes) may bring its own as
+    client.Increment; otherwise firebase-admin's is imported.
+    """
+    factory = getattr(client, 'Increment', None)
+    if factory is not None:
+        return factory
+    import_firebase()
+    return firestore.Increment
+
+class StatusWriter:
+    """Coalesces merge-writes per Firestore document and commits them in batches.
+
+    The newest value of each field wins; counter deltas passed to increment()
+    are summed and applied as Increment transforms. Pending writes are flushed
+    once updates pause for debounce_seconds, or max_latency_seconds after the
+    first pending one.
+    """
+
+    MAX_BATCH_WRITES = 500
+
+    def __init__(self, client_getter: Callable, debounce_seconds: float = 0.5,
+                 max_latency_seconds: float = 2.0, logger: logging.Logger = None,
+                 tracer: Tracer = None):
+        self.client_getter = client_getter
+        self.tracer = tracer
+        self.debounce_seconds = debounce_seconds
+        self.max_latency_seconds = max_latency_seconds
+        self.logger = logger or logging.getLogger(__name__)
+        self.pending = {}
+        self.pending_counters = {}
+        self.update_count = 0
+        self.written_count = 0
+        self.batch_count = 0
+        self.failed_count = 0
+        self._first_pending_at = None
+        self._last_update_at = None
+        self._retry_at = 0.0
+        self._cond = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+
+    def update(self, collection: str, document_id: str, fields: Dict):
+        """Queue a merge-write of fields into collection/document_id"""
+        with self._cond:
+            if self._closed:
+                return
+            merge_fields(self.pending.setdefault((collection, document_id), {}), fields)
+            self._queued()
+
+    def increment(self, collection: str, document_id: str, counters: Dict):
+        """Queue counter deltas (nested dicts of numbers) for collection/document_id"""
+        with self._cond:
+            if self._closed:
+                return
+            add_counters(self.pending_counters.setdefault((collection, document_id), {}), counters)
+            self._queued()
+
+    def _queued(self):
+        # Called with self._cond held
+        now = time.monotonic()
+        self.update_count += 1
+        self._last_update_at = now
+        if self._first_pending_at is None:
+            self._first_pending_at = now
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="zynapse-status-writer")
+            self._thread.start()
+        self._cond.notify()
+
+    def flush(self):
+        """Commit everything pending now, on the calling thread"""
+        with self._commit_lock:
+            self._commit(self._take())
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                'updates': self.update_count,
+                'pending_documents': len(set(self.pending) | set(self.pending_counters)),
+                'documents_written': self.written_count,
+                'batches': self.batch_count,
+                'failed_batches': self.failed_count
+            }
+
+    def _take(self) -> Tuple[Dict, Dict]:
+        with self._cond:
+            pending, self.pending = self.pending, {}
+            counters, self.pending_counters = self.pending_counters, {}
+            self._first_pending_at = None
+            return pending, counters
+
+    def _commit(self, taken: Tuple[Dict, Dict]):
+        pending, counters = taken
+        if not pending and not counters:
+            return
+        client = self.client_getter()
+        if not client:
+            return
+        
+        items = [(key, pending.get(key, {}), counters.get(key, {})) for key in {**pending, **counters}]
+        for start in range(0, len(items), self.MAX_BATCH_WRITES):
+            chunk = items[start:start + self.MAX_BATCH_WRITES]
+            t0 = time.monotonic()
+            try:
+                batch = client.batch()
+                for (collection, document_id), fields, deltas in chunk:
+                    if deltas:
+                        try:
+                            transforms = increment_transforms(deltas, increment_factory(client))
+                        except ImportError as e:
+                            # Without a transform the counters cannot be written; the
+                            # fields in this batch still are
+                            self.logger.error(f"Dropping counter updates for {collection}/{document_id}: {str(e)}")
+                            transforms = {}
+                        fields = copy.deepcopy(fields)
+                        merge_fields(fields, transforms)
+                    if fields:
+                        batch.set(client.collection(collection).document(document_id), fields, merge=True)
+                batch.commit()
+                if self.tracer:
+                    self.tracer.observe('firestore_status_batch', time.monotonic() - t0)
+                with self._cond:
+                    self.batch_count += 1
+                    self.written_count += len(chunk)
+            except Exception as e:
+                if self.tracer:
+                    self.tracer.observe('firestore_status_batch', time.monotonic() - t0, failed=True)
+                self.logger.error(f"Failed to commit status batch: {str(e)}")
+                with self._cond:
+                    self.failed_count += 1
+                    if not self._closed:
+                        # Retry on the next flush; fields updated since then still win
+                        # and counter deltas add up (the failed batch applied none)
+                        for key, fields, deltas in chunk:
+                            if fields:
+                                merged = copy.deepcopy(fields)
+                                merge_fields(merged, self.pending.get(key, {}))
+                                self.pending[key] = merged
+                            if deltas:
+                                add_counters(self.pending_counters.setdefault(key, {}), deltas)
+                        if self._first_pending_at is None:
+                            self._first_pending_at = time.monotonic()
+                        self._retry_at = time.monotonic() + self.max_latency_seconds
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.pending and not self.pending_counters and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                due = min(self._last_update_at + self.debounce_seconds,
+                          self._first_pending_at + self.max_latency_seconds)
+                due = max(due, self._retry_at)
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            self.flush()
+
+def process_group_options() -> Dict[str, Any]:
+    """Popen options that put a shell in its own process group"""
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+def terminate_process_tree(process: subprocess.Popen, grace_seconds: float = 3, logger: logging.Logger = None):
+    """Terminate a shell and its children, escalating to kill after a grace period"""
+    logger = logger or logging.getLogger(__name__)
+    if process.poll() is not None:
+        return
+    
+    try:
+        if grace_seconds > 0:
+            if os.name == 'nt':
+                subprocess.run(['taskkill', '/PID', str(process.pid), '/T'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            else:
+                os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=grace_seconds)
+            return
+    except subprocess.TimeoutExpired:
+        logger.warning(f"Process {process.pid} ignored terminate, killing process tree")
+    except (ProcessLookupError, PermissionError, OSError) as e:
+        logger.warning(f"Graceful terminate of process {process.pid} failed: {str(e)}")
+    
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/PID', str(process.pid), '/T', '/F'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, OSError):
+        process.kill()
+
+def is_powershell(shell_binary: str) -> bool:
+    return os.path.basename(shell_binary).lower().split('.')[0] in ('powershell', 'pwsh')
+
+def process_rss_mb(pid: int):
+    """Resident memory of a process in MB, or None when it cannot be read"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+# Request frame:  "<id> <base64 code>\n"
+# Response frame: "ZYNAPSE_FRAME <id> <exit code> <base64 stdout> <base64 stderr>\n"
+POWERSHELL_HOST_BOOTSTRAP = r'''
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+$utf8 = [System.Text.Encoding]::UTF8
+while ($true) {
+    $line = [Console]::In.ReadLine()
+    if ($null -eq $line) { break }
+    $parts = $line.Split(' ', 2)
+    $id = $parts[0]
+    $code = $utf8.GetString([Convert]::FromBase64String($parts[1]))
+    # A fresh runspace per command keeps variables, functions and location from leaking
+    $ps = [PowerShell]::Create()
+    $exit = 0
+    try {
+        [void]$ps.AddScript($code)
+        $out = ($ps.Invoke() | Out-String)
+        $info = ($ps.Streams.Information | ForEach-Object { $_.ToString() }) -join "`n"
+        if ($info) { $out = $info + "`n" + $out }
+        $err = ($ps.Streams.Error | Out-String)
+        if ($ps.HadErrors) { $exit = 1 }
+    } catch {
+        $out = ''
+        $err = $_.Exception.Message
+        $exit = 1
+    } finally {
+        $ps.Dispose()
+    }
+    $o = [Convert]::ToBase64String($utf8.GetBytes([string]$out))
+    $e = [Convert]::ToBase64String($utf8.GetBytes([string]$err))
+    [Console]::Out.WriteLine("ZYNAPSE_FRAME $id $exit $o $e")
+    [Console]::Out.Flush()
+}
+'''
+
+# Stand-in host for POSIX shells (sh, bash, dash...) used to benchmark the pool
+# on machines without PowerShell; each command runs in a subshell
+POSIX_HOST_BOOTSTRAP = r'''
+while IFS=' ' read -r id payload; do
+    d=$(mktemp -d)
+    printf '%s' "$payload" | base64 -d > "$d/cmd"
+    ( . "$d/cmd" ) > "$d/out" 2> "$d/err" < /dev/null
+    rc=$?
+    printf 'ZYNAPSE_FRAME %s %s %s %s\n' "$id" "$rc" "$(base64 < "$d/out" | tr -d '\n')" "$(base64 < "$d/err" | tr -d '\n')"
+    rm -rf "$d"
+done
+'''
+
+class ShellHost:
+    """A long-lived shell process that runs framed commands read from stdin"""
+
+    def __init__(self, shell_binary: str, logger: logging.Logger = None):
+        self.shell_binary = shell_binary
+        self.logger = logger or logging.getLogger(__name__)
+        self.commands_run = 0
+        self.baseline_rss_mb = None
+        self.started_at = time.monotonic()
+        self._frames = queue.Queue()
+        self._write_lock = threading.Lock()
+        
+        if is_powershell(shell_binary):
+            args = [shell_binary, '-NoLogo', '-NoProfile', '-NonInteractive',
+                    '-ExecutionPolicy', 'Bypass', '-Command', POWERSHELL_HOST_BOOTSTRAP]
+        else:
+            args = [shell_binary, '-c', POSIX_HOST_BOOTSTRAP]
+        
+        self.process = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1,
+            **process_group_options()
+        )
+        self._reader = threading.Thread(target=self._read_frames, daemon=True,
+                                        name=f"zynapse-host-{self.process.pid}")
+        self._reader.start()
+
+    def _read_frames(self):
+        for line in self.process.stdout:
+            if line.startswith('ZYNAPSE_FRAME '):
+                self._frames.put(line.rstrip('\n'))
+        # EOF: the host exited or was killed
+        self._frames.put(None)
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def rss_mb(self):
+        return process_rss_mb(self.process.pid)
+
+    def run(self, code: str, timeout: float) -> Tuple[int, str, str, bool]:
+        """Run code in the host; returns (exit_code, stdout, stderr, timed_out)"""
+        frame_id = uuid.uuid4().hex[:12]
+        payload = base64.b64encode(code.encode('utf-8')).decode('ascii')
+        
+        with self._write_lock:
+            self.process.stdin.write(f"{frame_id} {payload}\n")
+            self.process.stdin.flush()
+        self.commands_run += 1
+        
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return -1, "", "", True
+            try:
+                frame = self._frames.get(timeout=remaining)
+            except queue.Empty:
+                return -1, "", "", True
+            if frame is None:
+                # The host's own exit code (a command may end it with exit 0); its
+                # output is closed, so it is exiting. -1 if it does not finish
+                try:
+                    returncode = self.process.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    returncode = None
+                return (returncode if returncode is not None else -1), "", "Shell host exited unexpectedly", False
+            
+            parts = frame.split(' ')
+            if len(parts) != 5 or parts[1] != frame_id:
+                # Late frame from a command that timed out earlier
+                continue
+            stdout = base64.b64decode(parts[3]).decode('utf-8', errors='replace')
+            stderr = base64.b64decode(parts[4]).decode('utf-8', errors='replace')
+            return int(parts[2]), stdout, stderr, False
+
+    def close(self, grace_seconds: float = 3):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        terminate_process_tree(self.process, grace_seconds, self.logger)
+
+class ShellHostPool:
+    """Pool of warm shell hosts that removes interpreter startup from each command"""
+
+    def __init__(self, shell_binary: str, size: int = 2, max_commands_per_host: int = 100,
+                 max_memory_growth_mb: float = 200, logger: logging.Logger = None):
+        self.shell_binary = shell_binary
+        self.size = max(1, size)
+        self.max_commands_per_host = max_commands_per_host
+        self.max_memory_growth_mb = max_memory_growth_mb
+        self.logger = logger or logging.getLogger(__name__)
+        self.hosts_started = 0
+        self.hosts_recycled = 0
+        self.commands_run = 0
+        self._idle = queue.LifoQueue()
+        self._host_count = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        """Warm up the pool in the background"""
+        threading.Thread(target=self._prewarm, daemon=True, name="zynapse-pool-warmup").start()
+
+    def _prewarm(self):
+        for _ in range(self.size):
+            host = self._spawn()
+            if not host:
+                return
+            if self.check_host(host):
+                self._idle.put(host)
+            else:
+                self._discard(host)
+
+    def _spawn(self):
+        with self._lock:
+            if self._closed or self._host_count >= self.size:
+                return None
+            self._host_count += 1
+        try:
+            host = ShellHost(self.shell_binary, self.logger)
+        except Exception:
+            with self._lock:
+                self._host_count -= 1
+            raise
+        self.hosts_started += 1
+        return host
+
+    def _discard(self, host: ShellHost):
+        host.close(grace_seconds=0)
+        with self._lock:
+            self._host_count -= 1
+
+    def check_host(self, host: ShellHost, timeout: float = 15) -> bool:
+        """Health check: the host must echo a probe back within the timeout"""
+        probe = "Write-Output 'ok'" if is_powershell(self.shell_binary) else "echo ok"
+        exit_code, stdout, _, timed_out = host.run(probe, timeout)
+        host.commands_run -= 1
+        if not timed_out and exit_code == 0 and stdout.strip() == 'ok':
+            if host.baseline_rss_mb is None:
+                host.baseline_rss_mb = host.rss_mb()
+            return True
+        return False
+
+    def acquire(self, timeout: float) -> ShellHost:
+        try:
+            host = self._idle.get_nowait()
+        except queue.Empty:
+            host = self._spawn()
+            if host is None:
+                host = self._idle.get(timeout=timeout)
+        if not host.is_alive():
+            self._discard(host)
+            return self.acquire(timeout)
+        return host
+
+    def release(self, host: ShellHost):
+        """Return a host to the pool, recycling it when it is worn out"""
+        reason = None
+        if not host.is_alive():
+            reason = "exited"
+        elif self._closed:
+            reason = "pool closed"
+        elif host.commands_run >= self.max_commands_per_host:
+            reason = f"ran {host.commands_run} commands"
+        else:
+            rss = host.rss_mb()
+            if rss is not None and host.baseline_rss_mb is not None \
+                    and rss - host.baseline_rss_mb > self.max_memory_growth_mb:
+                reason = f"memory grew to {rss:.0f} MB"
+        
+        if reason:
+            self.logger.info(f"Recycling shell host {host.process.pid}: {reason}")
+            self.hosts_recycled += 1
+            self._discard(host)
+            if not self._closed:
+                self.start()
+        else:
+            self._idle.put(host)
+
+    def execute(self, code: str, timeout: float, on_host: Callable = None) -> Tuple[int, str, str, bool]:
+        """Run code on a pooled host; a host that times out is killed and replaced"""
+        started = time.monotonic()
+        host = self.acquire(timeout)
+        if on_host:
+            on_host(host)
+        try:
+            result = host.run(code, max(0.1, timeout - (time.monotonic() - started)))
+            self.commands_run += 1
+            if result[3]:
+                host.close(grace_seconds=0)
+            return result
+        finally:
+            self.release(host)
+
+    def health_check(self) -> Dict[str, Any]:
+        """Probe every idle host, replacing the ones that fail"""
+        healthy, replaced = 0, 0
+        hosts = []
+        while True:
+            try:
+                hosts.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for host in hosts:
+            if host.is_alive() and self.check_host(host, timeout=5):
+                healthy += 1
+                self._idle.put(host)
+            else:
+                replaced += 1
+                self._discard(host)
+        if replaced:
+            self.start()
+        return {'healthy': healthy, 'replaced': replaced}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'shell': self.shell_binary,
+            'size': self.size,
+            'hosts': self._host_count,
+            'idle': self._idle.qsize(),
+            'commands_run': self.commands_run,
+            'hosts_started': self.hosts_started,
+            'hosts_recycled': self.hosts_recycled
+        }
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+class CommandOutputStream:
+    """Collects a command's output line by line, echoes it to the console and
+    publishes throttled batches to zynapse_output/{command_id}/chunks"""
+
+    def __init__(self, command_id: str = None, output_ref=None, echo: bool = True,
+                 flush_interval: float = 0.5, max_batch_chars: int = 16384,
+                 max_output_chars: int = 1000000, logger: logging.Logger = None):
+        self.command_id = command_id
+        self.output_ref = output_ref
+        self.echo = echo
+        self.flush_interval = flush_interval
+        self.max_batch_chars = max_batch_chars
+        self.max_echo_chars = 1000
+        self.logger = logger or logging.getLogger(__name__)
+        self.chunk_count = 0
+        # Keep the head and the tail of each stream, dropping the middle past the cap
+        self._half_cap = max(1, max_output_chars // 2)
+        self._head = {'stdout': [], 'stderr': []}
+        self._head_chars = {'stdout': 0, 'stderr': 0}
+        self._tail = {'stdout': deque(), 'stderr': deque()}
+        self._tail_chars = {'stdout': 0, 'stderr': 0}
+        self._dropped_chars = {'stdout': 0, 'stderr': 0}
+        self._batch = []
+        self._batch_chars = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        
+        if self.output_ref is not None:
+            self.output_ref.set({'status': 'streaming', 'started_at': datetime.now().isoformat()})
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True,
+                                             name=f"zynapse-output-{command_id}")
+            self._flusher.start()
+
+    def write(self, stream: str, line: str):
+        """Record one line (with its newline) from stdout or stderr"""
+        if self.echo:
+            prefix = f"[{self.command_id}] " if self.command_id else ""
+            print(f"│ {prefix}{line.rstrip()[:self.max_echo_chars]}")
+        
+        flush_now = False
+        with self._lock:
+            line = self._collect(stream, line)
+            if self.output_ref is not None:
+                self._batch.append((stream, line))
+                self._batch_chars += len(line)
+                flush_now = self._batch_chars >= self.max_batch_chars
+        if flush_now:
+            self.flush()
+
+    def _collect(self, stream: str, line: str) -> str:
+        # Caller holds self._lock
+        if len(line) > self._half_cap:
+            self._dropped_chars[stream] += len(line) - self._half_cap
+            line = line[:self._half_cap]
+        
+        if self._head_chars[stream] + len(line) <= self._half_cap:
+            self._head[stream].append(line)
+            self._head_chars[stream] += len(line)
+            return line
+        
+        tail = self._tail[stream]
+        tail.append(line)
+        self._tail_chars[stream] += len(line)
+        while self._tail_chars[stream] > self._half_cap and len(tail) > 1:
+            dropped = tail.popleft()
+            self._tail_chars[stream] -= len(dropped)
+            self._dropped_chars[stream] += len(dropped)
+        return line
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Append the pending batch as one chunk per stream in a single RTDB update"""
+        with self._lock:
+            if not self._batch:
+                return
+            batch, self._batch, self._batch_chars = self._batch, [], 0
+            
+            update = {}
+            for stream in ('stdout', 'stderr'):
+                text = ''.join(line for line_stream, line in batch if line_stream == stream)
+                if text:
+                    update[f'chunks/{self.chunk_count:06d}'] = {
+                        'stream': stream,
+                        'text': text,
+                        'timestamp': datetime.now().isoformat()
+                    }
+                    self.chunk_count += 1
+            update['chunk_count'] = self.chunk_count
+        
+        try:
+            self.output_ref.update(update)
+        except Exception as e:
+            self.logger.warning(f"Failed to stream output for {self.command_id}: {str(e)}")
+
+    def finish(self) -> Tuple[str, str]:
+        """Flush what is left and return the capped stdout and stderr text"""
+        self._closed.set()
+        if self._flusher:
+            self._flusher.join(timeout=self.flush_interval * 2)
+        if self.output_ref is not None:
+            self.flush()
+            try:
+                self.output_ref.update({'status': 'finished', 'finished_at': datetime.now().isoformat()})
+            except Exception as e:
+                self.logger.warning(f"Failed to finish output stream for {self.command_id}: {str(e)}")
+        
+        with self._lock:
+            texts = []
+            for stream in ('stdout', 'stderr'):
+                text = ''.join(self._head[stream])
+                if self._dropped_chars[stream]:
+                    text += f"\n... [{self._dropped_chars[stream]} characters truncated] ...\n"
+                text += ''.join(self._tail[stream])
+                texts.append(text)
+                # Drop the line buffers so the output is only held once, as the joined text
+                self._head[stream] = []
+                self._tail[stream] = deque()
+        return texts[0], texts[1]
+
+
+ANALYZER_MODES = ('llm', 'heuristic', 'hybrid')
+
+# Output fragments that mean a command "succeeded" but still went wrong
+# (PowerShell writes many non-terminating errors and still exits 0)
+OUTPUT_ERROR_PATTERNS = (
+    'error', 'exception', 'access is denied', 'access denied', 'permission denied',
+    'is not recognized', 'cannot find', 'not found', 'failed', 'unauthorized',
+    'fullyqualifiederrorid', 'categoryinfo',
+)
+
+LARGE_OUTPUT_CHARS = 100000
+
+# Remote command ids remembered per device to drop replays and our own writes
+SEEN_COMMANDS_LIMIT = 4096
+
+# RTDB command layouts: 'partitioned' (zynapse_commands/{device_id}/{command_id}),
+# 'legacy' (zynapse_commands/{command_id}) or 'migration' (reads both)
+COMMAND_LAYOUTS = ('legacy', 'partitioned', 'migration')
+
+class PartitionEvent:
+    """An event of the whole zynapse_commands tree re-rooted at one device's partition"""
+
+    def __init__(self, path: str, data: Any):
+        self.event_type = 'put'
+        self.path = path
+        self.data = data
+
+def partition_events(segments: list, data: Any) -> list:
+    """Tree events under /{device_id}/... as events of that device's partition listener"""
+    if len(segments) == 2:
+        return [PartitionEvent(f'/{segments[1]}', data)]
+    if len(segments) == 1 and isinstance(data, dict):
+        return [PartitionEvent(f'/{command_id}', command) for command_id, command in data.items()]
+    return []
+
+# Fleet-wide counters kept in one small document, so controllers can show
+# totals from a single snapshot listener instead of scanning collections
+FLEET_STATS_COLLECTION = 'zynapse_fleet'
+FLEET_STATS_DOCUMENT = 'stats'
+
+# Results older than the archive age move from zynapse_results into compact
+# zynapse_results_archive documents (gzip NDJSON, bounded output per result)
+RESULT_ARCHIVE_BATCH = 100
+ARCHIVE_OUTPUT_CHARS = 4000
+RESULT_ARCHIVE_LEASE_SECONDS = 600
+
+# Command nodes that finished before the archive age are deleted from
+# zynapse_commands under the same lease; any of these fields marks a node
+# that will not change again (its result is in zynapse_results)
+FINISHED_COMMAND_FIELDS = ('completed_at', 'cancelled_at', 'rejected_at')
+COMMAND_PRUNE_BATCH = 200
+
+# Generated code shared across the fleet, one document per cache key
+CODEGEN_SHARED_COLLECTION = 'zynapse_codegen_cache'
+# Part of every cache key; bumped when normalization changes so entries stored
+# under the old keys (on disk and in the shared collection) are never matched
+CODEGEN_KEY_VERSION = 2
+
+# zynapse_results/{command_id} is the one full result record. Outputs longer
+# than the inline limit keep only a preview there; the full text is stored
+# gzip-compressed in base64 chunks under zynapse_result_blobs/{command_id}
+RESULT_INLINE_OUTPUT_CHARS = 16000
+RESULT_BLOB_CHUNK_CHARS = 256000
+RESULT_BLOBS_PATH = 'zynapse_result_blobs'
+
+def encode_output_blob(output: str) -> Dict[str, Any]:
+    """Full command output as gzip + base64 text split into RTDB-sized chunks"""
+    compressed = gzip.compress(output.encode('utf-8'))
+    encoded = base64.b64encode(compressed).decode('ascii')
+    return {
+        'encoding': 'gzip+base64',
+        'size': len(output),
+        'compressed_size': len(compressed),
+        'chunks': [encoded[i:i + RESULT_BLOB_CHUNK_CHARS]
+                   for i in range(0, len(encoded), RESULT_BLOB_CHUNK_CHARS)] or ['']
+    }
+
+def decode_output_blob(blob: Dict) -> str:
+    return gzip.decompress(base64.b64decode(''.join(blob.get('chunks') or []))).decode('utf-8')
+
+def compact_result(command_id: str, result: Dict) -> Dict[str, Any]:
+    """Archive form of a zynapse_results entry: metadata, code and a bounded output"""
+    code_info = result.get('code_info') or {}
+    metrics = result.get('metrics') or {}
+    analysis = result.get('analysis') or {}
+    output = result.get('output') or ''
+    if not output and result.get('data') is not None:
+        output = json.dumps(result['data'], ensure_ascii=False, separators=(',', ':'))
+    return {
+        'command_id': command_id,
+        'device_id': result.get('device_id'),
+        'status': result.get('status'),
+        'completed_at': result.get('completed_at'),
+        'success': result.get('success', False),
+        'execution_success': result.get('execution_success', False),
+        'code': code_info.get('code'),
+        'safety_level': code_info.get('safety_level'),
+        'execution_time': metrics.get('execution_time'),
+        'exit_code': metrics.get('exit_code'),
+        'request_fulfilled': analysis.get('request_fulfilled'),
+        'execution_quality': analysis.get('execution_quality'),
+        'output': output[:ARCHIVE_OUTPUT_CHARS],
+        'output_truncated': len(output) > ARCHIVE_OUTPUT_CHARS or bool(result.get('output_truncated'))
+    }
+
+# Code generation fields a remote command can start executing with, while
+# Gemini is still writing the explanation and the other descriptive fields
+EARLY_CODEGEN_FIELDS = ('code', 'safety_level')
+
+# Structured mode: the generated code prints one JSON document, and the parsed
+# value is stored on the result as typed 'data' in place of the output text
+STRUCTURED_OUTPUT_INSTRUCTION = """
+Structured output mode:
+- The code must write exactly one JSON document to stdout and nothing else
+- Select only the properties the request needs (Select-Object), as numbers, strings and booleans
+- Use base units (bytes, percent, seconds) and ISO 8601 strings for dates
+- End the pipeline with: ConvertTo-Json -Depth 4 -Compress
+- Never use Write-Host, Format-Table, Format-List or Out-String
+"""
+RTDB_FORBIDDEN_KEY_CHARS = str.maketrans({char: '_' for char in '.$#[]/'})
+
+def parse_structured_output(output: str) -> Any:
+    """Value of the JSON document printed by structured-mode code; raises ValueError"""
+    text = (output or '').strip().lstrip('\ufeff')
+    if not text:
+        raise ValueError("No output to parse")
+    try:
+        return json.loads(text)
+    except ValueError:
+        # Warnings or progress lines around the document
+        start = min((index for index in (text.find('{'), text.find('[')) if index != -1), default=-1)
+        end = max(text.rfind('}'), text.rfind(']')) + 1
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end])
+
+def rtdb_safe(value: Any) -> Any:
+    """Copy of parsed JSON whose keys the Realtime Database accepts"""
+    if isinstance(value, dict):
+        return {(str(key).translate(RTDB_FORBIDDEN_KEY_CHARS) or '_'): rtdb_safe(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [rtdb_safe(item) for item in value]
+    return value
+
+
+class StreamingJSONFields:
+    """Incremental parser for the top-level fields of a JSON object arriving in chunks
+
+    feed() accepts arbitrary slices of the text. Each top-level field is decoded
+    as soon as its value is complete and passed to on_field. Text before the
+    opening brace, such as a ```json fence, is skipped.
+    """
+
+    def __init__(self, on_field: Callable[[str, Any], None] = None):
+        self.on_field = on_field
+        self.fields = {}
+        self.complete = False
+        self.failed = False
+        self._state = 'start'
+        self._token = []
+        self._key = None
+        self._escape = False
+        self._in_string = False
+        self._depth = 0
+
+    def feed(self, text: str):
+        for char in text:
+            if self.complete or self.failed:
+                return
+            self._step(char)
+
+    def _step(self, char: str):
+        state = self._state
+        if state == 'start':
+            if char == '{':
+                self._state = 'key'
+        elif state == 'key':
+            if char == '"':
+                self._state = 'key_string'
+                self._token = []
+            elif char == '}':
+                self.complete = True
+            elif not (char.isspace() or char == ','):
+                self.failed = True
+        elif state == 'key_string':
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._key = self._decode('"' + ''.join(self._token) + '"')
+                self._state = 'colon'
+                return
+            self._token.append(char)
+        elif state == 'colon':
+            if char == ':':
+                self._state = 'value'
+            elif not char.isspace():
+                self.failed = True
+        elif state == 'value':
+            if char.isspace():
+                return
+            self._token = [char]
+            self._depth = 1 if char in '{[' else 0
+            self._in_string = char == '"'
+            self._escape = False
+            self._state = 'value_body'
+        elif self._in_string:
+            self._token.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 0:
+                    self._finish_value()
+        elif self._depth == 0 and char in ',}':
+            # End of a number, true, false or null
+            self._finish_value()
+            if char == '}':
+                self.complete = True
+        else:
+            self._token.append(char)
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish_value()
+
+    def _decode(self, raw: str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            self.failed = True
+            return None
+
+    def _finish_value(self):
+        value = self._decode(''.join(self._token).strip())
+        self._token = []
+        self._state = 'key'
+        if self.failed:
+            return
+        self.fields[self._key] = value
+        if self.on_field:
+            self.on_field(self._key, value)
+
+
+class InflightGeneration:
+    """One code generation shared by every caller that asks for the same cache key"""
+
+    def __init__(self):
+        self.completion = Future()
+        self.parser = StreamingJSONFields(lambda name, value: self._notify())
+        self._changed = threading.Condition()
+        self.completion.add_done_callback(lambda future: self._notify())
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_for_fields(self, fields: tuple) -> bool:
+        """Block until fields have streamed in (True) or the generation is over (False)"""
+        with self._changed:
+            while True:
+                if self.completion.done():
+                    return False
+                if all(field in self.parser.fields for field in fields):
+                    return True
+                self._changed.wait()
+
+class CodeGenerationCache:
+    """LRU + TTL cache of parsed code_info, keyed on the normalized request,
+    the model and the system prompt, with an optional SQLite tier on disk.
+    Identical requests that miss while a generation is running wait for it.
+    Normalization only collapses whitespace: case and punctuation can change
+    the code (file names, paths, variables), so they are part of the key."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600, persist_path: str = None,
+                 logger: logging.Logger = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.logger = logger or logging.getLogger(__name__)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._disk = None
+        self.persist_path = None
+        if persist_path:
+            self.enable_persistence(persist_path)
+
+    @staticmethod
+    def normalize_request(user_request: str) -> str:
+        return ' '.join(user_request.split())
+
+    def make_key(self, user_request: str, model: str, system_prompt: str) -> str:
+        prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+        material = json.dumps([CODEGEN_KEY_VERSION, self.normalize_request(user_request), model, prompt_hash])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def enable_persistence(self, persist_path: str):
+        with self._lock:
+            self._disk = sqlite3.connect(persist_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS codegen_cache "
+                "(key TEXT PRIMARY KEY, created_at REAL NOT NULL, code_info TEXT NOT NULL)"
+            )
+            self._disk.execute("DELETE FROM codegen_cache WHERE created_at < ?",
+                               (time.time() - self.ttl_seconds,))
+            self._disk.commit()
+            self.persist_path = persist_path
+
+    def disable_persistence(self):
+        with self._lock:
+            if self._disk:
+                self._disk.close()
+            self._disk = None
+            self.persist_path = None
+
+    def get(self, key: str):
+        """Return a copy of the cached code_info, or None"""
+        with self._lock:
+            return self._get_locked(key)
+
+    def get_or_join(self, key: str) -> Tuple[Dict, InflightGeneration, bool]:
+        """Cached code_info, or the in-flight generation for key and whether the caller must run it"""
+        with self._lock:
+            cached = self._get_locked(key)
+            if cached is not None:
+                return cached, None, False
+            generation = self._inflight.get(key)
+            if generation:
+                self.coalesced += 1
+                return None, generation, False
+            generation = self._inflight[key] = InflightGeneration()
+            return None, generation, True
+
+    def finish_generation(self, key: str, generation: InflightGeneration):
+        """Called by the generating caller once the result is cached (or failed)"""
+        with self._lock:
+            if self._inflight.get(key) is generation:
+                del self._inflight[key]
+
+    def _get_locked(self, key: str):
+        # Caller holds self._lock
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry and now - entry[0] <= self.ttl_seconds:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+        if entry:
+            del self._entries[key]
+            self.evictions += 1
+        
+        if self._disk:
+            try:
+                row = self._disk.execute(
+                    "SELECT created_at, code_info FROM codegen_cache WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                self.logger.warning(f"Code cache read failed: {str(e)}")
+                row = None
+            if row and now - row[0] <= self.ttl_seconds:
+                code_info = json.loads(row[1])
+                self._store_in_memory(key, row[0], code_info)
+                self.hits += 1
+                self.disk_hits += 1
+                return copy.deepcopy(code_info)
+        
+        self.misses += 1
+        return None
+
+    def put(self, key: str, code_info: Dict, created_at: float = None, shared_hit: bool = False):
+        """Store code_info; shared_hit marks an entry loaded from the fleet-wide Firestore cache"""
+        created_at = created_at or time.time()
+        code_info = copy.deepcopy(code_info)
+        with self._lock:
+            if shared_hit:
+                self.shared_hits += 1
+            self._store_in_memory(key, created_at, code_info)
+            if self._disk:
+                try:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO codegen_cache (key, created_at, code_info) VALUES (?, ?, ?)",
+                        (key, created_at, json.dumps(code_info))
+                    )
+                    self._disk.commit()
+                except sqlite3.Error as e:
+                    self.logger.warning(f"Code cache write failed: {str(e)}")
+
+    def _store_in_memory(self, key: str, created_at: float, code_info: Dict):
+        # Caller holds self._lock
+        self._entries[key] = (created_at, code_info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._disk:
+                self._disk.execute("DELETE FROM codegen_cache")
+                self._disk.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'shared_hits': self.shared_hits,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._inflight),
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / lookups * 100) if lookups else 0,
+                'persist_path': self.persist_path
+            }
+
+EXPORT_OPTIONS = ('incremental', 'gzip', 'zstd', 'none')
+
+# Characters of NDJSON per Firestore export part, well under the 1 MiB document limit
+EXPORT_PART_CHARS = 200000
+
+def open_export_file(path: str, compression: str):
+    """Text-mode writer for an export file, optionally gzip or zstd compressed"""
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8')
+    if compression == 'zstd':
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, 'wb')), encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+# Session log retention: segment files kept per session (0 keeps all of them,
+# ZYNAPSE_SESSION_MAX_SEGMENTS overrides it) and distinct requests counted
+SESSION_MAX_SEGMENTS = 20
+SESSION_UNIQUE_REQUESTS_LIMIT = 10000
+
+class SessionStore:
+    """Session log kept as a bounded ring in memory and append-only JSONL segments on disk.
+
+    Counters are maintained incrementally so statistics never rescan the log.
+    Only this session's newest max_segments segment files are kept on disk (all
+    of them with 0); dropping one is logged, and later exports start after it.
+    unique_commands stops counting at unique_limit distinct requests.
+    """
+
+    def __init__(self, directory: str, session_name: str, memory_entries: int = 50,
+                 segment_max_bytes: int = 5 * 1024 * 1024, max_segments: int = SESSION_MAX_SEGMENTS,
+                 unique_limit: int = SESSION_UNIQUE_REQUESTS_LIMIT, logger: logging.Logger = None):
+        self.directory = directory
+        self.session_name = session_name
+        self.segment_max_bytes = segment_max_bytes
+        self.max_segments = max(0, max_segments)
+        self.unique_limit = max(1, unique_limit)
+        self.logger = logger or logging.getLogger(__name__)
+        self.recent = deque(maxlen=max(1, memory_entries))
+        self.total_count = 0
+        self.success_count = 0
+        self.dropped_segments = 0
+        self._request_digests = set()
+        self._segments = []
+        self._file = None
+        self._lock = threading.Lock()
+        
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                self.logger.error(f"Session store disabled, cannot create {directory}: {str(e)}")
+                self.directory = None
+
+    def append(self, entry: Dict):
+        request = entry.get('request') or ''
+        with self._lock:
+            self.total_count += 1
+            entry = dict(entry, seq=self.total_count)
+            self.recent.append(entry)
+            if entry.get('execution_success', False):
+                self.success_count += 1
+            if len(self._request_digests) < self.unique_limit:
+                self._request_digests.add(hashlib.sha1(request.encode('utf-8')).digest()[:8])
+            
+            if not self.directory:
+                return
+            try:
+                if not self._file or self._file.tell() >= self.segment_max_bytes:
+                    self._open_segment(entry['seq'])
+                self._file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+                self._file.flush()
+            except OSError as e:
+                self.logger.error(f"Failed to append session entry: {str(e)}")
+
+    def _open_segment(self, first_seq: int):
+        # Caller holds self._lock
+        if self._file:
+            self._file.close()
+        path = os.path.join(self.directory, f"{self.session_name}_{len(self._segments) + self.dropped_segments:04d}.jsonl")
+        self._file = open(path, 'a', encoding='utf-8')
+        self._segments.append((path, first_seq))
+        while self.max_segments and len(self._segments) > self.max_segments:
+            oldest, _ = self._segments.pop(0)
+            self.dropped_segments += 1
+            self.logger.warning(f"Session log over {self.max_segments} segments, deleting {oldest}")
+            try:
+                os.remove(oldest)
+            except OSError:
+                pass
+
+    def recent_requests(self, limit: int = 10):
+        with self._lock:
+            entries = list(self.recent)[-limit:]
+        return [entry.get('request') for entry in entries]
+
+    def iter_entries(self, since_seq: int = 0):
+        """Yield logged entries oldest first, reading the segments lazily.
+
+        Only entries with a sequence number above since_seq are returned.
+        """
+        with self._lock:
+            if not self.directory or not self._segments:
+                snapshot = None
+                recent = list(self.recent)
+            else:
+                if self._file:
+                    self._file.flush()
+                # Skip whole segments that end before since_seq
+                snapshot = [
+                    (path, os.path.getsize(path))
+                    for index, (path, first_seq) in enumerate(self._segments)
+                    if index + 1 >= len(self._segments) or self._segments[index + 1][1] > since_seq + 1
+                ]
+        
+        if snapshot is None:
+            yield from (entry for entry in recent if entry.get('seq', 0) > since_seq)
+            return
+        
+        for path, size in snapshot:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    read = 0
+                    for line in f:
+                        read += len(line.encode('utf-8'))
+                        if read > size:
+                            break
+                        entry = json.loads(line)
+                        if entry.get('seq', 0) > since_seq:
+                            yield entry
+            except FileNotFoundError:
+                continue
+            except ValueError as e:
+                self.logger.warning(f"Skipping corrupt session segment line in {path}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'total_commands': self.total_count,
+                'successful_executions': self.success_count,
+                'unique_commands': len(self._request_digests),
+                'unique_commands_capped': len(self._request_digests) >= self.unique_limit,
+                'in_memory': len(self.recent),
+                'segments': len(self._segments),
+                'dropped_segments': self.dropped_segments
+            }
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+# Fan-out commands: a controller writes one zynapse_broadcasts/{id} record, each
+# addressed device claims zynapse_broadcast_claims/{id}/{device_id} and keeps its
+# outcome there, and the counters are added to zynapse_broadcasts/{id}/shards/{n}
+# in Firestore. Devices spread over the shards, so no single document takes
+# every device's write and its size does not grow with the fleet
+BROADCASTS_PATH = 'zynapse_broadcasts'
+BROADCAST_CLAIMS_PATH = 'zynapse_broadcast_claims'
+BROADCAST_AGGREGATE_COLLECTION = 'zynapse_broadcasts'
+BROADCAST_SHARDS_COLLECTION = 'shards'
+BROADCAST_COUNTER_SHARDS = 10
+BROADCAST_MAX_AGE_SECONDS = 900
+# Agents download the whole zynapse_broadcasts tree when they connect, so the
+# archiver deletes broadcasts and their claims once they are this old
+BROADCAST_RETENTION_SECONDS = 3600
+BROADCAST_PRUNE_BATCH = 100
+BROADCAST_ENTRY_DATA_CHARS = 2000
+BROADCAST_ENTRY_OUTPUT_CHARS = 500
+
+def broadcast_matches(broadcast: Dict, device_id: str) -> bool:
+    """Whether an open, recent broadcast addresses device_id (every device when device_ids is absent)"""
+    if broadcast.get('status', 'open') != 'open' or not broadcast.get('command'):
+        return False
+    created_at = broadcast.get('created_at')
+    if isinstance(created_at, (int, float)) and time.time() - created_at / 1000 > BROADCAST_MAX_AGE_SECONDS:
+        return False
+    device_ids = broadcast.get('device_ids')
+    if isinstance(device_ids, dict):
+        # The Realtime Database returns sparse arrays as maps
+        device_ids = list(device_ids.values())
+    return not device_ids or device_id in device_ids
+
+def broadcast_shard(broadcast_id: str, device_id: str) -> Tuple[str, str]:
+    """Collection and document id of the counter shard a device adds to"""
+    shard = int(hashlib.sha1(device_id.encode('utf-8')).hexdigest(), 16) % BROADCAST_COUNTER_SHARDS
+    return f'{BROADCAST_AGGREGATE_COLLECTION}/{broadcast_id}/{BROADCAST_SHARDS_COLLECTION}', str(shard)
+
+def broadcast_reduction(result_data: Dict, data: Any = None) -> Tuple[Dict, Dict]:
+    """Claim-node entry and counter deltas of one device's broadcast result
+
+    The entry is a bounded summary for the device's claim node; numeric
+    top-level fields of structured data are summed under totals and counted
+    under totals_count, so fleet averages need no pass over the entries.
+    """
+    metrics = result_data.get('metrics') or {}
+    if result_data.get('cancelled'):
+        outcome = 'cancelled'
+    elif result_data.get('success'):
+        outcome = 'succeeded'
+    else:
+        outcome = 'failed'
+    entry = {
+        'outcome': outcome,
+        'execution_time': metrics.get('execution_time'),
+        'exit_code': metrics.get('exit_code')
+    }
+    counters = {'completed': 1, outcome: 1}
+    if isinstance(metrics.get('execution_time'), (int, float)):
+        counters['execution_seconds_total'] = metrics['execution_time']
+    
+    if data is None:
+        entry['output'] = (result_data.get('output') or '')[:BROADCAST_ENTRY_OUTPUT_CHARS]
+        return entry, counters
+    
+    data = rtdb_safe(data)
+    if len(json.dumps(data, separators=(',', ':'))) <= BROADCAST_ENTRY_DATA_CHARS:
+        entry['data'] = data
+    else:
+        entry['data_truncated'] = True
+    totals, totals_count = {}, {}
+    for row in (data if isinstance(data, list) else [data]):
+        if not isinstance(row, dict):
+            continue
+        for key, value in row.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                totals[key] = totals.get(key, 0) + value
+                totals_count[key] = totals_count.get(key, 0) + 1
+    if totals:
+        counters.update({'totals': totals, 'totals_count': totals_count})
+    return entry, counters
 
-try:
-    from google import genai
-    from google.genai import types
-    import firebase_admin
-    from firebase_admin import credentials, firestore, db
-except ImportError as e:
-    print("Missing required packages. Please install them using:")
-    print("pip install google-genai firebase-admin")
-    sys.exit(1)
+# Scheduled jobs keep the code generated for their request and re-run it
+# locally; each run becomes a compact sample, and samples reach Firestore in
+# batches, one zynapse_job_runs document per batch
+JOBS_FILE_TEMPLATE = 'zynapse_jobs_{device_id}.json'
+# The CLI keeps its device id in this file, so jobs and the command partition
+# survive restarts; ZYNAPSE_DEVICE_ID overrides it
+DEVICE_ID_FILE = 'zynapse_device_id'
+JOB_RUNS_COLLECTION = 'zynapse_job_runs'
+JOB_BATCH_SAMPLES = 50
+JOB_FLUSH_SECONDS = 60
+JOB_SAMPLE_OUTPUT_CHARS = 500
+JOB_MIN_INTERVAL_SECONDS = 10
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+CRON_FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# How far ahead a cron spec may first match: Feb 29 can be 8 years away (2096 -> 2104)
+CRON_SEARCH_DAYS = 8 * 366
+
+def load_device_id(path: str = DEVICE_ID_FILE) -> str:
+    """Device id saved in path, created and saved on first use"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            device_id = f.read().strip()
+        if device_id:
+            return device_id
+    except FileNotFoundError:
+        pass
+    device_id = str(uuid.uuid4())[:8]
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(device_id + '\n')
+    except OSError as e:
+        logging.getLogger(__name__).warning(f"Device id {device_id} not saved to {path}: {str(e)}")
+    return device_id
+
+def parse_cron_field(field: str, low: int, high: int) -> set:
+    """Values matched by one cron field: *, n, a-b, */n, a-b/n and comma lists"""
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Cron field out of range: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+@lru_cache(maxsize=256)
+def parse_schedule(spec: str) -> Callable[[float], float]:
+    """Next-run function for an interval ('30s', 'every 5m') or a 5-field cron spec in local time
+
+    Raises ValueError for specs that cannot be parsed. Parsed specs are cached,
+    so split_schedule and the job it creates validate a spec only once.
+    """
+    text = (spec or '').strip().lower()
+    if text.startswith('every '):
+        text = text[6:].strip()
+    
+    if text[:-1].isdigit() and text[-1:] in INTERVAL_UNITS:
+        seconds = int(text[:-1]) * INTERVAL_UNITS[text[-1]]
+        if seconds < JOB_MIN_INTERVAL_SECONDS:
+            raise ValueError(f"Interval must be at least {JOB_MIN_INTERVAL_SECONDS}s: {spec}")
+        return lambda after: after + seconds
+    
+    fields = text.split()
+    if len(fields) != 5:
+        raise ValueError(f"Unknown schedule: {spec} (use e.g. 'every 5m' or '*/15 * * * *')")
+    try:
+        minutes, hours, days, months, weekdays = (
+            parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELD_RANGES)
+        )
+    except ValueError as e:
+        raise ValueError(f"Invalid cron schedule: {spec} ({str(e)})")
+    if 7 in weekdays:
+        weekdays.add(0)
+    # Like cron: when both day fields are restricted, either one may match
+    any_day = fields[2] == '*' or fields[4] == '*'
+    hour_list, minute_list = sorted(hours), sorted(minutes)
+    
+    def next_run(after: float) -> float:
+        # Step field by field: to the next matching month, then day, hour and minute
+        moment = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=CRON_SEARCH_DAYS)
+        while moment < limit:
+            if moment.month not in months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            day_match = moment.day in days
+            weekday_match = moment.isoweekday() % 7 in weekdays
+            if not ((day_match and weekday_match) if any_day else (day_match or weekday_match)):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            hour = next((value for value in hour_list if value >= moment.hour), None)
+            if hour is None:
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if hour != moment.hour:
+                moment = moment.replace(hour=hour, minute=0)
+            minute = next((value for value in minute_list if value >= moment.minute), None)
+            if minute is None:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+                continue
+            return moment.replace(minute=minute).timestamp()
+        raise ValueError(f"Schedule never runs: {spec}")
+    
+    next_run(time.time())
+    return next_run
+
+def split_schedule(text: str) -> Tuple[str, str]:
+    """Split 'every 5m check disk' or '*/5 * * * * check disk' into schedule and request"""
+    tokens = text.split()
+    for count in (1, 2, 5):
+        spec = ' '.join(tokens[:count])
+        try:
+            parse_schedule(spec)
+        except ValueError:
+            continue
+        if len(tokens) > count:
+            return spec, ' '.join(tokens[count:])
+    raise ValueError("Usage: job add <'5m' | 'every 1h' | cron spec> <request>")
+
+def job_sample(success: bool, output: str, metrics: Dict) -> Dict[str, Any]:
+    """Compact time-series point for one job run; numeric output is kept as a value"""
+    text = (output or '').strip()
+    sample = {
+        't': metrics.get('start_time') or datetime.now().isoformat(),
+        'ok': bool(success),
+        'exit': metrics.get('exit_code'),
+        'dur': metrics.get('execution_time', 0)
+    }
+    try:
+        value = float(text)
+        if math.isfinite(value):
+            sample['value'] = value
+            return sample
+    except ValueError:
+        pass
+    if text[:1] in ('{', '[') and len(text) <= JOB_SAMPLE_OUTPUT_CHARS:
+        try:
+            sample['data'] = rtdb_safe(json.loads(text))
+            return sample
+        except ValueError:
+            pass
+    sample['out'] = text[:JOB_SAMPLE_OUTPUT_CHARS]
+    return sample
+
+class ScheduledJob:
+    """A request whose generated code re-runs on a schedule without calling Gemini"""
+
+    def __init__(self, job_id: str, request: str, schedule: str, code_info: Dict,
+                 command_id: str = None, enabled: bool = True, created_at: str = None,
+                 runs: int = 0, failures: int = 0, skipped: int = 0, last_run_at: str = None,
+                 last_sample: Dict = None):
+        self.job_id = job_id
+        self.request = request
+        self.schedule = schedule
+        self.next_run = parse_schedule(schedule)
+        self.code_info = code_info
+        self.command_id = command_id
+        self.enabled = enabled
+        self.created_at = created_at or datetime.now().isoformat()
+        self.runs = runs
+        self.failures = failures
+        self.skipped = skipped
+        self.last_run_at = last_run_at
+        self.last_sample = last_sample
+        self.next_run_at = None
+        # Ticket of the run in flight; a due run is skipped while it is active
+        self.active_ticket = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'request': self.request,
+            'schedule': self.schedule,
+            'code_info': self.code_info,
+            'command_id': self.command_id,
+            'enabled': self.enabled,
+            'created_at': self.created_at,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'last_run_at': self.last_run_at,
+            'last_sample': self.last_sample
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ScheduledJob':
+        return cls(**data)
+
+class JobScheduler:
+    """Queues due jobs as batch tickets on the CommandQueue and batches their samples
+
+    Runs missed while the agent was busy or offline are skipped, not caught
+    up. Job definitions are saved to persist_path whenever they change.
+    """
+
+    def __init__(self, command_queue: CommandQueue, make_ticket: Callable[[ScheduledJob], CommandTicket],
+                 flush: Callable[[ScheduledJob, list], None], persist_path: str = None,
+                 logger: logging.Logger = None):
+        self.command_queue = command_queue
+        self.make_ticket = make_ticket
+        self.flush = flush
+        self.persist_path = persist_path
+        self.logger = logger or logging.getLogger(__name__)
+        self.jobs = OrderedDict()
+        self.dispatched = 0
+        self.samples_flushed = 0
+        self.batches_flushed = 0
+        self._samples = {}
+        self._last_flush = time.monotonic()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def load(self) -> int:
+        """Restore saved jobs; returns how many were loaded"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return 0
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Failed to load scheduled jobs from {self.persist_path}: {str(e)}")
+            return 0
+        
+        loaded = 0
+        for data in saved.get('jobs', []):
+            try:
+                self.add(ScheduledJob.from_dict(data), save=False)
+                loaded += 1
+            except (TypeError, ValueError) as e:
+                self.logger.error(f"Skipping saved job {data.get('job_id')}: {str(e)}")
+        return loaded
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self._cond:
+            saved = {'jobs': [job.to_dict() for job in self.jobs.values()]}
+        try:
+            temp_path = self.persist_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, ensure_ascii=False, indent=2, default=str)
+            os.replace(temp_path, self.persist_path)
+        except OSError as e:
+            self.logger.error(f"Failed to save scheduled jobs to {self.persist_path}: {str(e)}")
+
+    def add(self, job: ScheduledJob, save: bool = True):
+        with self._cond:
+            job.next_run_at = job.next_run(time.time())
+            self.jobs[job.job_id] = job
+            self._samples.setdefault(job.job_id, [])
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="zynapse-jobs")
+                self._thread.start()
+            self._cond.notify_all()
+        if save:
+            self.save()
+
+    def remove(self, job_id: str) -> ScheduledJob:
+        """Delete a job and send its buffered samples; returns the job or None"""
+        with self._cond:
+            job = self.jobs.pop(job_id, None)
+            samples = self._samples.pop(job_id, [])
+        if job:
+            self._flush_samples(job, samples)
+            self.save()
+        return job
+
+    def find_by_command(self, command_id: str) -> ScheduledJob:
+        with self._cond:
+            return next((job for job in self.jobs.values() if job.command_id == command_id), None)
+
+    def set_enabled(self, job_ids: list, enabled: bool) -> int:
+        """Pause or resume jobs; returns how many changed"""
+        changed = 0
+        with self._cond:
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job and job.enabled != enabled:
+                    job.enabled = enabled
+                    job.next_run_at = job.next_run(time.time())
+                    changed += 1
+            self._cond.notify_all()
+        if changed:
+            self.save()
+        return changed
+
+    def run_now(self, job_id: str) -> bool:
+        """Start a job outside its schedule; False if unknown or still running"""
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if not job or self._is_active(job):
+                return False
+        self._dispatch(job)
+        return True
+
+    def record(self, job: ScheduledJob, ticket: CommandTicket, sample: Dict):
+        """Store the sample of a finished run"""
+        with self._cond:
+            if job.active_ticket is ticket:
+                job.active_ticket = None
+            job.runs += 1
+            if not sample.get('ok'):
+                job.failures += 1
+            job.last_run_at = sample['t']
+            job.last_sample = sample
+            samples = self._samples.get(job.job_id)
+            if samples is None:
+                # Removed while it was running
+                samples = [sample]
+                full = True
+            else:
+                samples.append(sample)
+                full = len(samples) >= JOB_BATCH_SAMPLES
+                if full:
+                    self._samples[job.job_id] = []
+        if full:
+            self._flush_samples(job, samples)
+
+    def flush_all(self):
+        """Send every buffered sample now"""
+        with self._cond:
+            pending = [(self.jobs[job_id], samples) for job_id, samples in self._samples.items()
+                       if samples and job_id in self.jobs]
+            for job_id in self._samples:
+                self._samples[job_id] = []
+            self._last_flush = time.monotonic()
+        for job, samples in pending:
+            self._flush_samples(job, samples)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'jobs': len(self.jobs),
+                'enabled': sum(1 for job in self.jobs.values() if job.enabled),
+                'runs_dispatched': self.dispatched,
+                'samples_buffered': sum(len(samples) for samples in self._samples.values()),
+                'samples_flushed': self.samples_flushed,
+                'batches_flushed': self.batches_flushed,
+                'persist_path': self.persist_path
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.flush_all()
+        if self.jobs:
+            self.save()
+
+    def _is_active(self, job: ScheduledJob) -> bool:
+        # Caller holds self._cond; a ticket cancelled while queued never reports back
+        return job.active_ticket is not None and not job.active_ticket.cancelled.is_set()
+
+    def _dispatch(self, job: ScheduledJob):
+        ticket = self.make_ticket(job)
+        with self._cond:
+            job.active_ticket = ticket
+            self.dispatched += 1
+        try:
+            self.command_queue.submit(ticket)
+        except (queue.Full, RuntimeError) as e:
+            self.logger.warning(f"Skipped a run of job {job.job_id}: {str(e)}")
+            with self._cond:
+                job.active_ticket = None
+                job.skipped += 1
+
+    def _flush_samples(self, job: ScheduledJob, samples: list):
+        if not samples:
+            return
+        try:
+            self.flush(job, samples)
+            with self._cond:
+                self.samples_flushed += len(samples)
+                self.batches_flushed += 1
+        except Exception as e:
+            self.logger.error(f"Failed to flush {len(samples)} samples of job {job.job_id}: {str(e)}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.time()
+                due = []
+                for job in self.jobs.values():
+                    if not job.enabled or job.next_run_at > now:
+                        continue
+                    if self._is_active(job):
+                        job.skipped += 1
+                    else:
+                        due.append(job)
+                    # Missed runs are dropped: the next run is computed from now
+                    job.next_run_at = job.next_run(now)
+                flush_due = time.monotonic() - self._last_flush >= JOB_FLUSH_SECONDS
+                if not due and not flush_due:
+                    next_due = min((job.next_run_at for job in self.jobs.values() if job.enabled), default=None)
+                    wait = JOB_FLUSH_SECONDS - (time.monotonic() - self._last_flush)
+                    if next_due is not None:
+                        wait = min(wait, next_due - now)
+                    self._cond.wait(timeout=max(0.05, wait))
+                    continue
+            
+            for job in due:
+                self._dispatch(job)
+            if flush_due:
+                self.flush_all()
 
 class ZynapseFirebase:
-    def __init__(self, api_key: str = None, firebase_config: Dict = None):
-        """Initialize ZYNAPSE CLI with Firebase Integration"""
+    def __init__(self, api_key: str = None, firebase_config: Dict = None,
+                 gemini_client=None, firestore_client=None, realtime_db=None,
+                 device_id: str = None, host: 'ZynapseHost' = None,
+                 connection_test: bool = True, defer_connect: bool = False,
+                 command_layout: str = 'partitioned'):
+        """Initialize ZYNAPSE CLI with Firebase Integration
+
+        gemini_client, firestore_client and realtime_db replace the Google
+        clients, e.g. with the offline stand-ins in zynapse_benchmark.py.
+        A device created by a ZynapseHost uses the host's worker pool, writers,
+        code cache and tracer, and receives commands from the host's listener.
+        With defer_connect the Gemini client and Firebase are set up in the
+        background once run() shows the prompt.
+        """
+        
+        if command_layout not in COMMAND_LAYOUTS:
+            raise ValueError(f"Unknown command layout: {command_layout}")
         
         # Initialize device ID first
-        self.device_id = str(uuid.uuid4())[:8]
+        self.device_id = device_id or str(uuid.uuid4())[:8]
+        self.host = host
         
         # Setup logging
         logging.basicConfig(
@@ -43,49 +2280,214 @@ class ZynapseFirebase:
         # Set API key for Gemini
         if api_key:
             os.environ["GEMINI_API_KEY"] = api_key
-        elif not os.environ.get("GEMINI_API_KEY"):
+        elif not os.environ.get("GEMINI_API_KEY") and gemini_client is None:
             raise ValueError("Gemini API key not provided")
         
-        # Initialize Gemini client
-        try:
-            self.client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
-            self.model = "gemini-2.0-flash-exp"
-            self.logger.info(f"Gemini client initialized with model: {self.model}")
-        except Exception as e:
-            raise ConnectionError(f"Failed to initialize Gemini client: {str(e)}")
+        # Gemini client (created by connect_services unless injected)
+        self.client = gemini_client
+        self.model = "gemini-2.0-flash-exp"
+        self.tools = None
+        self.generate_config = None
         
         # Configuration
-        self.command_history = []
-        self.session_log = []
         self.safety_mode = True
         self.timeout_seconds = 60
         self.session_start = datetime.now()
+        
+        # Status bucket this device is counted in on the fleet stats document
+        self.fleet_status = None
+        self.fleet_status_lock = threading.Lock()
+        
+        # Session log: recent entries in memory, the full log in JSONL segments on disk
+        self.session_store = SessionStore(
+            'zynapse_session_store',
+            f"{self.device_id}_{self.session_start.strftime('%Y%m%d_%H%M%S')}",
+            max_segments=int(os.environ.get("ZYNAPSE_SESSION_MAX_SEGMENTS", SESSION_MAX_SEGMENTS)),
+            logger=self.logger
+        )
+        self.last_export_seq = 0
         self.is_running = True
         self.firebase_listener_thread = None
         
-        # Initialize Firebase after device_id is set
-        self.init_firebase(firebase_config)
-        
-        # Tools configuration for Gemini
-        self.tools = [types.Tool(googleSearch=types.GoogleSearch())]
-        self.generate_config = types.GenerateContentConfig(
-            tools=self.tools,
-            temperature=0.1,
-            top_p=0.8,
-            top_k=40,
-            max_output_tokens=4096
+        # Command layout, one of COMMAND_LAYOUTS
+        self.command_layout = command_layout
+        self.command_listeners = []
+        # Bounded, insertion-ordered: command_id -> RTDB path, doubles as the seen set
+        self.command_paths = OrderedDict()
+        self.command_paths_lock = threading.Lock()
+        self.command_event_stats = {'claimed': 0, 'lost_claims': 0, 'ignored_events': 0}
+        
+        # Remote command execution engine
+        self.max_concurrent_commands = 2
+        self.max_queued_commands = 50
+        if host:
+            self.command_queue = host.command_queue
+        else:
+            self.command_queue = CommandQueue(self.max_concurrent_commands, self.max_queued_commands, self.logger)
+        self.active_processes = {}
+        self.process_lock = threading.Lock()
+        self.kill_grace_seconds = 3
+        
+        # Shell used for execution; ZYNAPSE_SHELL may point at pwsh or a
+        # stand-in such as bash to benchmark the host pool on Linux
+        self.shell_binary = os.environ.get("ZYNAPSE_SHELL") or ("powershell" if os.name == 'nt' else "pwsh")
+        self.shell_pool = None
+        self.shell_pool_size = 2
+        self.shell_host_max_commands = 100
+        self.shell_host_max_memory_growth_mb = 200
+        
+        # Live output streaming
+        self.stream_output = True
+        self.output_flush_interval = 0.5
+        self.max_output_chars = 1000000
+        
+        # Results older than result_archive_age_hours are archived every
+        # result_archive_interval seconds, keeping zynapse_results small
+        self.result_archive_age_hours = 24
+        self.result_archive_interval = 3600
+        self.result_archiver_thread = None
+        self.result_archiver_stop = threading.Event()
+        
+        # Remote commands start executing once code and safety_level have streamed in
+        self.early_execution = True
+        
+        # Structured mode asks for ConvertTo-Json output and stores it as typed data;
+        # remote commands can choose per command with output_format 'json' or 'text'
+        self.structured_output = False
+        
+        # Generated code cache (repeat requests skip the Gemini round-trip)
+        if host:
+            self.codegen_cache = host.codegen_cache
+        else:
+            self.codegen_cache = CodeGenerationCache(max_entries=256, ttl_seconds=3600, logger=self.logger)
+        self.codegen_cache_file = 'zynapse_codegen_cache.db'
+        self.shared_codegen_cache = True
+        
+        # Scheduled jobs re-run their stored code as batch tickets on the command queue
+        self.job_scheduler = JobScheduler(
+            self.command_queue, self._make_job_ticket, self._flush_job_samples,
+            persist_path=JOBS_FILE_TEMPLATE.format(device_id=self.device_id), logger=self.logger
         )
         
-        # Start Firebase listener if Firebase is connected
-        if self.db and self.rtdb:
+        # Result analysis: 'llm' always asks Gemini, 'heuristic' never does,
+        # 'hybrid' only escalates failed or ambiguous executions
+        self.analyzer_mode = 'hybrid'
+        self.phase_latency = {}
+        self.phase_latency_lock = threading.Lock()
+        
+        self.metrics_server = None
+        if host:
+            # Shared with the other devices served by the same host
+            self.tracer = host.tracer
+            self.background_writer = host.background_writer
+            self.analysis_executor = host.analysis_executor
+            self.status_writer = host.status_writer
+        else:
+            # Latency tracing: spans feed in-memory histograms, exported by the
+            # 'perf' command and optionally over HTTP (ZYNAPSE_METRICS_PORT)
+            self.tracer = Tracer()
+            self.tracer.register_gauge('zynapse_queued_commands', 'Remote commands waiting for a worker',
+                                       lambda: self.command_queue.stats()['queued'])
+            self.tracer.register_gauge('zynapse_running_commands', 'Remote commands being processed',
+                                       lambda: self.command_queue.stats()['running'])
+            self.tracer.register_gauge('zynapse_pending_writes', 'Firebase writes waiting in the background writer',
+                                       lambda: self.background_writer.pending.qsize())
+            if os.environ.get("ZYNAPSE_METRICS_PORT"):
+                self.set_metrics_server(int(os.environ["ZYNAPSE_METRICS_PORT"]))
+            
+            # Firestore writes and deferred analysis stay off the command critical path
+            self.background_writer = BackgroundWriter(logger=self.logger, tracer=self.tracer)
+            self.analysis_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="zynapse-analysis")
+            
+            # Device status updates are coalesced per document and committed in batches
+            self.status_writer = StatusWriter(lambda: self.db, debounce_seconds=0.5,
+                                              max_latency_seconds=2.0, logger=self.logger,
+                                              tracer=self.tracer)
+            atexit.register(self.status_writer.shutdown)
+        
+        # Gemini and Firebase connections, set up here or in the background
+        self.db = firestore_client
+        self.rtdb = realtime_db
+        self.firebase_config = firebase_config
+        self.firebase_injected = firestore_client is not None or realtime_db is not None
+        self.connection_test = connection_test
+        self.services_ready = threading.Event()
+        self.services_thread = None
+        self.services_lock = threading.Lock()
+        self.services_error = None
+        self.startup_timings = {'import': IMPORT_SECONDS}
+        
+        if not defer_connect:
+            self.connect_services()
+            if self.services_error:
+                self.set_metrics_server(None)
+                raise self.services_error
+        
+        print(f"🚀 ZYNAPSE CLI Firebase Ready! Device ID: {self.device_id}")
+        
+        restored_jobs = self.job_scheduler.load()
+        if restored_jobs:
+            print(f"⏰ Restored {restored_jobs} scheduled jobs from {self.job_scheduler.persist_path}")
+
+    def connect_services(self, announce_ready: bool = False):
+        """Create the Gemini client, connect to Firebase and start the command listener"""
+        try:
+            # An injected client (such as the benchmark's) is used as it is, without the SDK
+            if self.client is None:
+                import_genai()
+                self.client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+                self.logger.info(f"Gemini client initialized with model: {self.model}")
+                
+                # Tools configuration for Gemini
+                self.tools = [types.Tool(googleSearch=types.GoogleSearch())]
+                self.generate_config = types.GenerateContentConfig(
+                    tools=self.tools,
+                    temperature=0.1,
+                    top_p=0.8,
+                    top_k=40,
+                    max_output_tokens=4096
+                )
+        except Exception as e:
+            self.services_error = ConnectionError(f"Failed to initialize Gemini client: {str(e)}")
+            self.logger.error(str(self.services_error))
+        
+        if not self.firebase_injected:
+            self.init_firebase(self.firebase_config)
+        
+        # Start Firebase listener if Firebase is connected (a host listens for all its
+        # devices); after a failed setup nothing is left running in the background
+        if self.db and self.rtdb and not self.host and not self.services_error:
             self.firebase_listener_thread = threading.Thread(target=self.listen_for_commands, daemon=True)
             self.firebase_listener_thread.start()
+            self.start_result_archiver()
         
-        print(f"🚀 ZYNAPSE CLI Firebase Ready! Device ID: {self.device_id}")
+        self.startup_timings['connected'] = time.perf_counter() - STARTUP_STARTED
+        self.services_ready.set()
+        
+        if announce_ready:
+            if self.services_error:
+                print(f"\n❌ {self.services_error}")
+            self.send_status_to_firebase('ready', {'message': 'Device ready for commands'})
+
+    def start_services(self, announce_ready: bool = False):
+        """Connect in a background thread, at most once"""
+        with self.services_lock:
+            if self.services_ready.is_set() or self.services_thread:
+                return
+            self.services_thread = threading.Thread(target=self.connect_services, args=(announce_ready,),
+                                                    daemon=True, name="zynapse-connect")
+            self.services_thread.start()
+
+    def wait_for_services(self):
+        """Block until the Gemini client and Firebase are set up"""
+        self.start_services()
+        self.services_ready.wait()
 
     def init_firebase(self, firebase_config: Dict = None):
         """Initialize Firebase connection"""
         try:
+            import_firebase()
+            
             # Default Firebase config if not provided
             if not firebase_config:
                 # Try to load from file if exists
@@ -116,13 +2518,14 @@ class ZynapseFirebase:
             self.db = firestore.client()  # Firestore
             self.rtdb = db  # Realtime Database
             
-            # Test connection
-            test_doc = self.db.collection('zynapse_test').document('connection_test')
-            test_doc.set({
-                'timestamp': datetime.now().isoformat(),
-                'device_id': self.device_id,
-                'status': 'connected'
-            })
+            # Test connection (a blocking round-trip, skipped with --no-connection-test)
+            if self.connection_test:
+                test_doc = self.db.collection('zynapse_test').document('connection_test')
+                test_doc.set({
+                    'timestamp': datetime.now().isoformat(),
+                    'device_id': self.device_id,
+                    'status': 'connected'
+                })
             
             self.logger.info("Firebase connection established")
             
@@ -148,127 +2551,718 @@ class ZynapseFirebase:
                 'uptime_seconds': (datetime.now() - self.session_start).total_seconds(),
                 'safety_mode': self.safety_mode,
                 'timeout_seconds': self.timeout_seconds,
-                'total_commands': len(self.command_history)
+                'command_layout': self.command_layout,
+                'total_commands': self.session_store.total_count
             }
             
             if data:
                 status_data.update(data)
             
-            # Store in Firestore
-            self.db.collection('zynapse_devices').document(self.device_id).set(status_data, merge=True)
+            # Store in Firestore (coalesced with other pending updates for this device)
+            with self.tracer.span('send_status'):
+                self.status_writer.update('zynapse_devices', self.device_id, status_data)
+                
+                # Move this device from its previous status bucket to the new one. The
+                # bucket is saved on the device document, committed in the same batch
+                # as the counters, so a restarted agent leaves the one it was counted in
+                with self.fleet_status_lock:
+                    if self.fleet_status is None:
+                        self.fleet_status = self._stored_fleet_bucket()
+                    previous, self.fleet_status = self.fleet_status, status
+                if previous != status:
+                    devices_by_status = {status: 1}
+                    if previous:
+                        devices_by_status[previous] = -1
+                    self.status_writer.increment(FLEET_STATS_COLLECTION, FLEET_STATS_DOCUMENT,
+                                                 {'devices_by_status': devices_by_status})
+                    self.status_writer.update(FLEET_STATS_COLLECTION, FLEET_STATS_DOCUMENT,
+                                              {'updated_at': status_data['timestamp']})
+                    self.status_writer.update('zynapse_devices', self.device_id, {'fleet_bucket': status})
             
         except Exception as e:
             self.logger.error(f"Failed to send status to Firebase: {str(e)}")
 
+    def _stored_fleet_bucket(self) -> str:
+        """Status bucket this device was counted in before it started, if any"""
+        try:
+            snapshot = self.db.collection('zynapse_devices').document(self.device_id).get()
+            return (snapshot.to_dict() or {}).get('fleet_bucket') if snapshot.exists else None
+        except Exception as e:
+            self.logger.warning(f"Failed to read the stored status bucket: {str(e)}")
+            return None
+
     def listen_for_commands(self):
         """Listen for commands from Firebase Realtime Database"""
-        if not self.rtdb:
+        if not self.rtdb or self.host:
             return
-            
-        print("👂 Firebase command listener started")
         
-        def on_command_change(event):
-            """Handle new commands from Firebase"""
+        try:
+            # Partitioned layout: only this device's commands are sent to us
+            if self.command_layout == 'partitioned':
+                partition_ref = self.rtdb.reference(f'zynapse_commands/{self.device_id}')
+                self.command_listeners.append(
+                    partition_ref.listen(lambda event: self.on_command_event(event, 'partitioned'))
+                )
+            
+            # Legacy layout: the whole tree is streamed and filtered on device_id here.
+            # That stream already holds our partition, so migration reads both from it
+            # instead of downloading the partition a second time
+            if self.command_layout in ('legacy', 'migration'):
+                commands_ref = self.rtdb.reference('zynapse_commands')
+                self.command_listeners.append(commands_ref.listen(self.on_command_tree_event))
+            
+            # Fan-out commands addressed to the whole fleet or a list of devices. The
+            # Admin SDK listens to whole references only, not queries; the archiver
+            # keeps this tree to the last BROADCAST_RETENTION_SECONDS
+            self.command_listeners.append(self.rtdb.reference(BROADCASTS_PATH).listen(self.on_broadcast_event))
+            
+            print(f"👂 Firebase command listener started ({self.command_layout} layout)")
+            
+        except Exception as e:
+            self.logger.error(f"Failed to start Firebase listener: {str(e)}")
+
+    def stop_command_listeners(self):
+        """Close all RTDB command subscriptions"""
+        for registration in self.command_listeners:
             try:
-                if event.data and isinstance(event.data, dict):
-                    command_data = event.data
-                    
-                    # Check if this command is for our device
-                    if command_data.get('device_id') == self.device_id:
-                        if command_data.get('status') == 'pending':
-                            command_text = command_data.get('command', '')
-                            command_id = command_data.get('id', str(uuid.uuid4()))
-                            
-                            print(f"\n📨 Received Firebase command: {command_text}")
-                            
-                            # Mark command as processing
-                            self.rtdb.reference(f'zynapse_commands/{command_id}').update({
-                                'status': 'processing',
-                                'processed_at': datetime.now().isoformat()
-                            })
-                            
-                            # Process the command
-                            result = self.process_request(command_text, command_id=command_id)
-                            
-                            # Send result back to Firebase
-                            self.send_result_to_firebase(command_id, result)
-                            
+                registration.close()
             except Exception as e:
-                self.logger.error(f"Error processing Firebase command: {str(e)}")
+                self.logger.warning(f"Failed to close command listener: {str(e)}")
+        self.command_listeners = []
+
+    def is_listener_active(self) -> bool:
+        if self.host:
+            return self.device_id in self.host.command_listeners or self.host.legacy_listener is not None
+        return bool(self.command_listeners) or bool(
+            self.firebase_listener_thread and self.firebase_listener_thread.is_alive()
+        )
+
+    def on_command_tree_event(self, event):
+        """Legacy /{command_id} events, and in migration layout this device's partition"""
+        segments = [segment for segment in (event.path or '').split('/') if segment]
+        if segments and segments[0] == self.device_id:
+            if self.command_layout == 'migration':
+                for partition_event in partition_events(segments, event.data):
+                    self.on_command_event(partition_event, 'partitioned')
+            return
+        self.on_command_event(event, 'legacy')
+
+    def on_command_event(self, event, layout: str):
+        """Handle new commands from Firebase"""
+        try:
+            # The initial snapshot at '/' is history, not new commands
+            segments = [segment for segment in (event.path or '').split('/') if segment]
+            if len(segments) != 1 or not isinstance(event.data, dict):
+                return
+            
+            command_data = event.data
+            command_id = command_data.get('id') or segments[0]
+            
+            # Partitioned commands also surface in the legacy tree as nodes without a
+            # command; cancel patches there carry only a status, so those are matched
+            # against the commands we queued
+            status = command_data.get('status')
+            if layout == 'legacy' and command_data.get('device_id') != self.device_id and not (
+                    status == 'cancel_requested' and self.owns_command(command_id)):
+                return
+            
+            if status == 'cancel_requested':
+                self.cancel_command(command_id)
+                return
+            
+            # Our own queue, progress and result writes, and replays after a
+            # reconnect, come back through the listener; drop them here
+            if status != 'pending' or not self._remember_command(command_id, layout):
+                self._count_command_event('ignored_events')
+                return
+            
+            if not self.claim_command(command_id):
+                self._count_command_event('lost_claims')
+                return
+            
+            command_text = command_data.get('command', '')
+            if command_text.strip().upper() == EMERGENCY_STOP_COMMAND:
+                priority = 'emergency'
+            elif command_data.get('priority') in REMOTE_PRIORITIES:
+                priority = command_data['priority']
+            else:
+                priority = 'remote'
+            submitter = command_data.get('submitted_by') or command_data.get('sent_from')
+            
+            print(f"\n📨 Received Firebase command: {command_text}")
+            self.enqueue_command(command_id, command_text, priority, submitter,
+                                 schedule=command_data.get('schedule') or None,
+                                 structured={'json': True, 'text': False}.get(command_data.get('output_format')))
+                
+        except Exception as e:
+            self.logger.error(f"Error processing Firebase command: {str(e)}")
+
+    def owns_command(self, command_id: str) -> bool:
+        """True if this agent queued the command (its status node is remembered)"""
+        with self.command_paths_lock:
+            return command_id in self.command_paths
+
+    def _count_command_event(self, name: str):
+        """Bump a command_event_stats counter; events arrive on several listener threads"""
+        with self.command_paths_lock:
+            self.command_event_stats[name] += 1
+
+    def _remember_command(self, command_id: str, layout: str = None, path: str = None) -> bool:
+        """Record a command id and the node its status goes to; False if it was already seen"""
+        with self.command_paths_lock:
+            if command_id in self.command_paths:
+                return False
+            self.command_paths[command_id] = path or self._command_path(command_id, layout)
+            while len(self.command_paths) > SEEN_COMMANDS_LIMIT:
+                self.command_paths.popitem(last=False)
+            return True
+
+    def claim_command(self, command_id: str, claim_path: str = None) -> bool:
+        """Move a command from pending to queued with a transaction, so only one agent runs it
+
+        With claim_path (broadcasts) the claim is a new node there instead.
+        """
+        claim_id = uuid.uuid4().hex
+        
+        def claim(current):
+            if claim_path and current is None:
+                current = {'status': 'pending'}
+            if not isinstance(current, dict) or current.get('status') != 'pending':
+                return current
+            return {**current, 'status': 'queued', 'claimed_by': self.device_id,
+                    'claim_id': claim_id, 'queued_at': datetime.now().isoformat()}
+        
+        try:
+            command = self.rtdb.reference(claim_path or self._command_path(command_id)).transaction(claim)
+        except Exception as e:
+            self.logger.error(f"Failed to claim command {command_id}: {str(e)}")
+            # Forget it so a replayed event can try the claim again
+            with self.command_paths_lock:
+                self.command_paths.pop(command_id, None)
+            return False
         
+        claimed = isinstance(command, dict) and command.get('claim_id') == claim_id
+        if claimed:
+            self._count_command_event('claimed')
+        return claimed
+
+    def on_broadcast_event(self, event):
+        """Claim and queue fan-out commands addressed to this device"""
         try:
-            # Listen to command changes
-            commands_ref = self.rtdb.reference('zynapse_commands')
-            commands_ref.listen(on_command_change)
+            segments = [segment for segment in (event.path or '').split('/') if segment]
+            if not segments:
+                # Initial snapshot: broadcasts still open and recent when we connected
+                broadcasts = event.data.items() if isinstance(event.data, dict) else []
+            elif len(segments) == 1 and isinstance(event.data, dict):
+                broadcasts = [(segments[0], event.data)]
+            elif len(segments) == 2 and segments[1] == 'status':
+                broadcasts = [(segments[0], {'status': event.data})]
+            else:
+                return
             
+            for broadcast_id, broadcast in broadcasts:
+                if not isinstance(broadcast, dict):
+                    continue
+                command_id = f"{broadcast_id}_{self.device_id}"
+                if broadcast.get('status') == 'cancelled':
+                    self.cancel_command(command_id)
+                elif broadcast_matches(broadcast, self.device_id):
+                    self.accept_broadcast(broadcast_id, command_id, broadcast)
         except Exception as e:
-            self.logger.error(f"Failed to start Firebase listener: {str(e)}")
+            self.logger.error(f"Error processing Firebase broadcast: {str(e)}")
+
+    def accept_broadcast(self, broadcast_id: str, command_id: str, broadcast: Dict):
+        """Claim this device's share of a broadcast and queue it like a remote command"""
+        claim_path = f'{BROADCAST_CLAIMS_PATH}/{broadcast_id}/{self.device_id}'
+        # Status, result summary and cancel writes for this command go to the claim node
+        if not self._remember_command(command_id, path=claim_path):
+            self._count_command_event('ignored_events')
+            return
+        if not self.claim_command(command_id, claim_path):
+            self._count_command_event('lost_claims')
+            return
+        self._add_to_broadcast(broadcast_id, {'claimed': 1})
+        
+        command_text = broadcast['command']
+        if command_text.strip().upper() == EMERGENCY_STOP_COMMAND:
+            priority, handler = 'emergency', self._run_emergency_stop
+        else:
+            priority = broadcast['priority'] if broadcast.get('priority') in REMOTE_PRIORITIES else 'remote'
+            handler = self._run_queued_command
+        ticket = CommandTicket(
+            command_id, command_text, handler, source='broadcast', priority=priority,
+            submitter=broadcast.get('submitted_by') or broadcast.get('sent_from'), owner=self.device_id,
+            structured={'json': True, 'text': False}.get(broadcast.get('output_format')),
+            broadcast_id=broadcast_id
+        )
+        
+        print(f"\n📡 Received broadcast {broadcast_id}: {command_text}")
+        try:
+            self.command_queue.submit(ticket)
+        except queue.Full as e:
+            self.logger.warning(f"Rejected broadcast {broadcast_id}: {str(e)}")
+            self.rtdb.reference(claim_path).update({
+                'status': 'rejected',
+                'reason': str(e),
+                'rejected_at': datetime.now().isoformat()
+            })
+            self._add_to_broadcast(broadcast_id, {'completed': 1, 'rejected': 1})
+
+    def _command_path(self, command_id: str, layout: str = None) -> str:
+        """RTDB path of a command node in the given (or remembered) layout"""
+        if layout is None:
+            if command_id in self.command_paths:
+                return self.command_paths[command_id]
+            layout = 'legacy' if self.command_layout == 'legacy' else 'partitioned'
+        
+        if layout == 'partitioned':
+            return f'zynapse_commands/{self.device_id}/{command_id}'
+        return f'zynapse_commands/{command_id}'
+
+    def set_command_layout(self, layout: str):
+        """Switch command layout and re-subscribe"""
+        if layout not in COMMAND_LAYOUTS:
+            raise ValueError(f"Unknown command layout: {layout}")
+        
+        self.command_layout = layout
+        if self.rtdb:
+            self.stop_command_listeners()
+            self.listen_for_commands()
+
+    def enqueue_command(self, command_id: str, command_text: str, priority: str = 'remote',
+                        submitter: str = None, schedule: str = None, structured: bool = None):
+        """Hand a remote command to the scheduler and report its queue state"""
+        command_ref = self.rtdb.reference(self._command_path(command_id))
+        handler = self._run_emergency_stop if priority == 'emergency' else self._run_queued_command
+        ticket = CommandTicket(command_id, command_text, handler, priority=priority,
+                               submitter=submitter, owner=self.device_id, schedule=schedule,
+                               structured=structured)
+        
+        try:
+            if schedule:
+                parse_schedule(schedule)
+            position = self.command_queue.submit(ticket)
+        except (queue.Full, ValueError) as e:
+            self.logger.warning(f"Rejected command {command_id}: {str(e)}")
+            command_ref.update({
+                'status': 'rejected',
+                'reason': str(e),
+                'rejected_at': datetime.now().isoformat()
+            })
+            return
+        if priority == 'emergency':
+            return
+        
+        # Backpressure signal for the console: the command is accepted but waiting for a worker
+        command_ref.update({
+            'queue_position': position,
+            'queue_depth': self.command_queue.stats()['queued']
+        })
+
+    def _run_queued_command(self, ticket: CommandTicket):
+        """Worker entry point for a queued remote command"""
+        if ticket.cancelled.is_set():
+            return
+        
+        self.tracer.observe('queue_wait', ticket.started_at - ticket.enqueued_at)
+        command_ref = self.rtdb.reference(self._command_path(ticket.command_id))
+        command_ref.update({
+            'status': 'processing',
+            'processed_at': datetime.now().isoformat(),
+            'queue_wait_seconds': round(ticket.started_at - ticket.enqueued_at, 3)
+        })
+        
+        result = self.process_request(ticket.command_text, command_id=ticket.command_id, defer_analysis=True,
+                                      structured=ticket.structured)
+        
+        if ticket.cancelled.is_set():
+            result['cancelled'] = True
+        
+        # Send the execution result now; the analysis follows when it is ready
+        analysis_future = result.pop('analysis_future', None)
+        self.send_result_to_firebase(ticket.command_id, result, broadcast_id=ticket.broadcast_id)
+        if analysis_future:
+            analysis_future.add_done_callback(
+                lambda future: self.send_analysis_to_firebase(ticket.command_id, future)
+            )
+        
+        if ticket.schedule and not result.get('cancelled'):
+            try:
+                job = self.create_job(ticket.command_text, ticket.schedule, result.get('code_info'),
+                                      command_id=ticket.command_id)
+                command_ref.update({
+                    'job_id': job.job_id,
+                    'schedule': job.schedule,
+                    'next_run_at': datetime.fromtimestamp(job.next_run_at).isoformat()
+                })
+            except ValueError as e:
+                print(f"❌ Not scheduled: {str(e)}")
+                command_ref.update({'schedule_error': str(e)})
+
+    def _run_emergency_stop(self, ticket: CommandTicket):
+        """Scheduler entry point for EMERGENCY_STOP; runs without waiting for a worker"""
+        start = time.monotonic()
+        stopped = self.emergency_stop(exclude=ticket.command_id)
+        self.send_result_to_firebase(ticket.command_id, broadcast_id=ticket.broadcast_id, result={
+            'success': True,
+            'execution_success': True,
+            'output': (f"Emergency stop: cancelled {stopped['queued']} queued commands, "
+                       f"killed {stopped['processes']} running processes"),
+            'code_info': {'code': EMERGENCY_STOP_COMMAND, 'safety_level': 'SAFE',
+                          'explanation': 'Cancel queued commands and kill running ones'},
+            'metrics': {'execution_time': round(time.monotonic() - start, 3), 'exit_code': 0}
+        })
+
+    def emergency_stop(self, exclude: str = None) -> Dict[str, int]:
+        """Pause scheduled jobs, cancel this device's queued commands and kill every process it is running"""
+        paused_jobs = self.job_scheduler.set_enabled(list(self.job_scheduler.jobs), False)
+        queued, running = self.command_queue.cancel_matching(
+            lambda ticket: ticket.owner == self.device_id and ticket.command_id != exclude
+        )
+        with self.process_lock:
+            processes = list(self.active_processes.values())
+        for process in processes:
+            self.terminate_process_tree(process, grace_seconds=0)
+        
+        if self.rtdb:
+            for ticket in queued:
+                if ticket.source == 'job':
+                    continue
+                try:
+                    self.rtdb.reference(self._command_path(ticket.command_id)).update({
+                        'status': 'cancelled',
+                        'cancelled_at': datetime.now().isoformat(),
+                        'reason': EMERGENCY_STOP_COMMAND
+                    })
+                except Exception as e:
+                    self.logger.error(f"Failed to mark {ticket.command_id} cancelled: {str(e)}")
+        for ticket in queued:
+            self._count_cancelled_broadcast(ticket)
+        
+        print(f"🛑 Emergency stop: {len(queued)} queued commands cancelled, "
+              f"{len(running)} running commands stopped ({len(processes)} processes killed)")
+        if paused_jobs:
+            print(f"⏸️ {paused_jobs} scheduled jobs paused ('job resume all' to restart them)")
+        self.send_status_to_firebase('ready', {'message': 'Emergency stop executed'})
+        return {'queued': len(queued), 'running': len(running), 'processes': len(processes),
+                'jobs_paused': paused_jobs}
+
+    def _run_interactive_command(self, ticket: CommandTicket):
+        result = self.process_request(ticket.command_text)
+        if ticket.schedule and not result.get('cancelled'):
+            try:
+                self.create_job(ticket.command_text, ticket.schedule, result.get('code_info'))
+            except ValueError as e:
+                print(f"❌ Not scheduled: {str(e)}")
+
+    def create_job(self, request: str, schedule: str, code_info: Dict, command_id: str = None) -> ScheduledJob:
+        """Schedule the code generated for a request; raises ValueError if it cannot run unattended"""
+        code = (code_info or {}).get('code') or ''
+        if not code or code.startswith('Error:'):
+            raise ValueError("no code was generated for this request")
+        # Scheduled runs have nobody to confirm them, so DANGEROUS code is never scheduled
+        safety_level = code_info.get('safety_level')
+        if safety_level not in ('SAFE', 'CAUTION'):
+            raise ValueError(f"{safety_level or 'unclassified'} code cannot run on a schedule")
+        
+        job = ScheduledJob(
+            f"job_{uuid.uuid4().hex[:8]}", request, schedule,
+            {key: code_info.get(key) for key in ('code', 'safety_level', 'explanation')},
+            command_id=command_id
+        )
+        self.job_scheduler.add(job)
+        print(f"⏰ Scheduled {job.job_id} ({job.schedule}): {request}")
+        print(f"   Next run: {datetime.fromtimestamp(job.next_run_at).strftime('%Y-%m-%d %H:%M:%S')}")
+        return job
+
+    def remove_job(self, job_id: str) -> bool:
+        job = self.job_scheduler.remove(job_id)
+        if not job:
+            return False
+        print(f"🗑️ Removed scheduled job {job_id}: {job.request}")
+        if job.command_id and self.rtdb:
+            try:
+                self.rtdb.reference(self._command_path(job.command_id)).update({
+                    'status': 'cancelled',
+                    'job_removed_at': datetime.now().isoformat()
+                })
+            except Exception as e:
+                self.logger.error(f"Failed to mark job command {job.command_id} cancelled: {str(e)}")
+        return True
+
+    def _make_job_ticket(self, job: ScheduledJob) -> CommandTicket:
+        return CommandTicket(
+            f"{job.job_id}_{uuid.uuid4().hex[:6]}", job.request,
+            lambda ticket: self._run_job(job, ticket),
+            source='job', priority='batch', submitter=job.job_id, owner=self.device_id
+        )
+
+    def _run_job(self, job: ScheduledJob, ticket: CommandTicket):
+        """Worker entry point for a scheduled run: the stored code, no Gemini call, no result record"""
+        if ticket.cancelled.is_set():
+            return
+        success, output, metrics = self.execute_powershell_with_monitoring(
+            job.code_info.get('code', ''), process_key=ticket.command_id, echo=False
+        )
+        self.tracer.observe('job_run', metrics.get('execution_time', 0), failed=not success)
+        self.job_scheduler.record(job, ticket, job_sample(success, output, metrics))
+
+    def _flush_job_samples(self, job: ScheduledJob, samples: list):
+        """Queue one zynapse_job_runs document holding a batch of samples"""
+        if not self.db:
+            raise RuntimeError("Firestore not connected")
+        document = self.db.collection(JOB_RUNS_COLLECTION).document(
+            f"{self.device_id}_{job.job_id}_{uuid.uuid4().hex[:8]}"
+        )
+        self.background_writer.submit("firestore_job_runs", document.set, {
+            'device_id': self.device_id,
+            'job_id': job.job_id,
+            'request': job.request,
+            'schedule': job.schedule,
+            'command_id': job.command_id,
+            'first_at': samples[0]['t'],
+            'last_at': samples[-1]['t'],
+            'count': len(samples),
+            'failures': sum(1 for sample in samples if not sample['ok']),
+            'samples': samples
+        })
+
+    def cancel_command(self, command_id: str) -> bool:
+        """Cancel a queued command, kill the process of a running one, or remove a scheduled job"""
+        if not command_id:
+            return False
+        
+        job = self.job_scheduler.find_by_command(command_id) or self.job_scheduler.jobs.get(command_id)
+        if job:
+            return self.remove_job(job.job_id)
+        
+        ticket, was_queued = self.command_queue.cancel(command_id)
+        if not ticket:
+            return False
+        
+        if was_queued:
+            print(f"🚫 Cancelled queued command: {command_id}")
+            if self.rtdb:
+                self.rtdb.reference(self._command_path(command_id)).update({
+                    'status': 'cancelled',
+                    'cancelled_at': datetime.now().isoformat()
+                })
+            self._count_cancelled_broadcast(ticket)
+            return True
+        
+        with self.process_lock:
+            process = self.active_processes.get(command_id)
+        if process:
+            self.terminate_process_tree(process, grace_seconds=0)
+        print(f"🚫 Cancelled running command: {command_id}")
+        return True
 
-    def send_result_to_firebase(self, command_id: str, result: Dict):
-        """Send command result back to Firebase"""
+    def _count_cancelled_broadcast(self, ticket: CommandTicket):
+        """A broadcast ticket cancelled before it ran still completes the device's share"""
+        if ticket.broadcast_id:
+            self._add_to_broadcast(ticket.broadcast_id, {'completed': 1, 'cancelled': 1})
+    
+    def _add_to_broadcast(self, broadcast_id: str, counters: Dict):
+        """Add counter deltas to this device's shard of a broadcast aggregate"""
+        collection, shard = broadcast_shard(broadcast_id, self.device_id)
+        self.status_writer.increment(collection, shard, counters)
+        self.status_writer.update(collection, shard, {'updated_at': datetime.now().isoformat()})
+
+    def send_result_to_firebase(self, command_id: str, result: Dict, broadcast_id: str = None):
+        """Send command result back to Firebase, adding it to its broadcast's aggregate"""
         if not self.rtdb:
             return
             
+        start = time.monotonic()
         try:
+            result_ref = f'zynapse_results/{command_id}'
+            output = result.get('output', '') or ''
             result_data = {
                 'command_id': command_id,
                 'device_id': self.device_id,
-                'status': 'completed',
+                'status': 'cancelled' if result.get('cancelled') else 'completed',
                 'completed_at': datetime.now().isoformat(),
                 'success': result.get('success', False),
+                'cancelled': result.get('cancelled', False),
                 'execution_success': result.get('execution_success', False),
-                'output': result.get('output', ''),
+                'output': output,
                 'code_info': result.get('code_info', {}),
                 'metrics': result.get('metrics', {}),
-                'analysis': result.get('analysis', {})
+                'analysis': result.get('analysis', {}),
+                'analysis_pending': result.get('analysis_pending', False)
             }
             
-            # Update command status
-            self.rtdb.reference(f'zynapse_commands/{command_id}').update(result_data)
+            # Structured results carry the parsed value; the JSON text is only
+            # kept when the value is too large to store inline
+            if result.get('data') is not None and len(output) <= RESULT_INLINE_OUTPUT_CHARS:
+                result_data.update({'data': rtdb_safe(result['data']), 'output': '', 'output_format': 'json'})
+            
+            # Lets the web interface page through one device's results by time
+            result_data['device_completed_at'] = f"{self.device_id}|{result_data['completed_at']}"
+            
+            # Large outputs: a preview inline, the full text fetched on demand
+            if len(output) > RESULT_INLINE_OUTPUT_CHARS:
+                blob_ref = f'{RESULT_BLOBS_PATH}/{command_id}'
+                self.rtdb.reference(blob_ref).set(encode_output_blob(output))
+                result_data.update({
+                    'output': output[:RESULT_INLINE_OUTPUT_CHARS],
+                    'output_truncated': True,
+                    'output_size': len(output),
+                    'output_ref': blob_ref
+                })
+            
+            # The command node only needs the outcome and where to find the result
+            command_summary = {key: result_data[key] for key in ('status', 'completed_at', 'success', 'cancelled',
+                                                                 'execution_success', 'analysis_pending')}
+            command_summary['result_ref'] = result_ref
+            # A broadcast's claim node also holds the device's entry for the console's table
+            counters = None
+            if broadcast_id:
+                entry, counters = broadcast_reduction(result_data, result.get('data'))
+                command_summary.update(entry)
+            self.rtdb.reference(self._command_path(command_id)).update(command_summary)
             
-            # Also store in results collection for history
-            self.rtdb.reference(f'zynapse_results/{command_id}').set(result_data)
+            self.rtdb.reference(result_ref).set(result_data)
+            self.count_result(result_data)
+            if counters:
+                self._add_to_broadcast(broadcast_id, counters)
             
             print(f"📤 Result sent to Firebase for command: {command_id}")
             
+            # The result now holds the output; replace the live chunks with a stub
+            if self.stream_output:
+                self.rtdb.reference(f'zynapse_output/{command_id}').set({
+                    'status': 'compacted',
+                    'result_ref': f'zynapse_results/{command_id}',
+                    'compacted_at': datetime.now().isoformat()
+                })
+            self.tracer.observe('send_result', time.monotonic() - start)
+            
         except Exception as e:
+            self.tracer.observe('send_result', time.monotonic() - start, failed=True)
             self.logger.error(f"Failed to send result to Firebase: {str(e)}")
 
-    def call_gemini_api(self, prompt: str, system_instruction: str = None) -> str:
-        """Call Gemini API"""
+    def count_result(self, result_data: Dict):
+        """Add a sent result to the fleet command counters"""
+        if not self.db:
+            return
+        
+        if result_data['cancelled']:
+            outcome = 'commands_cancelled'
+        elif result_data['success']:
+            outcome = 'commands_successful'
+        else:
+            outcome = 'commands_failed'
+        counters = {'commands_total': 1, outcome: 1}
+        execution_time = (result_data.get('metrics') or {}).get('execution_time')
+        if isinstance(execution_time, (int, float)):
+            counters['execution_seconds_total'] = execution_time
+        self.status_writer.increment(FLEET_STATS_COLLECTION, FLEET_STATS_DOCUMENT, counters)
+        self.status_writer.update(FLEET_STATS_COLLECTION, FLEET_STATS_DOCUMENT,
+                                  {'updated_at': result_data['completed_at']})
+
+    def session_summary(self, session_entry: Dict) -> Dict[str, Any]:
+        """zynapse_sessions form of a session entry
+        
+        Remote commands already have their full record in zynapse_results, so
+        only a summary and a reference are stored. Local commands keep the
+        details with the output capped at the inline limit.
+        """
+        code_info = session_entry.get('code_info') or {}
+        metrics = session_entry.get('metrics') or {}
+        analysis = session_entry.get('analysis') or {}
+        command_id = session_entry.get('command_id')
+        if command_id and self.rtdb:
+            return {
+                'timestamp': session_entry['timestamp'],
+                'request': session_entry['request'],
+                'command_id': command_id,
+                'device_id': session_entry['device_id'],
+                'execution_success': session_entry['execution_success'],
+                'request_fulfilled': analysis.get('request_fulfilled', False),
+                'safety_level': code_info.get('safety_level'),
+                'execution_time': metrics.get('execution_time'),
+                'result_ref': f'zynapse_results/{command_id}'
+            }
+        
+        output = session_entry.get('output') or ''
+        summary = dict(session_entry, output=output[:RESULT_INLINE_OUTPUT_CHARS])
+        if len(output) > RESULT_INLINE_OUTPUT_CHARS:
+            summary.update({'output_truncated': True, 'output_size': len(output)})
+        return summary
+
+    def send_analysis_to_firebase(self, command_id: str, analysis_future: Future):
+        """Attach a deferred analysis to a result that was already sent"""
+        if not self.rtdb:
+            return
+        
         try:
-            contents = []
-            
-            if system_instruction:
-                contents.append(types.Content(
-                    role="user",
-                    parts=[types.Part.from_text(text=f"System: {system_instruction}\n\nUser: {prompt}")]
-                ))
-            else:
-                contents.append(types.Content(
-                    role="user",
-                    parts=[types.Part.from_text(text=prompt)]
-                ))
+            result = analysis_future.result()
+            analysis_data = {
+                'success': result.get('success', False),
+                'analysis': result.get('analysis', {}),
+                'metrics': result.get('metrics', {}),
+                'analysis_pending': False
+            }
+        except Exception as e:
+            self.logger.error(f"Deferred analysis failed for {command_id}: {str(e)}")
+            analysis_data = {'analysis_pending': False, 'analysis_error': str(e)}
+        
+        # Runs on the analysis thread, so the writes do not wait behind the writer backlog
+        try:
+            self.rtdb.reference(self._command_path(command_id)).update({
+                key: value for key, value in analysis_data.items() if key not in ('analysis', 'metrics')
+            })
+            self.rtdb.reference(f'zynapse_results/{command_id}').update(analysis_data)
+        except Exception as e:
+            self.logger.error(f"Failed to send analysis to Firebase: {str(e)}")
+
+    def call_gemini_api(self, prompt: str, system_instruction: str = None,
+                        on_text: Callable[[str], None] = None) -> str:
+        """Call Gemini API; on_text receives each streamed chunk as it arrives"""
+        start = time.monotonic()
+        try:
+            self.wait_for_services()
+            if self.client is None:
+                raise self.services_error or ConnectionError("Gemini client not initialized")
+            # Content as a plain dict, which the SDK accepts, so injected clients need no SDK types
+            text = f"System: {system_instruction}\n\nUser: {prompt}" if system_instruction else prompt
+            contents = [{'role': 'user', 'parts': [{'text': text}]}]
             
             print("🤖 Processing with AI...")
-            response_text = ""
+            response_parts = []
+            first_chunk = True
             
             for chunk in self.client.models.generate_content_stream(
                 model=self.model,
                 contents=contents,
                 config=self.generate_config,
             ):
+                if first_chunk:
+                    self.tracer.observe('gemini_first_chunk', time.monotonic() - start)
+                    first_chunk = False
                 if chunk.text:
-                    response_text += chunk.text
+                    response_parts.append(chunk.text)
+                    if on_text:
+                        on_text(chunk.text)
             
-            return response_text.strip()
+            self.tracer.observe('gemini_call', time.monotonic() - start)
+            return ''.join(response_parts).strip()
             
         except Exception as e:
+            self.tracer.observe('gemini_call', time.monotonic() - start, failed=True)
             self.logger.error(f"Error calling Gemini API: {str(e)}")
             return f"Error: Failed to get response from Gemini - {str(e)}"
 
-    def generate_powershell_code(self, user_request: str, context: Dict = None) -> Dict[str, str]:
-        """Generate PowerShell code with enhanced prompting"""
+    def generate_powershell_code(self, user_request: str, context: Dict = None,
+                                 early_fields: tuple = None, structured: bool = False) -> Dict[str, str]:
+        """Generate PowerShell code with enhanced prompting
+        
+        With early_fields the call returns as soon as those fields have streamed
+        in. The returned dict then holds only them plus a 'completion' future
+        that resolves to the full code info (see complete_code_info).
+        With structured the code is asked to print a single JSON document.
+        """
         
         system_instruction = """
 You are ZYNAPSE AI, an expert PowerShell developer and system administrator with deep knowledge of Windows systems.
@@ -289,6 +3283,9 @@ Safety Levels:
 - DANGEROUS: High risk operation
 - BLOCKED: Should not be executed
 """
+        if structured:
+            # Part of the cache key too, so text and JSON code are cached apart
+            system_instruction += STRUCTURED_OUTPUT_INSTRUCTION
 
         context_info = ""
         if context:
@@ -308,11 +3305,107 @@ Return ONLY valid JSON in this exact format:
 }}
 """
 
-        print("📝 Generating PowerShell code...")
-        response = self.call_gemini_api(prompt, system_instruction)
+        # The context only carries per-call ids and timestamps, so it is left out of the key
+        cache_key = self.codegen_cache.make_key(user_request, self.model, system_instruction)
+        cached, generation, leader = self.codegen_cache.get_or_join(cache_key)
+        if cached:
+            print("⚡ Using cached PowerShell code")
+            cached['cached'] = True
+            return cached
+        
+        # Identical requests share one generation instead of each calling Gemini
+        if leader:
+            print("📝 Generating PowerShell code...")
+            if not early_fields:
+                self._run_generation(generation, prompt, system_instruction, cache_key)
+                return copy.deepcopy(generation.completion.result())
+            threading.Thread(target=self._run_generation, daemon=True, name="zynapse-codegen",
+                             args=(generation, prompt, system_instruction, cache_key)).start()
+        else:
+            print("⏳ Waiting for an identical request that is already generating...")
+        
+        start = time.monotonic()
+        if not early_fields or not generation.wait_for_fields(early_fields):
+            return copy.deepcopy(generation.completion.result())
+        self.tracer.observe('codegen_early_fields', time.monotonic() - start)
+        code_info = {field: generation.parser.fields[field] for field in early_fields}
+        code_info['completion'] = generation.completion
+        print(f"⚡ Code ready after {time.monotonic() - start:.2f}s "
+              f"(safety: {code_info.get('safety_level')}), Gemini is still writing the details")
+        return code_info
+
+    def complete_code_info(self, code_info: Dict) -> Dict:
+        """Wait for the fields still streaming after an early return from generate_powershell_code"""
+        completion = code_info.get('completion') if code_info else None
+        if completion is None:
+            return code_info
+        return copy.deepcopy(completion.result())
+
+    def _run_generation(self, generation: InflightGeneration, prompt: str, system_instruction: str,
+                        cache_key: str):
+        """Resolve a shared generation from the fleet cache or from Gemini"""
+        try:
+            code_info = self._load_shared_code(cache_key)
+            if code_info is None:
+                code_info = self._generate_code(prompt, system_instruction, cache_key, generation.parser)
+            generation.completion.set_result(code_info)
+        except Exception as e:
+            generation.completion.set_exception(e)
+        finally:
+            self.codegen_cache.finish_generation(cache_key, generation)
+
+    def _load_shared_code(self, cache_key: str):
+        """Code another device generated for the same key, if still fresh"""
+        if not self.db or not self.shared_codegen_cache:
+            return None
+        start = time.monotonic()
+        try:
+            doc = self.db.collection(CODEGEN_SHARED_COLLECTION).document(cache_key).get()
+        except Exception as e:
+            self.tracer.observe('firestore_codegen_read', time.monotonic() - start, failed=True)
+            self.logger.warning(f"Shared code cache read failed: {str(e)}")
+            return None
+        self.tracer.observe('firestore_codegen_read', time.monotonic() - start)
+        
+        entry = doc.to_dict() if doc.exists else None
+        if not entry or entry.get('expires_at', 0) <= time.time() or not entry.get('code_info'):
+            return None
+        code_info = entry['code_info']
+        self.codegen_cache.put(cache_key, code_info, created_at=entry['expires_at'] - self.codegen_cache.ttl_seconds,
+                               shared_hit=True)
+        print("⚡ Using PowerShell code generated by another device")
+        return dict(code_info, cached=True)
+
+    def _cache_generated_code(self, cache_key: str, code_info: Dict):
+        """Keep a parsed generation locally and publish it for the rest of the fleet"""
+        self.codegen_cache.put(cache_key, code_info)
+        if self.db and self.shared_codegen_cache:
+            self.background_writer.submit(
+                "firestore_codegen_write",
+                self.db.collection(CODEGEN_SHARED_COLLECTION).document(cache_key).set,
+                {
+                    'code_info': code_info,
+                    'model': self.model,
+                    'device_id': self.device_id,
+                    'generated_at': datetime.now().isoformat(),
+                    'expires_at': time.time() + self.codegen_cache.ttl_seconds
+                }
+            )
+
+    def _generate_code(self, prompt: str, system_instruction: str, cache_key: str,
+                       parser: StreamingJSONFields = None) -> Dict[str, Any]:
+        """Stream the code generation response through the incremental JSON parser"""
+        parser = parser or StreamingJSONFields()
+        response = self.call_gemini_api(prompt, system_instruction, on_text=parser.feed)
         
         try:
-            # Clean response and extract JSON
+            if parser.complete:
+                parsed = dict(parser.fields)
+                # Cached as generated, safety_level included, so process_request still checks it
+                self._cache_generated_code(cache_key, parsed)
+                return parsed
+            
+            # Not one well-formed object: fall back to the outermost braces
             response = response.strip()
             if response.startswith('```json'):
                 response = response[7:]
@@ -325,6 +3418,8 @@ Return ONLY valid JSON in this exact format:
             if start_idx != -1 and end_idx != -1:
                 json_str = response[start_idx:end_idx]
                 parsed = json.loads(json_str)
+                # Cached as generated, safety_level included, so process_request still checks it
+                self._cache_generated_code(cache_key, parsed)
                 return parsed
             else:
                 raise ValueError("No JSON found")
@@ -340,59 +3435,259 @@ Return ONLY valid JSON in this exact format:
                 "reversible": False
             }
 
-    def execute_powershell_with_monitoring(self, command: str) -> Tuple[bool, str, Dict]:
-        """Execute PowerShell command with monitoring"""
-        start_time = time.time()
+    def execute_powershell_with_monitoring(self, command: str, command_id: str = None,
+                                           process_key: str = None, echo: bool = True) -> Tuple[bool, str, Dict]:
+        """Execute PowerShell command with monitoring
+
+        process_key names the process for cancel and emergency stop (default:
+        command_id); with echo False nothing is printed to the console.
+        """
+        start_time = time.monotonic()
         metrics = {
             "start_time": datetime.now().isoformat(),
             "execution_time": 0,
             "timeout": False,
             "exit_code": None
         }
+        output_stream = None
+        process_key = process_key or command_id or LOCAL_PROCESS_KEY
         
         try:
-            print("⚡ Executing PowerShell command...")
-            
-            process = subprocess.Popen(
-                ["powershell", "-ExecutionPolicy", "Bypass", "-Command", command],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                errors='replace'
-            )
+            if echo:
+                print("⚡ Executing PowerShell command...")
             
-            # Monitor for timeout
-            timeout_counter = 0
-            while process.poll() is None:
-                time.sleep(0.1)
-                timeout_counter += 0.1
-                if timeout_counter >= self.timeout_seconds:
-                    process.terminate()
-                    metrics["timeout"] = True
-                    break
+            output_stream = self._create_output_stream(command_id, echo)
+            returncode = None
+            if self.shell_pool:
+                try:
+                    returncode, stdout, stderr = self._execute_in_shell_pool(
+                        command, process_key, metrics, output_stream
+                    )
+                    metrics["executor"] = "host_pool"
+                except queue.Empty:
+                    self.logger.warning("All shell hosts busy, starting a dedicated shell")
             
-            stdout, stderr = process.communicate()
+            if returncode is None:
+                returncode, stdout, stderr = self._execute_in_new_shell(
+                    command, process_key, metrics, output_stream
+                )
+                metrics["executor"] = "process"
             
-            execution_time = time.time() - start_time
+            execution_time = time.monotonic() - start_time
+            self.tracer.observe('execution', execution_time, failed=metrics["timeout"] or returncode != 0)
             metrics["execution_time"] = round(execution_time, 2)
             metrics["end_time"] = datetime.now().isoformat()
-            metrics["exit_code"] = process.returncode
+            metrics["exit_code"] = returncode
             
             if metrics["timeout"]:
                 return False, f"Command timed out after {self.timeout_seconds} seconds", metrics
-            elif process.returncode == 0:
+            elif returncode == 0:
                 return True, stdout.strip() if stdout else "Command executed successfully", metrics
             else:
-                return False, stderr.strip() if stderr else f"Command failed with exit code {process.returncode}", metrics
+                return False, stderr.strip() if stderr else f"Command failed with exit code {returncode}", metrics
                 
         except Exception as e:
-            metrics["execution_time"] = time.time() - start_time
+            if output_stream:
+                output_stream.finish()
+            self.tracer.observe('execution', time.monotonic() - start_time, failed=True)
+            metrics["execution_time"] = round(time.monotonic() - start_time, 2)
             metrics["error"] = str(e)
             return False, f"Execution error: {str(e)}", metrics
 
+    def _create_output_stream(self, command_id: str, echo: bool = True) -> CommandOutputStream:
+        output_ref = None
+        if self.rtdb and command_id and self.stream_output:
+            output_ref = self.rtdb.reference(f'zynapse_output/{command_id}')
+        return CommandOutputStream(
+            command_id,
+            output_ref,
+            echo=echo,
+            flush_interval=self.output_flush_interval,
+            max_output_chars=self.max_output_chars,
+            logger=self.logger
+        )
+
+    def _shell_command_args(self, command: str) -> list:
+        if is_powershell(self.shell_binary):
+            return [self.shell_binary, "-ExecutionPolicy", "Bypass", "-Command", command]
+        return [self.shell_binary, "-c", command]
+
+    def _execute_in_new_shell(self, command: str, process_key: str, metrics: Dict,
+                              output_stream: CommandOutputStream) -> Tuple[int, str, str]:
+        """Run the command in a fresh shell process, streaming its output line by line"""
+        process = subprocess.Popen(
+            self._shell_command_args(command),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1,
+            **process_group_options()
+        )
+        
+        # Track the process so a cancel request or an emergency stop can kill it
+        with self.process_lock:
+            self.active_processes[process_key] = process
+        
+        # Drain stdout and stderr concurrently, so a chatty child can never
+        # block on a full pipe buffer, while this thread just waits for exit
+        readers = [
+            threading.Thread(target=self._pump_output, args=(process.stdout, 'stdout', output_stream), daemon=True),
+            threading.Thread(target=self._pump_output, args=(process.stderr, 'stderr', output_stream), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+        
+        try:
+            process.wait(timeout=self.timeout_seconds)
+        except subprocess.TimeoutExpired:
+            metrics["timeout"] = True
+            self.terminate_process_tree(process)
+        finally:
+            with self.process_lock:
+                self.active_processes.pop(process_key, None)
+        
+        # An orphaned grandchild may still hold the pipes open; don't wait on it forever
+        for reader in readers:
+            reader.join(timeout=self.kill_grace_seconds)
+        
+        stdout, stderr = output_stream.finish()
+        return process.returncode, stdout, stderr
+
+    def _pump_output(self, pipe, stream: str, output_stream: CommandOutputStream):
+        try:
+            for line in pipe:
+                output_stream.write(stream, line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            pipe.close()
+
+    def _execute_in_shell_pool(self, command: str, process_key: str, metrics: Dict,
+                               output_stream: CommandOutputStream) -> Tuple[int, str, str]:
+        """Run the command on a warm shell host; raises queue.Empty if none frees up in time"""
+        def track_host(host: ShellHost):
+            # Cancelling kills the host process; the pool replaces it
+            with self.process_lock:
+                self.active_processes[process_key] = host.process
+        
+        try:
+            returncode, stdout, stderr, timed_out = self.shell_pool.execute(
+                command, self.timeout_seconds, on_host=track_host
+            )
+        finally:
+            with self.process_lock:
+                self.active_processes.pop(process_key, None)
+        
+        metrics["timeout"] = timed_out
+        
+        # Hosts answer with a single frame, so the output arrives in one piece
+        for stream, text in (('stdout', stdout), ('stderr', stderr)):
+            for line in text.splitlines(keepends=True):
+                output_stream.write(stream, line)
+        return (returncode,) + output_stream.finish()
+
+    def set_shell_pool(self, enabled: bool):
+        """Start or stop the warm shell host pool"""
+        if enabled and not self.shell_pool:
+            self.shell_pool = ShellHostPool(
+                self.shell_binary,
+                size=self.shell_pool_size,
+                max_commands_per_host=self.shell_host_max_commands,
+                max_memory_growth_mb=self.shell_host_max_memory_growth_mb,
+                logger=self.logger
+            )
+            self.shell_pool.start()
+        elif not enabled and self.shell_pool:
+            self.shell_pool.shutdown()
+            self.shell_pool = None
+
+    def terminate_process_tree(self, process: subprocess.Popen, grace_seconds: float = None):
+        """Terminate a shell and its children, escalating to kill after a grace period"""
+        grace_seconds = self.kill_grace_seconds if grace_seconds is None else grace_seconds
+        terminate_process_tree(process, grace_seconds, self.logger)
+
     def analyze_execution_results(self, user_request: str, code_info: Dict, 
-                                execution_success: bool, output: str, metrics: Dict) -> Dict:
+                                execution_success: bool, output: str, metrics: Dict,
+                                data: Any = None) -> Dict:
+        """Analyze execution results with the configured analyzer mode"""
+        if data is not None and self.analyzer_mode != 'llm':
+            # Parsed structured output is the answer itself; field names such as
+            # "ErrorCount" must not trip the output error patterns
+            analysis, _ = self.heuristic_analysis(code_info, execution_success, '', metrics)
+            analysis["suggestions"] = ["Review data"]
+            analysis["analysis_source"] = "structured"
+            return analysis
+        
+        if self.analyzer_mode != 'llm':
+            analysis, confident = self.heuristic_analysis(code_info, execution_success, output, metrics)
+            if self.analyzer_mode == 'heuristic' or (confident and execution_success):
+                analysis["analysis_source"] = "heuristic"
+                return analysis
+
+        analysis = self.analyze_with_gemini(user_request, code_info, execution_success, output, metrics)
+        analysis.setdefault("analysis_source", "llm")
+        return analysis
+
+    def heuristic_analysis(self, code_info: Dict, execution_success: bool,
+                           output: str, metrics: Dict) -> Tuple[Dict, bool]:
+        """Analyze results locally from exit code, timeout, error patterns and output size.
+
+        Returns the analysis dict and whether the rules are confident in it.
+        """
+        output = output or ""
+        lowered = output.lower()
+        exit_code = metrics.get("exit_code")
+        risk_level = {"SAFE": "low", "CAUTION": "medium", "DANGEROUS": "high"}.get(
+            code_info.get("safety_level"), "medium"
+        )
+        issues = []
+        suggestions = []
+        
+        if metrics.get("timeout"):
+            issues.append(f"Command timed out after {metrics.get('execution_time', self.timeout_seconds)}s")
+            suggestions.append("Increase the timeout or narrow the scope of the request")
+            return {
+                "request_fulfilled": False,
+                "execution_quality": "poor",
+                "issues_found": issues,
+                "suggestions": suggestions,
+                "risk_level": risk_level,
+                "next_steps": "Retry with a longer timeout"
+            }, True
+        
+        if not execution_success:
+            issues.append(f"Command exited with code {exit_code}" if exit_code is not None else "Execution failed")
+            return {
+                "request_fulfilled": False,
+                "execution_quality": "poor",
+                "issues_found": issues,
+                "suggestions": ["Check command syntax"],
+                "risk_level": risk_level,
+                "next_steps": "Debug and retry"
+            }, False
+        
+        matched = [pattern for pattern in OUTPUT_ERROR_PATTERNS if pattern in lowered]
+        if matched:
+            issues.append(f"Output mentions: {', '.join(matched[:3])}")
+            suggestions.append("Review output for non-terminating errors")
+        if len(output) > LARGE_OUTPUT_CHARS:
+            suggestions.append("Filter or page the output to reduce its size")
+        if not suggestions:
+            suggestions.append("Review output")
+        
+        return {
+            "request_fulfilled": not matched,
+            "execution_quality": "fair" if matched else "excellent",
+            "issues_found": issues,
+            "suggestions": suggestions,
+            "risk_level": risk_level,
+            "next_steps": "Review reported issues" if matched else "Task completed"
+        }, not matched
+
+    def analyze_with_gemini(self, user_request: str, code_info: Dict, 
+                            execution_success: bool, output: str, metrics: Dict) -> Dict:
         """Analyze execution results using Gemini"""
         
         system_instruction = """
@@ -446,9 +3741,35 @@ Return ONLY valid JSON:
             "issues_found": [] if execution_success else ["Execution failed"],
             "suggestions": ["Review output" if execution_success else "Check command syntax"],
             "risk_level": "low",
-            "next_steps": "Task completed" if execution_success else "Debug and retry"
+            "next_steps": "Task completed" if execution_success else "Debug and retry",
+            "analysis_source": "fallback"
         }
 
+    def record_phase_latency(self, timings: Dict):
+        """Accumulate per-phase latency for the active analyzer mode"""
+        with self.phase_latency_lock:
+            totals = self.phase_latency.setdefault(self.analyzer_mode, {"commands": 0, "llm_analyses": 0})
+            totals["commands"] += 1
+            if timings.get("analysis_source") == "llm":
+                totals["llm_analyses"] += 1
+            for phase in ("generation", "execution", "analysis"):
+                key = f"{phase}_seconds"
+                totals[key] = totals.get(key, 0.0) + timings.get(key, 0.0)
+        self.tracer.observe('generation', timings.get("generation_seconds", 0.0))
+        self.tracer.observe(f"analysis_{timings.get('analysis_source', 'llm')}", timings.get("analysis_seconds", 0.0))
+
+    def show_phase_latency(self):
+        """Print average phase latency per analyzer mode"""
+        with self.phase_latency_lock:
+            snapshot = copy.deepcopy(self.phase_latency)
+        for mode, totals in snapshot.items():
+            count = totals["commands"] or 1
+            print(f"- {mode}: {totals['commands']} commands, "
+                  f"gen {totals.get('generation_seconds', 0) / count:.2f}s, "
+                  f"exec {totals.get('execution_seconds', 0) / count:.2f}s, "
+                  f"analysis {totals.get('analysis_seconds', 0) / count:.2f}s avg, "
+                  f"{totals['llm_analyses']} Gemini analyses")
+
     def display_results(self, request: str, code_info: Dict, execution_success: bool, 
                        output: str, metrics: Dict, analysis: Dict):
         """Display results without visual effects"""
@@ -505,18 +3826,32 @@ Return ONLY valid JSON:
         
         print("="*80)
 
-    def process_request(self, user_request: str, command_id: str = None) -> Dict[str, Any]:
-        """Process user request - main logic"""
+    def process_request(self, user_request: str, command_id: str = None,
+                        defer_analysis: bool = False, structured: bool = None) -> Dict[str, Any]:
+        """Process user request - main logic
+
+        With defer_analysis the result is returned as soon as execution ends,
+        with an analysis_future that completes the analysis, display and logging.
+        structured (default: the agent's setting) requests JSON output, returned
+        parsed as 'data'.
+        """
+        if structured is None:
+            structured = self.structured_output
         
         print(f"\n🚀 ZYNAPSE Processing: {user_request}")
         if command_id:
             print(f"Command ID: {command_id}")
         
+        # Firebase logging below needs the connection when it is still being set up
+        self.wait_for_services()
+        
         try:
             # Update Firebase status
             self.send_status_to_firebase('processing', {'current_command': user_request})
             
-            # Step 1: Generate PowerShell code
+            # Step 1: Generate PowerShell code; remote commands continue as soon as
+            # code and safety_level are in (local ones need the full preview)
+            phase_start = time.monotonic()
             code_info = self.generate_powershell_code(
                 user_request, 
                 context={
@@ -524,11 +3859,15 @@ Return ONLY valid JSON:
                     "session_id": id(self),
                     "device_id": self.device_id,
                     "command_id": command_id
-                }
+                },
+                early_fields=EARLY_CODEGEN_FIELDS if command_id and self.early_execution else None,
+                structured=structured
             )
+            generation_seconds = time.monotonic() - phase_start
             
             # Safety check
             if code_info.get('safety_level') == 'BLOCKED':
+                code_info = self.complete_code_info(code_info)
                 print(f"🚫 Request Blocked: {code_info.get('explanation', 'Safety concerns')}")
                 print("Please modify your request or use safer alternatives.")
                 result = {"success": False, "blocked": True, "code_info": code_info}
@@ -550,8 +3889,8 @@ Return ONLY valid JSON:
                         self.send_status_to_firebase('cancelled', {'reason': 'User cancelled dangerous operation'})
                         return result
 
-            # Display code preview
-            if code_info.get('code') and not code_info['code'].startswith('Error:'):
+            # Display code preview (after an early return the details are still streaming)
+            if code_info.get('code') and not code_info['code'].startswith('Error:') and 'completion' not in code_info:
                 print(f"\nCode Preview:")
                 print(f"- Explanation: {code_info.get('explanation', 'N/A')}")
                 print(f"- Safety Level: {code_info.get('safety_level', 'N/A')}")
@@ -559,15 +3898,80 @@ Return ONLY valid JSON:
                 print(f"- Est. Time: {code_info.get('estimated_time', 'Unknown')}")
                 print(f"- Reversible: {'Yes' if code_info.get('reversible') else 'No'}")
 
+            # A remote cancel may arrive while the code is being generated
+            if command_id and self.command_queue.is_cancelled(command_id):
+                print(f"🚫 Command cancelled before execution: {command_id}")
+                return {"success": False, "cancelled": True, "code_info": self.complete_code_info(code_info)}
+
             # Step 2: Execute the code
+            phase_start = time.monotonic()
             execution_success, output, metrics = self.execute_powershell_with_monitoring(
-                code_info.get('code', '')
+                code_info.get('code', ''), command_id=command_id
             )
+            execution_seconds = time.monotonic() - phase_start
+            code_info = self.complete_code_info(code_info)
+            
+            data = None
+            if structured and execution_success:
+                try:
+                    data = parse_structured_output(output)
+                except ValueError as e:
+                    self.logger.warning(f"Structured output is not JSON, keeping it as text: {str(e)}")
+                    metrics["structured_error"] = str(e)
+
+            phase_args = (user_request, command_id, code_info, execution_success, output, metrics,
+                          generation_seconds, execution_seconds, data)
+            if defer_analysis:
+                return {
+                    "success": execution_success,
+                    "code_info": code_info,
+                    "execution_success": execution_success,
+                    "output": output,
+                    "data": data,
+                    "metrics": dict(metrics),
+                    "analysis": {},
+                    "analysis_pending": True,
+                    "analysis_future": self.analysis_executor.submit(self._finalize_request, *phase_args)
+                }
+            return self._finalize_request(*phase_args)
+
+        except Exception as e:
+            error_msg = f"Unexpected error during processing: {str(e)}"
+            self.logger.error(error_msg)
+            print(f"💥 System Error: {error_msg}")
+            
+            # Update Firebase with error
+            self.send_status_to_firebase('error', {'error_message': error_msg})
+            
+            return {
+                "success": False,
+                "error": error_msg,
+                "code_info": None,
+                "execution_success": False,
+                "output": "",
+                "metrics": {},
+                "analysis": {}
+            }
 
+    def _finalize_request(self, user_request: str, command_id: str, code_info: Dict,
+                          execution_success: bool, output: str, metrics: Dict,
+                          generation_seconds: float, execution_seconds: float,
+                          data: Any = None) -> Dict[str, Any]:
+        """Analyze, display and log an executed request"""
+        try:
             # Step 3: Analyze results
+            phase_start = time.monotonic()
             analysis = self.analyze_execution_results(
-                user_request, code_info, execution_success, output, metrics
+                user_request, code_info, execution_success, output, metrics, data
             )
+            metrics["phase_timings"] = {
+                "generation_seconds": round(generation_seconds, 3),
+                "execution_seconds": round(execution_seconds, 3),
+                "analysis_seconds": round(time.monotonic() - phase_start, 3),
+                "analyzer_mode": self.analyzer_mode,
+                "analysis_source": analysis.get("analysis_source", "llm")
+            }
+            self.record_phase_latency(metrics["phase_timings"])
 
             # Step 4: Display results
             self.display_results(
@@ -586,15 +3990,14 @@ Return ONLY valid JSON:
                 "metrics": metrics,
                 "analysis": analysis
             }
-            self.session_log.append(session_entry)
-            self.command_history.append(user_request)
+            if data is not None:
+                session_entry["output_format"] = "json"
+            self.session_store.append(session_entry)
 
             # Store in Firebase
             if self.db:
-                try:
-                    self.db.collection('zynapse_sessions').add(session_entry)
-                except Exception as e:
-                    self.logger.error(f"Failed to store session in Firebase: {str(e)}")
+                self.background_writer.submit("firestore_session_add", self.db.collection('zynapse_sessions').add,
+                                              self.session_summary(session_entry))
 
             # Update status
             final_status = 'completed_success' if (execution_success and analysis.get("request_fulfilled", False)) else 'completed_error'
@@ -609,12 +4012,13 @@ Return ONLY valid JSON:
                 "code_info": code_info,
                 "execution_success": execution_success,
                 "output": output,
+                "data": data,
                 "metrics": metrics,
                 "analysis": analysis
             }
 
         except Exception as e:
-            error_msg = f"Unexpected error during processing: {str(e)}"
+            error_msg = f"Unexpected error during analysis: {str(e)}"
             self.logger.error(error_msg)
             print(f"💥 System Error: {error_msg}")
             
@@ -624,13 +4028,187 @@ Return ONLY valid JSON:
             return {
                 "success": False,
                 "error": error_msg,
-                "code_info": None,
-                "execution_success": False,
-                "output": "",
-                "metrics": {},
+                "code_info": code_info,
+                "execution_success": execution_success,
+                "output": output,
+                "metrics": metrics,
                 "analysis": {}
             }
 
+    def start_result_archiver(self):
+        """Archive old results periodically in a background thread"""
+        if not (self.db and self.rtdb) or self.result_archiver_thread:
+            return
+        self.result_archiver_thread = threading.Thread(target=self._result_archive_loop, daemon=True,
+                                                       name="zynapse-archiver")
+        self.result_archiver_thread.start()
+
+    def _result_archive_loop(self):
+        while not self.result_archiver_stop.wait(self.result_archive_interval):
+            archived = self.archive_old_results()
+            if archived:
+                self.logger.info(f"Archived {archived} results older than {self.result_archive_age_hours}h")
+
+    def _acquire_result_archive_lease(self) -> bool:
+        """Claim the archiver lease so two agents never archive the same results"""
+        now = time.time()
+        
+        def claim(current):
+            if current and current.get('holder') != self.device_id and current.get('expires_at', 0) > now:
+                return current
+            return {'holder': self.device_id, 'expires_at': now + RESULT_ARCHIVE_LEASE_SECONDS}
+        
+        try:
+            lease = self.rtdb.reference('zynapse_maintenance/result_archiver').transaction(claim)
+            return bool(lease) and lease.get('holder') == self.device_id
+        except Exception as e:
+            self.logger.error(f"Failed to acquire result archive lease: {str(e)}")
+            return False
+
+    def archive_old_results(self, max_age_hours: float = None, max_batches: int = 10) -> int:
+        """Move zynapse_results entries older than max_age_hours into zynapse_results_archive
+        
+        Any agent archives every device's results, oldest first, in batches of
+        RESULT_ARCHIVE_BATCH per archive document; finished command nodes and
+        old broadcasts are pruned in the same pass. Returns the number archived.
+        """
+        if not (self.db and self.rtdb) or not self._acquire_result_archive_lease():
+            return 0
+        
+        max_age_hours = self.result_archive_age_hours if max_age_hours is None else max_age_hours
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        results_ref = self.rtdb.reference('zynapse_results')
+        archived = 0
+        
+        try:
+            for _ in range(max_batches):
+                batch = results_ref.order_by_child('completed_at').end_at(cutoff).limit_to_first(
+                    RESULT_ARCHIVE_BATCH
+                ).get() or {}
+                if not batch:
+                    break
+                
+                records = sorted(
+                    (compact_result(key, value) for key, value in batch.items() if isinstance(value, dict)),
+                    key=lambda record: str(record['completed_at'])
+                )
+                if records:
+                    # Deterministic ID: a batch retried after a failed removal overwrites itself
+                    archive_id = hashlib.sha1('|'.join(sorted(batch)).encode('utf-8')).hexdigest()[:20]
+                    payload = '\n'.join(json.dumps(record, default=str) for record in records)
+                    self.db.collection('zynapse_results_archive').document(archive_id).set({
+                        'archived_at': datetime.now().isoformat(),
+                        'archived_by': self.device_id,
+                        'count': len(records),
+                        'first_completed_at': records[0]['completed_at'],
+                        'last_completed_at': records[-1]['completed_at'],
+                        'device_ids': sorted({str(record['device_id']) for record in records}),
+                        'command_ids': [record['command_id'] for record in records],
+                        'encoding': 'ndjson+gzip',
+                        'results': gzip.compress(payload.encode('utf-8'))
+                    })
+                
+                # Removed only once the archive document is stored
+                removals = {}
+                for key in batch:
+                    removals[f'zynapse_results/{key}'] = None
+                    removals[f'zynapse_output/{key}'] = None
+                    removals[f'{RESULT_BLOBS_PATH}/{key}'] = None
+                self.rtdb.reference('/').update(removals)
+                archived += len(batch)
+                
+                if len(batch) < RESULT_ARCHIVE_BATCH:
+                    break
+        except Exception as e:
+            self.logger.error(f"Result archiving failed: {str(e)}")
+        
+        # Finished commands and old broadcasts are pruned under the same lease
+        pruned = self.prune_finished_commands(max_age_hours)
+        if pruned:
+            self.logger.info(f"Pruned {pruned} command nodes finished more than {max_age_hours}h ago")
+        pruned = self.prune_broadcasts()
+        if pruned:
+            self.logger.info(f"Pruned {pruned} broadcasts older than {BROADCAST_RETENTION_SECONDS}s")
+        return archived
+
+    def prune_finished_commands(self, max_age_hours: float = None) -> int:
+        """Delete command nodes of every device that finished more than max_age_hours ago
+        
+        Partition listeners download the whole partition when they connect, so
+        only pending, running and recent commands are kept. Nodes of scheduled
+        jobs stay until the job is removed. Returns the number deleted.
+        """
+        max_age_hours = self.result_archive_age_hours if max_age_hours is None else max_age_hours
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        pruned = 0
+        
+        try:
+            # Keys only: a partition per device, and the legacy flat commands
+            children = self.rtdb.reference('zynapse_commands').get(shallow=True) or {}
+            for parent in ['zynapse_commands'] + [f'zynapse_commands/{key}' for key in children]:
+                parent_ref = self.rtdb.reference(parent)
+                removals = {}
+                for field in FINISHED_COMMAND_FIELDS:
+                    # start_at('') leaves out nodes without the field, which sort first
+                    finished = parent_ref.order_by_child(field).start_at('').end_at(cutoff).limit_to_first(
+                        COMMAND_PRUNE_BATCH
+                    ).get() or {}
+                    for command_id, command in finished.items():
+                        if isinstance(command, dict) and (not command.get('job_id') or
+                                                          command.get('status') == 'cancelled'):
+                            removals[f'{parent}/{command_id}'] = None
+                if removals:
+                    self.rtdb.reference('/').update(removals)
+                    pruned += len(removals)
+        except Exception as e:
+            self.logger.error(f"Command pruning failed: {str(e)}")
+        
+        return pruned
+
+    def prune_broadcasts(self, max_batches: int = 10) -> int:
+        """Delete broadcasts created more than BROADCAST_RETENTION_SECONDS ago, with their claims
+        
+        Devices stop accepting a broadcast after BROADCAST_MAX_AGE_SECONDS; the
+        results stay in zynapse_results. Returns the number of broadcasts deleted.
+        """
+        cutoff = int((time.time() - BROADCAST_RETENTION_SECONDS) * 1000)
+        broadcasts_ref = self.rtdb.reference(BROADCASTS_PATH)
+        pruned = 0
+        
+        try:
+            for _ in range(max_batches):
+                # Records without created_at (such as a late cancel of a pruned
+                # broadcast) sort first and are removed too
+                batch = broadcasts_ref.order_by_child('created_at').end_at(cutoff).limit_to_first(
+                    BROADCAST_PRUNE_BATCH
+                ).get() or {}
+                if not batch:
+                    break
+                removals = {}
+                for key in batch:
+                    removals[f'{BROADCASTS_PATH}/{key}'] = None
+                    removals[f'{BROADCAST_CLAIMS_PATH}/{key}'] = None
+                self.rtdb.reference('/').update(removals)
+                pruned += len(batch)
+                
+                if len(batch) < BROADCAST_PRUNE_BATCH:
+                    break
+        except Exception as e:
+            self.logger.error(f"Broadcast pruning failed: {str(e)}")
+        
+        return pruned
+
+    def shutdown_pipeline(self, timeout: float = 10):
+        """Let deferred analyses and queued Firebase writes finish before exit"""
+        self.result_archiver_stop.set()
+        self.analysis_executor.shutdown(wait=True)
+        self.job_scheduler.shutdown()
+        self.session_store.close()
+        self.set_metrics_server(None)
+        self.status_writer.shutdown()
+        if not self.background_writer.flush(timeout):
+            self.logger.warning(f"Exited with {self.background_writer.pending.qsize()} Firebase writes unsent")
+
     def show_help(self):
         """Display help information"""
         print("\n" + "="*60)
@@ -644,8 +4222,22 @@ Return ONLY valid JSON:
         print("- safety on/off: Toggle safety mode")
         print("- timeout <seconds>: Set execution timeout")
         print("- stats: Show session statistics")
+        print("- queue: Show remote command queue")
+        print("- workers <n>: Set concurrent remote commands")
+        print("- cancel <command_id>: Cancel a queued or running remote command")
+        print("- stop: Emergency stop (cancel queued commands, kill running ones, pause jobs)")
+        print("- jobs: List scheduled jobs")
+        print("- job add <5m|every 1h|cron spec> <request>: Generate code once, re-run it on a schedule")
+        print("- job remove/run <job_id>, job pause/resume <job_id|all>: Manage scheduled jobs")
+        print("- pool on/off/status/check: Manage warm shell host pool")
+        print("- cache [clear|persist on/off|shared on/off]: Generated code cache")
+        print("- analyzer llm/heuristic/hybrid: Set result analysis mode")
+        print("- structured on/off: Ask for ConvertTo-Json output and store results as typed data")
+        print("- perf [reset|serve <port>|stop]: Latency percentiles and Prometheus endpoint")
         print("- firebase: Show Firebase connection status")
-        print("- export: Export session log")
+        print("- layout legacy/partitioned/migration: Set RTDB command layout")
+        print("- export [incremental] [gzip|zstd|none]: Export session log as NDJSON")
+        print("- archive [hours]: Archive Firebase results older than hours (default 24)")
         print("- clear: Clear the screen")
         print("- quit/exit: Exit the application")
         print("\nFirebase Features:")
@@ -663,8 +4255,9 @@ Return ONLY valid JSON:
     def show_stats(self):
         """Display session statistics"""
         session_duration = datetime.now() - self.session_start
-        total_commands = len(self.session_log)
-        successful_commands = sum(1 for entry in self.session_log if entry.get('execution_success', False))
+        session_stats = self.session_store.stats()
+        total_commands = session_stats['total_commands']
+        successful_commands = session_stats['successful_executions']
         success_rate = (successful_commands / total_commands * 100) if total_commands > 0 else 0
         
         print("\n" + "="*50)
@@ -675,12 +4268,113 @@ Return ONLY valid JSON:
         print(f"Total Commands: {total_commands}")
         print(f"Successful Commands: {successful_commands}")
         print(f"Success Rate: {success_rate:.1f}%")
+        print(f"Session Log: {session_stats['in_memory']} entries in memory, {session_stats['segments']} segments on disk")
         print(f"Safety Mode: {'Enabled' if self.safety_mode else 'Disabled'}")
         print(f"Timeout Setting: {self.timeout_seconds}s")
         print(f"AI Model: {self.model}")
         print(f"Firebase Connected: {'Yes' if self.db else 'No'}")
-        print(f"Firebase Listener: {'Active' if self.firebase_listener_thread and self.firebase_listener_thread.is_alive() else 'Inactive'}")
+        print(f"Firebase Listener: {'Active' if self.is_listener_active() else 'Inactive'}")
+        print(f"Command Workers: {self.command_queue.max_workers}")
+        cache_stats = self.codegen_cache.stats()
+        print(f"Code Cache: {cache_stats['hits']} hits ({cache_stats['disk_hits']} from disk), "
+              f"{cache_stats['misses']} misses, {cache_stats['hit_rate']:.1f}% hit rate, "
+              f"{cache_stats['entries']} entries")
+        print(f"Shared Generations: {cache_stats['shared_hits']} from other devices, "
+              f"{cache_stats['coalesced']} joined an identical in-flight request")
+        print(f"Shell: {self.shell_binary} ({'warm host pool' if self.shell_pool else 'process per command'})")
+        job_stats = self.job_scheduler.stats()
+        print(f"Scheduled Jobs: {job_stats['jobs']} ({job_stats['enabled']} enabled), "
+              f"{job_stats['samples_flushed']} samples sent in {job_stats['batches_flushed']} batches")
+        print(f"Analyzer Mode: {self.analyzer_mode}")
+        print(f"Output Mode: {'structured (JSON)' if self.structured_output else 'text'}")
+        writer_stats = self.background_writer.stats()
+        print(f"Background Writes: {writer_stats['written']} sent, {writer_stats['pending']} pending, "
+              f"{writer_stats['failed']} failed, {writer_stats['dropped']} dropped")
+        status_stats = self.status_writer.stats()
+        print(f"Status Writes: {status_stats['updates']} updates coalesced into "
+              f"{status_stats['documents_written']} document writes ({status_stats['batches']} batches)")
+        self.show_phase_latency()
+        print("="*50)
+
+    def set_metrics_server(self, port: int = None):
+        """Start the Prometheus endpoint on localhost, or stop it when port is None"""
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server = None
+        if port is None:
+            return
+        try:
+            self.metrics_server = MetricsServer(self.tracer, port)
+            print(f"📈 Metrics at http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+        except OSError as e:
+            self.logger.error(f"Failed to start metrics endpoint on port {port}: {str(e)}")
+            print(f"❌ Metrics endpoint failed: {str(e)}")
+
+    def show_perf(self):
+        """Show latency percentiles for every traced span"""
+        print("\n" + "="*72)
+        print("ZYNAPSE PERFORMANCE")
+        print("="*72)
+        summary = self.tracer.summary()
+        if not summary:
+            print("No spans recorded yet.")
+        else:
+            print(f"{'Span':<24}{'count':>7}{'errors':>7}{'p50':>8}{'p95':>8}{'p99':>8}{'mean':>8}")
+            for name, stats in summary.items():
+                print(f"{name:<24}{stats['count']:>7}{stats['errors']:>7}{stats['p50']:>8.3f}"
+                      f"{stats['p95']:>8.3f}{stats['p99']:>8.3f}{stats['mean']:>8.3f}")
+        if self.metrics_server:
+            print(f"Prometheus: http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+        print("="*72)
+
+    def show_queue_status(self):
+        """Show remote command queue state"""
+        queue_stats = self.command_queue.stats()
+        
+        print("\n" + "="*50)
+        print("REMOTE COMMAND QUEUE")
         print("="*50)
+        print(f"Workers: {queue_stats['workers']}")
+        print(f"Running: {queue_stats['running']}")
+        print(f"Queued: {queue_stats['queued']} / {self.command_queue.max_queue_size}")
+        print(f"Completed: {queue_stats['completed']}")
+        print(f"Cancelled: {queue_stats['cancelled']}")
+        print(f"Rejected: {queue_stats['rejected']}")
+        print(f"Claimed: {self.command_event_stats['claimed']} "
+              f"({self.command_event_stats['lost_claims']} lost to another agent)")
+        print(f"Ignored events: {self.command_event_stats['ignored_events']}")
+        
+        print("Queued by priority: " + ', '.join(
+            f"{priority} {count}" for priority, count in queue_stats['queued_by_priority'].items()
+        ) + f" ({queue_stats['submitters']} submitters)")
+        
+        for command_id, ticket in list(self.command_queue.running.items()):
+            print(f"- RUNNING {command_id} [{ticket.priority}]: {ticket.command_text}")
+        for ticket in self.command_queue.queued_tickets():
+            print(f"- QUEUED  {ticket.command_id} [{ticket.priority}, {ticket.submitter}]: {ticket.command_text}")
+        print("="*50)
+
+    def show_jobs(self):
+        """List scheduled jobs with their last sample"""
+        job_stats = self.job_scheduler.stats()
+        
+        print("\n" + "="*60)
+        print("SCHEDULED JOBS")
+        print("="*60)
+        print(f"Jobs: {job_stats['jobs']} ({job_stats['enabled']} enabled), saved to {job_stats['persist_path']}")
+        print(f"Samples: {job_stats['samples_buffered']} buffered, {job_stats['samples_flushed']} sent "
+              f"in {job_stats['batches_flushed']} {JOB_RUNS_COLLECTION} documents")
+        for job in list(self.job_scheduler.jobs.values()):
+            next_run = (datetime.fromtimestamp(job.next_run_at).strftime('%H:%M:%S')
+                        if job.enabled else 'paused')
+            print(f"- {job.job_id} [{job.schedule}] {job.request}")
+            print(f"  next {next_run}, {job.runs} runs, {job.failures} failed, {job.skipped} skipped")
+            if job.last_sample:
+                sample = job.last_sample
+                last = sample['value'] if 'value' in sample else (sample.get('out') or '')[:60]
+                print(f"  last {sample['t']}: {'ok' if sample['ok'] else 'failed'} "
+                      f"in {sample['dur']}s -> {last}")
+        print("="*60)
 
     def show_firebase_status(self):
         """Show Firebase connection status"""
@@ -690,7 +4384,8 @@ Return ONLY valid JSON:
         print(f"Device ID: {self.device_id}")
         print(f"Firestore Connected: {'Yes' if self.db else 'No'}")
         print(f"Realtime DB Connected: {'Yes' if self.rtdb else 'No'}")
-        print(f"Command Listener: {'Active' if self.firebase_listener_thread and self.firebase_listener_thread.is_alive() else 'Inactive'}")
+        print(f"Command Listener: {'Active' if self.is_listener_active() else 'Inactive'}")
+        print(f"Command Layout: {self.command_layout}")
         
         if self.db:
             try:
@@ -707,16 +4402,34 @@ Return ONLY valid JSON:
         
         print("="*50)
 
-    def export_session(self):
-        """Export session data"""
+    def export_session(self, incremental: bool = False, compression: str = 'gzip'):
+        """Stream the session log to an NDJSON file and upload it as a manifest plus parts
+
+        The first record describes the session; each following record is one log
+        entry. With incremental only entries logged since the last export are written.
+        """
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                print("⚠️ zstandard not installed - using gzip (pip install zstandard)")
+                compression = 'gzip'
+        
+        # The upload below needs Firebase when it is still connecting
+        self.wait_for_services()
+        
+        since_seq = self.last_export_seq if incremental else 0
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"zynapse_firebase_session_{self.device_id}_{timestamp}.json"
+        extension = {'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}.get(compression, '.ndjson')
+        filename = f"zynapse_firebase_session_{self.device_id}_{timestamp}{extension}"
         
-        export_data = {
+        header = {
+            "record_type": "session",
             "device_info": {
                 "device_id": self.device_id,
                 "firebase_connected": self.db is not None,
-                "listener_active": self.firebase_listener_thread and self.firebase_listener_thread.is_alive()
+                "listener_active": self.is_listener_active(),
+                "command_layout": self.command_layout
             },
             "session_info": {
                 "start_time": self.session_start.isoformat(),
@@ -727,47 +4440,104 @@ Return ONLY valid JSON:
                 "timeout_seconds": self.timeout_seconds
             },
             "statistics": {
-                "total_commands": len(self.command_history),
-                "successful_executions": sum(1 for entry in self.session_log if entry.get('execution_success', False)),
-                "unique_commands": len(set(self.command_history))
+                key: value for key, value in self.session_store.stats().items()
+                if key in ('total_commands', 'successful_executions', 'unique_commands', 'unique_commands_capped')
             },
-            "command_history": self.command_history,
-            "detailed_log": self.session_log
+            "incremental": incremental,
+            "since_seq": since_seq
         }
         
+        # Firestore copy: parts/{index} hold consecutive slices of the NDJSON text,
+        # the manifest is written last so readers only see complete exports
+        export_ref = None
+        if self.db:
+            export_ref = self.db.collection('zynapse_exports').document(f"{self.device_id}_{timestamp}")
+        part_text = ""
+        part_count = 0
+        record_count = 0
+        last_seq = since_seq
+        
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, indent=2, ensure_ascii=False)
-            print(f"📁 Session data exported to: {filename}")
+            with open_export_file(filename, compression) as f:
+                records = (dict(entry, record_type="entry") for entry in self.session_store.iter_entries(since_seq))
+                for record in itertools.chain([header], records):
+                    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                    f.write(line)
+                    if record["record_type"] == "entry":
+                        record_count += 1
+                        last_seq = record.get("seq", last_seq)
+                    
+                    if export_ref:
+                        part_text += line
+                        while len(part_text) >= EXPORT_PART_CHARS:
+                            export_ref = self._upload_export_part(export_ref, part_count, part_text[:EXPORT_PART_CHARS])
+                            part_text = part_text[EXPORT_PART_CHARS:]
+                            part_count += 1
             
-            # Also upload to Firebase if connected
-            if self.db:
-                try:
-                    self.db.collection('zynapse_exports').add({
-                        'device_id': self.device_id,
-                        'export_timestamp': datetime.now().isoformat(),
-                        'filename': filename,
-                        'export_data': export_data
-                    })
-                    print("📤 Export also uploaded to Firebase")
-                except Exception as e:
-                    print(f"⚠️ Failed to upload to Firebase: {str(e)}")
+            print(f"📁 Session data exported to: {filename} ({record_count} entries)")
+            
+            if export_ref and part_text:
+                export_ref = self._upload_export_part(export_ref, part_count, part_text)
+                part_count += 1
+            if export_ref:
+                export_ref.set({
+                    'device_id': self.device_id,
+                    'export_timestamp': datetime.now().isoformat(),
+                    'filename': filename,
+                    'format': 'ndjson',
+                    'incremental': incremental,
+                    'from_seq': since_seq + 1,
+                    'to_seq': last_seq,
+                    'record_count': record_count,
+                    'part_count': part_count,
+                    'statistics': header['statistics']
+                })
+                print(f"📤 Export also uploaded to Firebase ({part_count} parts)")
+            elif self.db:
+                # A part failed to upload: the next incremental export repeats these entries
+                print("⚠️ Firebase export incomplete - incremental position not advanced")
+                return
+            
+            self.last_export_seq = last_seq
                     
         except Exception as e:
             print(f"❌ Export failed: {str(e)}")
 
-    def run(self):
-        """Run interactive mode with Firebase integration"""
+    def _upload_export_part(self, export_ref, index: int, text: str):
+        """Write one export part; returns None to stop uploading after a failure"""
+        try:
+            export_ref.collection('parts').document(f"{index:05d}").set({'index': index, 'data': text})
+            return export_ref
+        except Exception as e:
+            print(f"⚠️ Failed to upload to Firebase: {str(e)}")
+            return None
+
+    def run(self, startup_benchmark: bool = False):
+        """Run interactive mode with Firebase integration
+        
+        With startup_benchmark, print the startup timings as JSON and return at
+        the first prompt.
+        """
         print("🚀 ZYNAPSE CLI with Firebase - Ready!")
         print(f"Device ID: {self.device_id}")
         print(f"Model: {self.model}")
         print(f"Safety: {'ON' if self.safety_mode else 'OFF'}")
         print(f"Timeout: {self.timeout_seconds}s")
-        print(f"Firebase: {'Connected' if self.db else 'Disconnected'}")
+        if self.services_ready.is_set():
+            print(f"Firebase: {'Connected' if self.db else 'Disconnected'}")
+            # Send initial status to Firebase
+            self.send_status_to_firebase('ready', {'message': 'Device ready for commands'})
+        else:
+            # Gemini and Firebase connect while the first request is typed
+            print("Firebase: Connecting in background")
+            self.start_services(announce_ready=True)
         print("Type 'help' for commands or 'quit' to exit.")
         
-        # Send initial status to Firebase
-        self.send_status_to_firebase('ready', {'message': 'Device ready for commands'})
+        self.startup_timings['prompt'] = time.perf_counter() - STARTUP_STARTED
+        if startup_benchmark:
+            self.wait_for_services()
+            print("ZYNAPSE_STARTUP " + json.dumps({k: round(v, 4) for k, v in self.startup_timings.items()}))
+            return
         
         while self.is_running:
             try:
@@ -780,6 +4550,9 @@ Return ONLY valid JSON:
                 if user_input.lower() in ['quit', 'exit', 'q']:
                     print("👋 Thanks for using ZYNAPSE CLI with Firebase!")
                     self.send_status_to_firebase('offline', {'message': 'Device going offline'})
+                    self.command_queue.shutdown()
+                    self.set_shell_pool(False)
+                    self.shutdown_pipeline()
                     self.is_running = False
                     break
                     
@@ -788,9 +4561,10 @@ Return ONLY valid JSON:
                     continue
                     
                 elif user_input.lower() == 'history':
-                    if self.command_history:
+                    recent_requests = self.session_store.recent_requests(10)
+                    if recent_requests:
                         print("\nCommand History:")
-                        for i, cmd in enumerate(self.command_history[-10:], 1):
+                        for i, cmd in enumerate(recent_requests, 1):
                             print(f"{i}. {cmd}")
                     else:
                         print("No command history yet.")
@@ -838,16 +4612,193 @@ Return ONLY valid JSON:
                     self.show_firebase_status()
                     continue
                     
-                elif user_input.lower() == 'export':
-                    self.export_session()
+                elif user_input.lower().startswith('layout'):
+                    parts = user_input.split()
+                    if len(parts) > 1:
+                        try:
+                            self.set_command_layout(parts[1].lower())
+                            print(f"🗂️ Command layout: {self.command_layout}")
+                            self.send_status_to_firebase('config_changed', {'command_layout': self.command_layout})
+                        except ValueError as e:
+                            print(f"❌ {str(e)}. Use legacy, partitioned or migration.")
+                    else:
+                        print(f"🗂️ Command layout: {self.command_layout}")
+                    continue
+                    
+                elif user_input.lower().startswith('pool'):
+                    parts = user_input.lower().split()
+                    action = parts[1] if len(parts) > 1 else 'status'
+                    if action == 'on':
+                        self.set_shell_pool(True)
+                        print(f"🔥 Warm shell host pool: ENABLED ({self.shell_pool_size} x {self.shell_binary})")
+                        self.send_status_to_firebase('config_changed', {'shell_pool': True})
+                    elif action == 'off':
+                        self.set_shell_pool(False)
+                        print("🔥 Warm shell host pool: DISABLED")
+                        self.send_status_to_firebase('config_changed', {'shell_pool': False})
+                    elif not self.shell_pool:
+                        print("🔥 Warm shell host pool: DISABLED")
+                    elif action == 'check':
+                        health = self.shell_pool.health_check()
+                        print(f"🔥 Healthy hosts: {health['healthy']}, replaced: {health['replaced']}")
+                    else:
+                        for key, value in self.shell_pool.stats().items():
+                            print(f"- {key}: {value}")
+                    continue
+                    
+                elif user_input.lower().startswith('cache'):
+                    parts = user_input.lower().split()
+                    if len(parts) > 1 and parts[1] == 'clear':
+                        self.codegen_cache.clear()
+                        print("🧹 Generated code cache cleared")
+                    elif len(parts) > 2 and parts[1] == 'persist':
+                        if parts[2] == 'on':
+                            self.codegen_cache.enable_persistence(self.codegen_cache_file)
+                            print(f"💾 Code cache persisted to: {self.codegen_cache_file}")
+                        else:
+                            self.codegen_cache.disable_persistence()
+                            print("💾 Code cache persistence: DISABLED")
+                    elif len(parts) > 2 and parts[1] == 'shared':
+                        self.shared_codegen_cache = parts[2] == 'on'
+                        print(f"🌐 Fleet code cache ({CODEGEN_SHARED_COLLECTION}): "
+                              f"{'ENABLED' if self.shared_codegen_cache else 'DISABLED'}")
+                    else:
+                        for key, value in self.codegen_cache.stats().items():
+                            print(f"- {key}: {value}")
+                    continue
+                    
+                elif user_input.lower().startswith('analyzer'):
+                    parts = user_input.lower().split()
+                    if len(parts) > 1 and parts[1] in ANALYZER_MODES:
+                        self.analyzer_mode = parts[1]
+                        print(f"🔍 Analyzer mode: {self.analyzer_mode}")
+                        self.send_status_to_firebase('config_changed', {'analyzer_mode': self.analyzer_mode})
+                    else:
+                        print(f"Analyzer mode: {self.analyzer_mode} (options: {', '.join(ANALYZER_MODES)})")
+                        self.show_phase_latency()
+                    continue
+                    
+                elif user_input.lower().split()[0] == 'structured' and len(user_input.split()) <= 2:
+                    parts = user_input.lower().split()
+                    if len(parts) > 1 and parts[1] in ('on', 'off'):
+                        self.structured_output = parts[1] == 'on'
+                        self.send_status_to_firebase('config_changed', {'structured_output': self.structured_output})
+                    print(f"🧾 Structured output: {'ENABLED' if self.structured_output else 'DISABLED'}")
+                    continue
+                    
+                elif user_input.lower() == 'perf' or user_input.lower().startswith('perf '):
+                    parts = user_input.lower().split()
+                    if len(parts) > 1 and parts[1] == 'reset':
+                        self.tracer.reset()
+                        print("🧹 Performance histograms cleared")
+                    elif len(parts) > 1 and parts[1] == 'serve':
+                        try:
+                            self.set_metrics_server(int(parts[2]) if len(parts) > 2 else 9464)
+                        except ValueError:
+                            print("❌ Invalid port. Please use a number.")
+                    elif len(parts) > 1 and parts[1] == 'stop':
+                        self.set_metrics_server(None)
+                        print("📈 Metrics endpoint stopped")
+                    else:
+                        self.show_perf()
+                    continue
+                    
+                elif user_input.lower() == 'queue':
+                    self.show_queue_status()
+                    continue
+                    
+                elif user_input.lower().startswith('workers'):
+                    parts = user_input.split()
+                    if len(parts) > 1:
+                        try:
+                            self.max_concurrent_commands = int(parts[1])
+                            self.command_queue.set_workers(self.max_concurrent_commands)
+                            print(f"⚙️ Concurrent commands set to: {self.command_queue.max_workers}")
+                            self.send_status_to_firebase('config_changed', {'max_concurrent_commands': self.command_queue.max_workers})
+                        except ValueError:
+                            print("❌ Invalid worker count. Please use a number.")
+                    else:
+                        print(f"⚙️ Concurrent commands: {self.command_queue.max_workers}")
+                    continue
+                    
+                elif user_input.lower() == 'stop':
+                    self.emergency_stop()
+                    continue
+                    
+                elif user_input.lower() == 'jobs':
+                    self.show_jobs()
+                    continue
+                    
+                elif user_input.lower().split()[0] == 'job':
+                    parts = user_input.split(maxsplit=2)
+                    action = parts[1].lower() if len(parts) > 1 else ''
+                    if action == 'add' and len(parts) > 2:
+                        try:
+                            schedule, request = split_schedule(parts[2])
+                        except ValueError as e:
+                            print(f"❌ {str(e)}")
+                            continue
+                        # The first run goes through the full pipeline; its code becomes the job
+                        self.command_queue.run_now(CommandTicket(
+                            f"local_{uuid.uuid4().hex[:12]}", request, self._run_interactive_command,
+                            source='interactive', priority='interactive', submitter='console',
+                            owner=self.device_id, schedule=schedule
+                        ))
+                    elif action == 'remove' and len(parts) > 2:
+                        if not self.remove_job(parts[2]):
+                            print(f"❌ No scheduled job with ID: {parts[2]}")
+                    elif action == 'run' and len(parts) > 2:
+                        if self.job_scheduler.run_now(parts[2]):
+                            print(f"⏰ Queued a run of {parts[2]}")
+                        else:
+                            print(f"❌ No idle scheduled job with ID: {parts[2]}")
+                    elif action in ('pause', 'resume') and len(parts) > 2:
+                        job_ids = list(self.job_scheduler.jobs) if parts[2].lower() == 'all' else [parts[2]]
+                        changed = self.job_scheduler.set_enabled(job_ids, action == 'resume')
+                        print(f"⏰ {changed} jobs {'resumed' if action == 'resume' else 'paused'}")
+                    else:
+                        print("Usage: job add <5m|every 1h|cron spec> <request> | "
+                              "job remove/run <job_id> | job pause/resume <job_id|all>")
+                    continue
+                    
+                elif user_input.lower().startswith('cancel'):
+                    parts = user_input.split()
+                    if len(parts) > 1:
+                        if not self.cancel_command(parts[1]):
+                            print(f"❌ No queued or running command with ID: {parts[1]}")
+                    else:
+                        print("Usage: cancel <command_id>")
+                    continue
+                    
+                elif user_input.lower().split()[0] == 'export' and all(
+                        option in EXPORT_OPTIONS for option in user_input.lower().split()[1:]):
+                    options = user_input.lower().split()[1:]
+                    compression = next((option for option in options if option != 'incremental'), 'gzip')
+                    self.export_session(incremental='incremental' in options, compression=compression)
+                    continue
+                    
+                elif user_input.lower().split()[0] == 'archive' and len(user_input.split()) <= 2 and all(
+                        part.replace('.', '', 1).isdigit() for part in user_input.split()[1:]):
+                    parts = user_input.split()
+                    if not self.db or not self.rtdb:
+                        print("❌ Firebase not connected")
+                    else:
+                        hours = float(parts[1]) if len(parts) > 1 else self.result_archive_age_hours
+                        archived = self.archive_old_results(max_age_hours=hours)
+                        print(f"🗄️ Archived {archived} results older than {hours:g}h")
                     continue
 
-                # Process the request
-                result = self.process_request(user_input)
+                # Process the request right here, ahead of queued remote work; the
+                # scheduler tracks it so an emergency stop can kill it too
+                self.command_queue.run_now(CommandTicket(
+                    f"local_{uuid.uuid4().hex[:12]}", user_input, self._run_interactive_command,
+                    source='interactive', priority='interactive', submitter='console', owner=self.device_id
+                ))
 
             except KeyboardInterrupt:
                 print("\n👋 ZYNAPSE CLI terminated by user")
                 self.send_status_to_firebase('offline', {'message': 'Device terminated by user'})
+                self.shutdown_pipeline()
                 self.is_running = False
                 break
             except Exception as e:
@@ -855,6 +4806,205 @@ Return ONLY valid JSON:
                 self.logger.error(f"Critical error in interactive mode: {str(e)}")
                 self.send_status_to_firebase('error', {'error_message': str(e)})
 
+class ZynapseHost:
+    """One process serving many device identities.
+
+    Devices share the Gemini client, the Firebase connection, the listener on
+    zynapse_broadcasts, the worker pool, the Firebase writers, the code cache
+    and the tracer. Each device keeps its own session log, safety mode, timeout
+    and analyzer mode, and has a listener on its own command partition; the
+    legacy zynapse_commands tree is only streamed in 'migration' or 'legacy'
+    command layout, and then that one stream serves every device instead.
+
+    Partitions are listened to one by one on purpose: the only single stream
+    that covers them is the zynapse_commands root, which also carries every
+    other device's commands, and the Admin SDK cannot listen to a query that
+    narrows it. N partition streams download only this host's commands.
+    """
+
+    def __init__(self, device_ids: list, api_key: str = None, firebase_config: Dict = None,
+                 gemini_client=None, firestore_client=None, realtime_db=None,
+                 max_concurrent_commands: int = 4, max_queued_commands: int = 200,
+                 connection_test: bool = True, command_layout: str = 'partitioned'):
+        if command_layout not in COMMAND_LAYOUTS:
+            raise ValueError(f"Unknown command layout: {command_layout}")
+        self.api_key = api_key
+        self.connection_test = connection_test
+        self.firebase_config = firebase_config
+        self.client = gemini_client
+        self.db = firestore_client
+        self.rtdb = realtime_db
+        self.logger = logging.getLogger(__name__)
+        self.devices = {}
+        self.command_layout = command_layout
+        self.command_listeners = {}
+        self.legacy_listener = None
+        self.broadcast_listener = None
+        self.started = False
+        
+        self.command_queue = CommandQueue(max_concurrent_commands, max_queued_commands, self.logger)
+        self.codegen_cache = CodeGenerationCache(max_entries=1024, ttl_seconds=3600, logger=self.logger)
+        self.tracer = Tracer()
+        self.background_writer = BackgroundWriter(logger=self.logger, tracer=self.tracer)
+        self.analysis_executor = ThreadPoolExecutor(max_workers=max_concurrent_commands,
+                                                    thread_name_prefix="zynapse-analysis")
+        self.status_writer = StatusWriter(lambda: self.db, debounce_seconds=0.5,
+                                          max_latency_seconds=2.0, logger=self.logger,
+                                          tracer=self.tracer)
+        atexit.register(self.status_writer.shutdown)
+        
+        self.tracer.register_gauge('zynapse_host_devices', 'Device identities served by this process',
+                                   lambda: len(self.devices))
+        self.tracer.register_gauge('zynapse_queued_commands', 'Remote commands waiting for a worker',
+                                   lambda: self.command_queue.stats()['queued'])
+        self.tracer.register_gauge('zynapse_running_commands', 'Remote commands being processed',
+                                   lambda: self.command_queue.stats()['running'])
+        self.tracer.register_gauge('zynapse_pending_writes', 'Firebase writes waiting in the background writer',
+                                   lambda: self.background_writer.pending.qsize())
+        self.metrics_server = None
+        if os.environ.get("ZYNAPSE_METRICS_PORT"):
+            self.metrics_server = MetricsServer(self.tracer, int(os.environ["ZYNAPSE_METRICS_PORT"]))
+        
+        for device_id in device_ids:
+            self.add_device(device_id)
+
+    def add_device(self, device_id: str = None) -> ZynapseFirebase:
+        """Create a device identity; the first one establishes the shared connections"""
+        device = ZynapseFirebase(
+            api_key=self.api_key,
+            firebase_config=self.firebase_config,
+            gemini_client=self.client,
+            firestore_client=self.db,
+            realtime_db=self.rtdb,
+            device_id=device_id,
+            host=self,
+            connection_test=self.connection_test,
+            command_layout=self.command_layout
+        )
+        self.client = self.client or device.client
+        if self.db is None and self.rtdb is None:
+            self.db, self.rtdb = device.db, device.rtdb
+        self.devices[device.device_id] = device
+        if self.started:
+            self._listen_for_device(device)
+        return device
+
+    def _listen_for_device(self, device: ZynapseFirebase):
+        """Subscribe to zynapse_commands/{device_id}, so a device downloads only its own partition"""
+        # The legacy tree stream already carries every partition
+        if not self.rtdb or self.command_layout != 'partitioned' or device.device_id in self.command_listeners:
+            return
+        try:
+            self.command_listeners[device.device_id] = self.rtdb.reference(
+                f'zynapse_commands/{device.device_id}'
+            ).listen(lambda event: device.on_command_event(event, 'partitioned'))
+        except Exception as e:
+            self.logger.error(f"Failed to start command listener for {device.device_id}: {str(e)}")
+
+    def start(self):
+        """Subscribe to each device's partition and to broadcasts, and mark every device ready"""
+        if self.rtdb and not self.started:
+            self.started = True
+            for device in list(self.devices.values()):
+                self._listen_for_device(device)
+            try:
+                # The legacy tree carries every device's commands and partitions,
+                # so it is only streamed while older controllers may still use it
+                if self.command_layout in ('legacy', 'migration'):
+                    self.legacy_listener = self.rtdb.reference('zynapse_commands').listen(self.on_command_tree_event)
+                self.broadcast_listener = self.rtdb.reference(BROADCASTS_PATH).listen(self.on_broadcast_event)
+            except Exception as e:
+                self.logger.error(f"Failed to start host command listener: {str(e)}")
+        # Archiving covers every device's results, so one archiver per host is enough
+        if self.devices:
+            next(iter(self.devices.values())).start_result_archiver()
+        for device in self.devices.values():
+            device.send_status_to_firebase('ready', {'message': 'Device ready for commands', 'host_mode': True})
+
+    def on_command_tree_event(self, event):
+        """Route legacy /{command_id} events to the device named in their device_id field,
+        or to the device that queued the command; in migration layout partition
+        events (/{device_id}/...) go to that device"""
+        try:
+            segments = [segment for segment in (event.path or '').split('/') if segment]
+            if segments and segments[0] in self.devices:
+                if self.command_layout == 'migration':
+                    device = self.devices[segments[0]]
+                    for partition_event in partition_events(segments, event.data):
+                        device.on_command_event(partition_event, 'partitioned')
+                return
+            if len(segments) != 1 or not isinstance(event.data, dict):
+                return
+            
+            device = self.devices.get(event.data.get('device_id'))
+            if not device:
+                # Cancel patches carry only a status; send them to the device that queued the command
+                command_id = event.data.get('id') or segments[0]
+                device = next((d for d in self.devices.values() if d.owns_command(command_id)), None)
+            if device:
+                device.on_command_event(event, 'legacy')
+        except Exception as e:
+            self.logger.error(f"Error routing Firebase command: {str(e)}")
+
+    def on_broadcast_event(self, event):
+        """Every device served here claims its own share of a broadcast"""
+        for device in list(self.devices.values()):
+            device.on_broadcast_event(event)
+
+    def show_status(self):
+        queue_stats = self.command_queue.stats()
+        print("\n" + "="*60)
+        print("ZYNAPSE HOST STATUS")
+        print("="*60)
+        print(f"Devices: {len(self.devices)}")
+        print(f"Listeners: {len(self.command_listeners)} partitions"
+              f"{', legacy tree' if self.legacy_listener else ''}{', broadcasts' if self.broadcast_listener else ''}")
+        print(f"Workers: {queue_stats['workers']} ({queue_stats['running']} running, {queue_stats['queued']} queued)")
+        for device_id, device in self.devices.items():
+            session_stats = device.session_store.stats()
+            print(f"- {device_id}: {session_stats['total_commands']} commands, "
+                  f"{session_stats['successful_executions']} successful, timeout {device.timeout_seconds}s")
+        print("="*60)
+
+    def shutdown(self):
+        for listener in [*self.command_listeners.values(), self.legacy_listener, self.broadcast_listener]:
+            if not listener:
+                continue
+            try:
+                listener.close()
+            except Exception as e:
+                self.logger.error(f"Failed to close host listener: {str(e)}")
+        self.command_listeners = {}
+        self.legacy_listener = self.broadcast_listener = None
+        self.started = False
+        for device in self.devices.values():
+            device.send_status_to_firebase('offline', {'message': 'Host shutting down'})
+        self.command_queue.shutdown()
+        self.analysis_executor.shutdown(wait=True)
+        for device in self.devices.values():
+            device.result_archiver_stop.set()
+            device.job_scheduler.shutdown()
+            device.session_store.close()
+        self.status_writer.shutdown()
+        self.background_writer.flush()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server = None
+
+    def serve_forever(self):
+        """Serve remote commands for every device until interrupted"""
+        self.start()
+        print(f"🚀 ZYNAPSE host serving {len(self.devices)} devices: {', '.join(self.devices)}")
+        print("Press Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(60)
+                self.show_status()
+        except KeyboardInterrupt:
+            print("\n👋 ZYNAPSE host stopping")
+        finally:
+            self.shutdown()
+
 def create_firebase_config_template():
     """Create Firebase configuration template file"""
     config_template = {
@@ -880,6 +5030,17 @@ def create_firebase_config_template():
 
 def main():
     """Main function with Firebase integration"""
+    parser = argparse.ArgumentParser(description="ZYNAPSE CLI with Firebase integration")
+    parser.add_argument('--no-connection-test', action='store_true',
+                        help="skip the Firestore test write at startup")
+    parser.add_argument('--startup-benchmark', action='store_true',
+                        help="print import, prompt and connection times as JSON and exit")
+    args = parser.parse_args()
+    
+    if missing_packages():
+        print(MISSING_PACKAGES_MESSAGE)
+        sys.exit(1)
+    
     try:
         print("🚀 Initializing ZYNAPSE CLI with Firebase...")
         
@@ -895,7 +5056,7 @@ def main():
                 sys.exit(1)
         
         # Check for Firebase config
-        if not os.path.exists('firebase-service-account.json'):
+        if not os.path.exists('firebase-service-account.json') and not args.startup_benchmark:
             print("⚠️ Firebase service account file not found")
             choice = input("Create template config file? (y/n): ").strip().lower()
             if choice in ['y', 'yes']:
@@ -905,11 +5066,30 @@ def main():
             else:
                 print("Continuing without Firebase configuration...")
         
-        # Initialize ZYNAPSE CLI with Firebase
-        zynapse = ZynapseFirebase(api_key=GEMINI_API_KEY)
+        command_layout = os.environ.get("ZYNAPSE_COMMAND_LAYOUT", "partitioned").strip().lower()
+        if command_layout not in COMMAND_LAYOUTS:
+            print(f"❌ Unknown ZYNAPSE_COMMAND_LAYOUT: {command_layout}. Use legacy, partitioned or migration.")
+            sys.exit(1)
+        
+        # Host mode: one process serving several device identities, given as
+        # a comma-separated list of device IDs or a number of saved ones
+        host_devices = os.environ.get("ZYNAPSE_HOST_DEVICES", "").strip()
+        if host_devices:
+            if host_devices.isdigit():
+                device_ids = [load_device_id(f"{DEVICE_ID_FILE}.{index}") for index in range(int(host_devices))]
+            else:
+                device_ids = [device_id.strip() for device_id in host_devices.split(',') if device_id.strip()]
+            ZynapseHost(device_ids, api_key=GEMINI_API_KEY, connection_test=not args.no_connection_test,
+                        command_layout=command_layout).serve_forever()
+            return
+        
+        # Initialize ZYNAPSE CLI with Firebase; connections are set up behind the prompt
+        zynapse = ZynapseFirebase(api_key=GEMINI_API_KEY, connection_test=not args.no_connection_test,
+                                  device_id=os.environ.get("ZYNAPSE_DEVICE_ID") or load_device_id(),
+                                  defer_connect=True, command_layout=command_layout)
         
         # Run interactive mode
-        zynapse.run()
+        zynapse.run(startup_benchmark=args.startup_benchmark)
         
     except ValueError as e:
         print(f"❌ Configuration Error: {str(e)}")
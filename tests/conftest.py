@@ -0,0 +1,38 @@
+"""Shared fixtures: each test runs against both agent variants"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import zynapse_benchmark as bench
+
+
+@pytest.fixture(params=['11.py', '12.py'])
+def agent_module(request):
+    return bench.load_agent_module(os.path.join(ROOT, request.param))
+
+
+@pytest.fixture
+def make_agent(agent_module, tmp_path, monkeypatch):
+    """Agents sharing in-memory Firebase fakes, run from tmp_path and shut down after the test"""
+    monkeypatch.chdir(tmp_path)
+    firestore, rtdb = bench.FakeFirestore(), bench.FakeRealtimeDatabase()
+    agents = []
+
+    def make(device_id, **options):
+        agent = agent_module.ZynapseFirebase(gemini_client=bench.FakeGeminiClient(0, 0), firestore_client=firestore,
+                                             realtime_db=rtdb, device_id=device_id, defer_connect=True, **options)
+        agents.append(agent)
+        return agent
+
+    make.firestore, make.rtdb = firestore, rtdb
+    yield make
+    for agent in agents:
+        # Agents that connected (e.g. to export) subscribe on a background thread
+        if agent.firebase_listener_thread:
+            agent.firebase_listener_thread.join(5)
+        agent.stop_command_listeners()
+        agent.shutdown_pipeline()
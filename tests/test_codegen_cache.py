@@ -0,0 +1,30 @@
+"""Code generation cache keys and lookups"""
+
+
+def cache_key(cache, request):
+    return cache.make_key(request, 'gemini-test', 'system prompt')
+
+
+def test_case_distinct_requests_miss(agent_module):
+    cache = agent_module.CodeGenerationCache()
+    cache.put(cache_key(cache, 'create file Foo.txt'), {'code': "New-Item Foo.txt"})
+
+    assert cache.get(cache_key(cache, 'create file foo.txt')) is None
+    assert cache.get(cache_key(cache, 'create file Foo.txt!')) is None
+    assert cache.get(cache_key(cache, 'create file Foo.txt')) == {'code': "New-Item Foo.txt"}
+
+
+def test_whitespace_only_differences_hit(agent_module):
+    cache = agent_module.CodeGenerationCache()
+    cache.put(cache_key(cache, 'show  running processes'), {'code': 'Get-Process'})
+
+    assert cache.get(cache_key(cache, ' show running\tprocesses ')) == {'code': 'Get-Process'}
+    assert cache.stats()['hits'] == 1
+
+
+def test_key_covers_model_and_system_prompt(agent_module):
+    cache = agent_module.CodeGenerationCache()
+    key = cache.make_key('check disk', 'gemini-test', 'system prompt')
+    assert key == cache.make_key('check  disk', 'gemini-test', 'system prompt')
+    assert key != cache.make_key('check disk', 'gemini-other', 'system prompt')
+    assert key != cache.make_key('check disk', 'gemini-test', 'system prompt, structured output')
@@ -0,0 +1,56 @@
+"""Command queue dispatch order: priority classes, then round-robin per submitter"""
+import queue
+import threading
+import time
+
+import pytest
+
+
+def make_ticket(module, command_id, order, priority='remote', submitter=None, gate=None):
+    def handler(ticket):
+        order.append(ticket.command_id)
+        if gate:
+            gate.wait(5)
+    return module.CommandTicket(command_id, command_id, handler, priority=priority, submitter=submitter)
+
+
+def test_priority_then_round_robin(agent_module):
+    command_queue = agent_module.CommandQueue(max_workers=1)
+    order, gate = [], threading.Event()
+    try:
+        command_queue.submit(make_ticket(agent_module, 'blocker', order, gate=gate))
+        while not order:
+            time.sleep(0.01)
+        positions = [command_queue.submit(make_ticket(agent_module, command_id, order, priority, submitter))
+                     for command_id, priority, submitter in [
+                         ('a1', 'remote', 'alice'), ('a2', 'remote', 'alice'), ('a3', 'remote', 'alice'),
+                         ('b1', 'remote', 'bob'), ('x1', 'batch', 'alice'), ('i1', 'interactive', 'carol')]]
+        # bob's first command goes ahead of alice's second; interactive jumps every remote one
+        assert positions == [1, 2, 3, 2, 5, 1]
+
+        gate.set()
+        for _ in range(100):
+            if command_queue.stats()['completed'] == 7:
+                break
+            time.sleep(0.05)
+        assert order == ['blocker', 'i1', 'a1', 'b1', 'a2', 'a3', 'x1']
+    finally:
+        gate.set()
+        command_queue.shutdown()
+
+
+def test_full_queue_rejects(agent_module):
+    command_queue = agent_module.CommandQueue(max_workers=1, max_queue_size=2)
+    order, gate = [], threading.Event()
+    try:
+        command_queue.submit(make_ticket(agent_module, 'blocker', order, gate=gate))
+        while not order:
+            time.sleep(0.01)
+        command_queue.submit(make_ticket(agent_module, 'c1', order))
+        command_queue.submit(make_ticket(agent_module, 'c2', order))
+        with pytest.raises(queue.Full):
+            command_queue.submit(make_ticket(agent_module, 'c3', order))
+        assert command_queue.stats()['rejected'] == 1
+    finally:
+        gate.set()
+        command_queue.shutdown()
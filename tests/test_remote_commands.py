@@ -0,0 +1,95 @@
+"""Claiming remote commands and sending their results through the Firebase fakes"""
+import threading
+
+
+def test_only_one_agent_claims_a_command(make_agent):
+    agents = [make_agent(f'agent-{index}') for index in range(4)]
+    node = make_agent.rtdb.reference('zynapse_commands/agent-0/c1')
+    node.set({'id': 'c1', 'command': 'check disk', 'status': 'pending'})
+
+    results = {}
+    barrier = threading.Barrier(len(agents))
+
+    def claim(agent):
+        barrier.wait()
+        results[agent.device_id] = agent.claim_command('c1', 'zynapse_commands/agent-0/c1')
+
+    threads = [threading.Thread(target=claim, args=(agent,)) for agent in agents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [device_id for device_id, claimed in results.items() if claimed]
+    assert len(winners) == 1
+    claimed = node.get()
+    assert claimed['status'] == 'queued' and claimed['claimed_by'] == winners[0]
+    assert claimed['claim_id'] and claimed['command'] == 'check disk'
+    assert sum(agent.command_event_stats['claimed'] for agent in agents) == 1
+
+
+def test_broadcast_claim_creates_the_claim_node(make_agent):
+    agent = make_agent('device-1')
+    claim_path = 'zynapse_broadcast_claims/b1/device-1'
+    assert agent.claim_command('b1_device-1', claim_path)
+    assert not agent.claim_command('b1_device-1', claim_path)
+    assert make_agent.rtdb.reference(claim_path).get()['claimed_by'] == 'device-1'
+
+
+def test_large_output_goes_to_a_blob(agent_module, make_agent):
+    agent = make_agent('device-1')
+    make_agent.rtdb.reference('zynapse_commands/device-1/c1').set({'id': 'c1', 'status': 'processing'})
+    output = 'line\n' * 5000
+    agent.send_result_to_firebase('c1', {'success': True, 'execution_success': True, 'output': output,
+                                         'metrics': {'execution_time': 1.5, 'exit_code': 0}})
+
+    result = make_agent.rtdb.reference('zynapse_results/c1').get()
+    assert result['output'] == output[:agent_module.RESULT_INLINE_OUTPUT_CHARS]
+    assert result['output_truncated'] and result['output_size'] == len(output)
+    blob = make_agent.rtdb.reference(result['output_ref']).get()
+    assert agent_module.decode_output_blob(blob) == output
+
+    # The command node keeps only the outcome and a reference
+    node = make_agent.rtdb.reference('zynapse_commands/device-1/c1').get()
+    assert node['status'] == 'completed' and node['result_ref'] == 'zynapse_results/c1'
+    assert 'output' not in node
+
+
+def test_structured_result_keeps_data_not_text(make_agent):
+    agent = make_agent('device-1')
+    agent.send_result_to_firebase('c2', {'success': True, 'output': '{"FreeGB": 10.5}', 'data': {'FreeGB': 10.5}})
+    result = make_agent.rtdb.reference('zynapse_results/c2').get()
+    assert result['data'] == {'FreeGB': 10.5}
+    assert result['output'] == '' and result['output_format'] == 'json'
+
+
+def test_compact_result_bounds_the_archived_output(agent_module):
+    result = {'device_id': 'device-1', 'status': 'completed', 'success': True, 'output': 'x' * 10000,
+              'code_info': {'code': 'Get-Process', 'safety_level': 'SAFE'},
+              'metrics': {'execution_time': 2.0, 'exit_code': 0}, 'analysis': {'request_fulfilled': True}}
+    archived = agent_module.compact_result('c1', result)
+    assert archived['output'] == 'x' * agent_module.ARCHIVE_OUTPUT_CHARS
+    assert archived['output_truncated']
+    assert (archived['code'], archived['exit_code'], archived['request_fulfilled']) == ('Get-Process', 0, True)
+
+    structured = agent_module.compact_result('c2', {'data': {'FreeGB': 10.5}})
+    assert structured['output'] == '{"FreeGB":10.5}' and not structured['output_truncated']
+
+
+def test_broadcast_reduction(agent_module):
+    result = {'success': True, 'metrics': {'execution_time': 0.5, 'exit_code': 0}}
+    entry, counters = agent_module.broadcast_reduction(
+        result, [{'Name': 'C', 'FreeGB': 10.5, 'Ready': True}, {'Name': 'D', 'FreeGB': 2}]
+    )
+    assert entry['outcome'] == 'succeeded' and entry['data'][1] == {'Name': 'D', 'FreeGB': 2}
+    # Booleans and text are not summed
+    assert counters == {'completed': 1, 'succeeded': 1, 'execution_seconds_total': 0.5,
+                        'totals': {'FreeGB': 12.5}, 'totals_count': {'FreeGB': 2}}
+
+    entry, counters = agent_module.broadcast_reduction({'cancelled': True, 'output': 'x' * 1000})
+    assert entry['outcome'] == 'cancelled'
+    assert len(entry['output']) == agent_module.BROADCAST_ENTRY_OUTPUT_CHARS
+    assert counters == {'completed': 1, 'cancelled': 1}
+
+    entry, _ = agent_module.broadcast_reduction(result, ['x' * 100] * 100)
+    assert entry['data_truncated'] and 'data' not in entry
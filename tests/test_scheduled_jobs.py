@@ -0,0 +1,53 @@
+"""Scheduled jobs: schedules and reloading after an agent restart"""
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+import zynapse_benchmark as bench
+
+
+def start_agent(module):
+    # What main() does, without connecting to Gemini or Firebase
+    return module.ZynapseFirebase(gemini_client=bench.FakeGeminiClient(0, 0),
+                                  device_id=module.load_device_id(), defer_connect=True)
+
+
+def test_jobs_reload_after_restart(agent_module, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    agent = start_agent(agent_module)
+    job = agent.create_job('check disk space', 'every 5m',
+                           {'code': 'Get-PSDrive C', 'safety_level': 'SAFE', 'explanation': 'Disk usage'})
+    agent.job_scheduler.shutdown()
+    agent.session_store.close()
+
+    restarted = start_agent(agent_module)
+    try:
+        assert restarted.device_id == agent.device_id
+        assert list(restarted.job_scheduler.jobs) == [job.job_id]
+        restored = restarted.job_scheduler.jobs[job.job_id]
+        assert restored.request == 'check disk space'
+        assert restored.code_info['code'] == 'Get-PSDrive C'
+        # One jobs file, not one per start
+        assert [name for name in os.listdir(tmp_path) if name.startswith('zynapse_jobs_')] == \
+            [f'zynapse_jobs_{agent.device_id}.json']
+    finally:
+        restarted.job_scheduler.shutdown()
+        restarted.session_store.close()
+
+
+def test_cron_next_run_steps_to_rare_dates(agent_module):
+    after = datetime(2026, 3, 1, 10, 30).timestamp()
+    assert datetime.fromtimestamp(agent_module.parse_schedule('15 9 29 2 *')(after)) == datetime(2028, 2, 29, 9, 15)
+    assert datetime.fromtimestamp(agent_module.parse_schedule('*/20 22 * * 1')(after)) == datetime(2026, 3, 2, 22, 0)
+    assert datetime.fromtimestamp(agent_module.parse_schedule('45 10 * * *')(after)) == datetime(2026, 3, 1, 10, 45)
+
+
+def test_impossible_cron_spec_fails_fast(agent_module):
+    started = time.perf_counter()
+    with pytest.raises(ValueError, match='never runs'):
+        agent_module.parse_schedule('0 0 30 2 *')
+    with pytest.raises(ValueError):
+        agent_module.split_schedule('0 0 31 4 * check disk')
+    assert time.perf_counter() - started < 0.2
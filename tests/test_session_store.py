@@ -0,0 +1,68 @@
+"""Session log retention, bounded counters and incremental export"""
+import json
+import os
+
+
+def test_unique_requests_stop_at_limit(agent_module):
+    store = agent_module.SessionStore(None, 'bounded', unique_limit=3)
+    for index in range(10):
+        store.append({'request': f'request {index}'})
+    stats = store.stats()
+    assert stats['total_commands'] == 10
+    assert stats['unique_commands'] == 3
+    assert stats['unique_commands_capped']
+
+
+def test_segments_kept_unless_limited(agent_module, tmp_path):
+    kept = agent_module.SessionStore(str(tmp_path / 'all'), 'kept', segment_max_bytes=1, max_segments=0)
+    bounded = agent_module.SessionStore(str(tmp_path / 'bounded'), 'bounded', segment_max_bytes=1, max_segments=2)
+    for index in range(5):
+        kept.append({'request': f'request {index}'})
+        bounded.append({'request': f'request {index}'})
+    kept.close()
+    bounded.close()
+
+    assert len(os.listdir(tmp_path / 'all')) == 5
+    assert len(os.listdir(tmp_path / 'bounded')) == 2
+    assert bounded.stats()['dropped_segments'] == 3
+    assert [entry['seq'] for entry in kept.iter_entries()] == [1, 2, 3, 4, 5]
+    assert [entry['seq'] for entry in bounded.iter_entries()] == [4, 5]
+
+
+def read_export(firestore, device_id):
+    """Records of the newest export, joined from its Firestore parts"""
+    manifest_path = max(path for path in firestore.documents if path.startswith(f'zynapse_exports/{device_id}_')
+                        and path.count('/') == 1)
+    parts = sorted(path for path in firestore.documents if path.startswith(manifest_path + '/parts/'))
+    text = ''.join(firestore.documents[path]['data'] for path in parts)
+    return firestore.documents[manifest_path], [json.loads(line) for line in text.splitlines()]
+
+
+def test_incremental_export_writes_only_new_entries(make_agent, tmp_path):
+    agent = make_agent('export-device')
+    for index in range(3):
+        agent.session_store.append({'request': f'request {index}', 'execution_success': True})
+
+    agent.export_session(incremental=True, compression='none')
+    manifest, records = read_export(make_agent.firestore, 'export-device')
+    assert [record['seq'] for record in records[1:]] == [1, 2, 3]
+    assert (manifest['from_seq'], manifest['to_seq'], manifest['record_count']) == (1, 3, 3)
+    exported = [name for name in os.listdir(tmp_path) if name.startswith('zynapse_firebase_session_')]
+    with open(tmp_path / exported[0], encoding='utf-8') as f:
+        assert [json.loads(line)['record_type'] for line in f] == ['session', 'entry', 'entry', 'entry']
+
+    agent.session_store.append({'request': 'request 3'})
+    agent.export_session(incremental=True, compression='none')
+    manifest, records = read_export(make_agent.firestore, 'export-device')
+    assert records[0]['since_seq'] == 3
+    assert [record['request'] for record in records[1:]] == ['request 3']
+    assert agent.last_export_seq == 4
+
+
+def test_failed_upload_keeps_the_export_position(make_agent):
+    agent = make_agent('export-device')
+    agent.session_store.append({'request': 'request 0'})
+    agent._upload_export_part = lambda export_ref, index, text: None
+
+    agent.export_session(incremental=True, compression='none')
+    assert agent.last_export_seq == 0
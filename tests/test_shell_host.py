@@ -0,0 +1,24 @@
+"""Warm shell hosts report the real exit code"""
+import shutil
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not shutil.which('bash'), reason="needs bash for the POSIX host")
+
+
+def test_exit_codes_come_from_the_command(agent_module):
+    host = agent_module.ShellHost('bash')
+    try:
+        assert host.run('echo hi', 5) == (0, 'hi\n', '', False)
+        assert host.run('exit 3', 5)[0] == 3
+    finally:
+        host.process.kill()
+
+
+def test_host_exit_reports_its_own_code(agent_module):
+    host = agent_module.ShellHost('bash')
+    try:
+        returncode, _, stderr, timed_out = host.run('kill -9 $$', 5)
+        assert (returncode, stderr, timed_out) == (-9, 'Shell host exited unexpectedly', False)
+    finally:
+        host.process.kill()
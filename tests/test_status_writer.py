@@ -0,0 +1,47 @@
+"""Batched Firestore status writes, with and without firebase-admin"""
+import zynapse_benchmark as bench
+
+
+def test_status_write_reaches_fake_firestore(make_agent):
+    agent = make_agent('status-device')
+    agent.send_status_to_firebase('ready')
+    agent.status_writer.flush()
+
+    documents = make_agent.firestore.documents
+    assert documents['zynapse_devices/status-device']['status'] == 'ready'
+    assert documents['zynapse_fleet/stats']['devices_by_status'] == {'ready': 1}
+    assert agent.status_writer.stats()['failed_batches'] == 0
+
+
+def test_fields_written_when_counters_cannot_be(agent_module, monkeypatch):
+    class PlainFirestore(bench.FakeFirestore):
+        Increment = None
+
+    def missing_packages():
+        raise ImportError(agent_module.MISSING_PACKAGES_MESSAGE)
+
+    monkeypatch.setattr(agent_module, 'import_firebase', missing_packages)
+    firestore = PlainFirestore()
+    writer = agent_module.StatusWriter(lambda: firestore)
+    writer.update('zynapse_devices', 'plain', {'status': 'ready'})
+    writer.increment('zynapse_fleet', 'stats', {'devices_by_status': {'ready': 1}})
+    writer.flush()
+
+    assert firestore.documents['zynapse_devices/plain'] == {'status': 'ready'}
+    assert writer.stats()['failed_batches'] == 0
+    assert 'zynapse_fleet/stats' not in firestore.documents
+
+
+def test_broadcast_counter_shards_add_up(agent_module):
+    firestore = bench.FakeFirestore()
+    writer = agent_module.StatusWriter(lambda: firestore)
+    for index in range(60):
+        collection, shard = agent_module.broadcast_shard('b1', f'device-{index}')
+        writer.increment(collection, shard, {'claimed': 1, 'totals': {'FreeGB': 1.5}})
+    writer.flush()
+
+    shards = [document for path, document in firestore.documents.items()
+              if path.startswith('zynapse_broadcasts/b1/shards/')]
+    assert len(shards) == agent_module.BROADCAST_COUNTER_SHARDS
+    assert sum(shard['claimed'] for shard in shards) == 60
+    assert sum(shard['totals']['FreeGB'] for shard in shards) == 90
@@ -0,0 +1,33 @@
+"""Incremental parsing of the JSON object Gemini streams back"""
+
+RESPONSE = (
+    '```json\n'
+    '{"code": "Write-Output \\"{a}\\"", "safety_level": "SAFE", '
+    '"nested": {"x": [1, {"y": "}"}]}, "n": -1.5e2, "ok": true, "none": null}\n'
+    '```'
+)
+
+
+def test_fields_arrive_as_soon_as_complete(agent_module):
+    seen = []
+    parser = agent_module.StreamingJSONFields(lambda key, value: seen.append((key, value)))
+    code_done = RESPONSE.index('"safety_level"')
+    for index, char in enumerate(RESPONSE):
+        parser.feed(char)
+        if index == code_done:
+            assert seen == [('code', 'Write-Output "{a}"')]
+
+    assert parser.complete and not parser.failed
+    assert seen == [('code', 'Write-Output "{a}"'), ('safety_level', 'SAFE'),
+                    ('nested', {'x': [1, {'y': '}'}]}), ('n', -150.0), ('ok', True), ('none', None)]
+
+
+def test_chunk_boundaries_do_not_matter(agent_module):
+    whole = agent_module.StreamingJSONFields()
+    whole.feed(RESPONSE)
+    for size in (2, 3, 7, 64):
+        chunked = agent_module.StreamingJSONFields()
+        for start in range(0, len(RESPONSE), size):
+            chunked.feed(RESPONSE[start:start + size])
+        assert chunked.fields == whole.fields
+        assert chunked.complete
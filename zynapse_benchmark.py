@@ -0,0 +1,740 @@
+#!/usr/bin/env python3
+"""
+ZYNAPSE Offline Benchmark
+In-process stand-ins for Firestore, the Realtime Database, Gemini and the shell,
+plus a harness that drives synthetic remote commands through
+listen_for_commands -> process_request -> send_result_to_firebase
+and reports per-phase latency percentiles and throughput.
+"""
+
+import argparse
+import contextlib
+import copy
+import importlib.util
+import io
+import json
+import math
+import os
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Any, List
+
+
+# ---------------------------------------------------------------------------
+# Realtime Database stand-in (firebase_admin.db)
+# ---------------------------------------------------------------------------
+
+def split_path(path: str) -> List[str]:
+    return [segment for segment in (path or '').split('/') if segment]
+
+def payload_size(data: Any) -> int:
+    """Approximate bytes on the wire for one write"""
+    return len(json.dumps(data, default=str).encode('utf-8'))
+
+class FakeEvent:
+    """Mirrors firebase_admin.db.Event"""
+
+    def __init__(self, event_type: str, path: str, data: Any):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+class FakeListener:
+    """One listen() registration, dispatching events on its own thread like the Admin SDK"""
+
+    def __init__(self, rtdb, segments: List[str], callback):
+        self.rtdb = rtdb
+        self.segments = segments
+        self.callback = callback
+        self.events = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True, name="fake-rtdb-listener")
+        self.thread.start()
+
+    def notify(self, event_type: str, segments: List[str], data: Any):
+        if segments[:len(self.segments)] != self.segments:
+            return
+        relative = segments[len(self.segments):]
+        self.events.put(FakeEvent(event_type, '/' + '/'.join(relative), copy.deepcopy(data)))
+
+    def close(self):
+        self.closed = True
+        self.rtdb._remove_listener(self)
+        self.events.put(None)
+
+    def _run(self):
+        while True:
+            event = self.events.get()
+            if event is None or self.closed:
+                return
+            try:
+                self.callback(event)
+            except Exception as e:
+                print(f"⚠️ Listener callback failed: {str(e)}", file=sys.stderr)
+
+class FakeQuery:
+    """Mirrors firebase_admin.db.Query for order_by_child with range and limit filters"""
+
+    def __init__(self, reference, child_path: str):
+        self.reference = reference
+        self.child_segments = split_path(child_path)
+        self.start = self.end = self.equal = None
+        self.limit_first = self.limit_last = None
+
+    def start_at(self, value):
+        self.start = value
+        return self
+
+    def end_at(self, value):
+        self.end = value
+        return self
+
+    def equal_to(self, value):
+        self.equal = value
+        return self
+
+    def limit_to_first(self, limit: int):
+        self.limit_first = limit
+        return self
+
+    def limit_to_last(self, limit: int):
+        self.limit_last = limit
+        return self
+
+    def get(self):
+        children = self.reference.get() or {}
+        if not isinstance(children, dict):
+            return {}
+        matches = []
+        for key, child in children.items():
+            value = child
+            for segment in self.child_segments:
+                value = value.get(segment) if isinstance(value, dict) else None
+            if self.equal is not None and value != self.equal:
+                continue
+            # Children without the value sort first and only pass an end_at filter
+            if value is None:
+                if self.start is not None or self.equal is not None:
+                    continue
+            elif (self.start is not None and str(value) < str(self.start)) or \
+                    (self.end is not None and str(value) > str(self.end)):
+                continue
+            matches.append((value is not None, str(value), key, child))
+        matches.sort(key=lambda match: match[:3])
+        if self.limit_first is not None:
+            matches = matches[:self.limit_first]
+        if self.limit_last is not None:
+            matches = matches[-self.limit_last:]
+        return {key: child for _, _, key, child in matches}
+
+class FakeReference:
+    """Mirrors firebase_admin.db.Reference for the calls the agent makes"""
+
+    def __init__(self, rtdb, path: str):
+        self.rtdb = rtdb
+        self.segments = split_path(path)
+        self.path = '/' + '/'.join(self.segments)
+        self.key = self.segments[-1] if self.segments else None
+
+    def child(self, path: str):
+        return FakeReference(self.rtdb, '/'.join(self.segments + split_path(path)))
+
+    def order_by_child(self, path: str):
+        return FakeQuery(self, path)
+
+    def get(self, shallow: bool = False):
+        with self.rtdb.lock:
+            value = self.rtdb._get(self.segments)
+            if shallow and isinstance(value, dict):
+                return {key: True for key in value}
+            return copy.deepcopy(value)
+
+    def set(self, value):
+        self.rtdb._write('put', self.segments, value, lambda: self.rtdb._set(self.segments, copy.deepcopy(value)))
+
+    def update(self, value: Dict):
+        def apply():
+            for key, field in value.items():
+                self.rtdb._set(self.segments + split_path(key), copy.deepcopy(field))
+        self.rtdb._write('patch', self.segments, value, apply)
+
+    def delete(self):
+        self.set(None)
+
+    def push(self, value=None):
+        child = self.child(f"-{uuid.uuid4().hex[:19]}")
+        child.set(value if value is not None else '')
+        return child
+
+    def transaction(self, transaction_update):
+        with self.rtdb.lock:
+            new_value = transaction_update(copy.deepcopy(self.rtdb._get(self.segments)))
+            self.set(new_value)
+            return new_value
+
+    def listen(self, callback):
+        listener = FakeListener(self.rtdb, self.segments, callback)
+        with self.rtdb.lock:
+            self.rtdb.listeners.append(listener)
+            initial = copy.deepcopy(self.rtdb._get(self.segments))
+        listener.events.put(FakeEvent('put', '/', initial))
+        return listener
+
+class FakeRealtimeDatabase:
+    """In-memory JSON tree with reference(), listen() events and transactions"""
+
+    def __init__(self, write_latency: float = 0.0):
+        self.tree = {}
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.write_latency = write_latency
+        self.write_count = 0
+        self.write_bytes = 0
+
+    def reference(self, path: str = '/'):
+        return FakeReference(self, path)
+
+    def _get(self, segments: List[str]):
+        node = self.tree
+        for segment in segments:
+            if not isinstance(node, dict) or segment not in node:
+                return None
+            node = node[segment]
+        return node
+
+    def _set(self, segments: List[str], value):
+        if not segments:
+            self.tree = value if isinstance(value, dict) else {}
+            return
+        node = self.tree
+        for segment in segments[:-1]:
+            if not isinstance(node.get(segment), dict):
+                if value is None:
+                    return
+                node[segment] = {}
+            node = node[segment]
+        if value is None:
+            node.pop(segments[-1], None)
+        else:
+            node[segments[-1]] = value
+
+    def _write(self, event_type: str, segments: List[str], data, apply):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        with self.lock:
+            apply()
+            self.write_count += 1
+            self.write_bytes += payload_size(data)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener.notify(event_type, segments, data)
+
+    def _remove_listener(self, listener: FakeListener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+
+# ---------------------------------------------------------------------------
+# Firestore stand-in (firestore.client())
+# ---------------------------------------------------------------------------
+
+class FakeIncrement:
+    """firestore.Increment: adds value to the stored number on a merge-write"""
+
+    def __init__(self, value):
+        self.value = value
+
+class FakeDocumentSnapshot:
+    def __init__(self, document_id: str, data: Dict):
+        self.id = document_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+class FakeDocumentReference:
+    def __init__(self, firestore, path: str):
+        self.firestore = firestore
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def collection(self, name: str):
+        return FakeCollectionReference(self.firestore, f"{self.path}/{name}")
+
+    def set(self, data: Dict, merge: bool = False):
+        self.firestore._write(lambda: self.firestore._set(self.path, data, merge), data)
+
+    def update(self, data: Dict):
+        self.firestore._write(lambda: self.firestore._set(self.path, data, True), data)
+
+    def delete(self):
+        self.firestore._write(lambda: self.firestore.documents.pop(self.path, None))
+
+    def get(self):
+        with self.firestore.lock:
+            return FakeDocumentSnapshot(self.id, copy.deepcopy(self.firestore.documents.get(self.path)))
+
+class FakeCollectionReference:
+    def __init__(self, firestore, path: str):
+        self.firestore = firestore
+        self.path = path
+
+    def document(self, document_id: str = None):
+        return FakeDocumentReference(self.firestore, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data: Dict):
+        document = self.document()
+        document.set(data)
+        return datetime.now(), document
+
+    def stream(self):
+        prefix = self.path + '/'
+        with self.firestore.lock:
+            items = [(path, data) for path, data in self.firestore.documents.items()
+                     if path.startswith(prefix) and '/' not in path[len(prefix):]]
+        for path, data in items:
+            yield FakeDocumentSnapshot(path.rsplit('/', 1)[-1], copy.deepcopy(data))
+
+class FakeWriteBatch:
+    def __init__(self, firestore):
+        self.firestore = firestore
+        self.operations = []
+        self.payloads = []
+
+    def set(self, document: FakeDocumentReference, data: Dict, merge: bool = False):
+        self.operations.append(lambda: self.firestore._set(document.path, data, merge))
+        self.payloads.append(data)
+
+    def update(self, document: FakeDocumentReference, data: Dict):
+        self.operations.append(lambda: self.firestore._set(document.path, data, True))
+        self.payloads.append(data)
+
+    def delete(self, document: FakeDocumentReference):
+        self.operations.append(lambda: self.firestore.documents.pop(document.path, None))
+
+    def commit(self):
+        def apply():
+            for operation in self.operations:
+                operation()
+        self.firestore._write(apply, self.payloads)
+
+class FakeFirestore:
+    """In-memory document store keyed by full document path"""
+
+    # Counter transform the agent uses with this client instead of firebase-admin's
+    Increment = FakeIncrement
+
+    def __init__(self, write_latency: float = 0.0):
+        self.documents = {}
+        self.lock = threading.RLock()
+        self.write_latency = write_latency
+        self.write_count = 0
+        self.write_bytes = 0
+
+    def collection(self, name: str):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def _set(self, path: str, data: Dict, merge: bool):
+        if not merge or not isinstance(self.documents.get(path), dict):
+            self.documents[path] = {}
+        self._merge(self.documents[path], data)
+
+    def _merge(self, target: Dict, data: Dict):
+        # Nested maps merge field by field; Increment transforms add to the stored number
+        for key, value in data.items():
+            if isinstance(value, dict):
+                if not isinstance(target.get(key), dict):
+                    target[key] = {}
+                self._merge(target[key], value)
+            elif isinstance(value, FakeIncrement) or type(value).__name__ == 'Increment':
+                current = target.get(key)
+                target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+            else:
+                target[key] = copy.deepcopy(value)
+
+    def _write(self, apply, data: Any = None):
+        # One round-trip per write or batch commit
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        with self.lock:
+            apply()
+            self.write_count += 1
+            self.write_bytes += payload_size(data)
+
+
+# ---------------------------------------------------------------------------
+# Gemini and shell stand-ins
+# ---------------------------------------------------------------------------
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeGeminiModels:
+    def __init__(self, client):
+        self.client = client
+
+    def generate_content_stream(self, model: str, contents, config=None):
+        # Content as plain dicts (what the agent sends) or SDK objects
+        prompt = ''.join(
+            (part.get('text') if isinstance(part, dict) else getattr(part, 'text', '')) or ''
+            for content in contents
+            for part in ((content.get('parts') if isinstance(content, dict) else getattr(content, 'parts', None)) or [])
+        )
+        kind = 'analysis' if 'Analyze this execution' in prompt else 'generation'
+        with self.client.lock:
+            self.client.calls[kind] += 1
+        response = json.dumps(self.client.responses[kind])
+
+        time.sleep(self.client.first_token_latency)
+        for start in range(0, len(response), self.client.chunk_chars):
+            if start:
+                time.sleep(self.client.chunk_delay)
+            yield FakeChunk(response[start:start + self.client.chunk_chars])
+
+class FakeGeminiClient:
+    """Stand-in for genai.Client that streams canned JSON with configurable latency"""
+
+    def __init__(self, first_token_latency: float = 0.4, chunk_delay: float = 0.02,
+                 chunk_chars: int = 40, code: str = "echo benchmark"):
+        self.first_token_latency = first_token_latency
+        self.chunk_delay = chunk_delay
+        self.chunk_chars = max(1, chunk_chars)
+        self.calls = {'generation': 0, 'analysis': 0}
+        self.lock = threading.Lock()
+        self.responses = {
+            'generation': {
+                "code": code,
+                "safety_level": "SAFE",
+                "explanation": "Benchmark command",
+                "prerequisites": "None",
+                "estimated_time": "1 second",
+                "reversible": True
+            },
+            'analysis': {
+                "request_fulfilled": True,
+                "execution_quality": "good",
+                "issues_found": [],
+                "suggestions": ["Review output"],
+                "risk_level": "low",
+                "next_steps": "Task completed"
+            }
+        }
+        self.models = FakeGeminiModels(self)
+
+class FakeShellExecutor:
+    """Replaces execute_powershell_with_monitoring with a timed sleep and synthetic output"""
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.1, output_lines: int = 20,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.output_lines = output_lines
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def execute(self, command: str, command_id: str = None, process_key: str = None, echo: bool = True):
+        # Same signature as the agent method; nothing is printed and there is no
+        # process to cancel, so process_key and echo have no effect here
+        with self.lock:
+            duration = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.failure_rate
+
+        start = datetime.now()
+        time.sleep(duration)
+        output = "\n".join(f"{index:04d} {command}" for index in range(self.output_lines))
+        metrics = {
+            "start_time": start.isoformat(),
+            "end_time": datetime.now().isoformat(),
+            "execution_time": round(duration, 2),
+            "exit_code": 1 if failed else 0,
+            "timeout": False,
+            "executor": "fake"
+        }
+        return (False, "Error: simulated failure", metrics) if failed else (True, output, metrics)
+
+
+# ---------------------------------------------------------------------------
+# Harness
+# ---------------------------------------------------------------------------
+
+REQUEST_TEMPLATES = [
+    "list files in current directory",
+    "show system information",
+    "check memory usage",
+    "show running processes",
+    "check disk space",
+    "show network adapters",
+    "list installed services",
+    "show environment variables",
+]
+
+def load_agent_module(path: str):
+    """Import an agent script (e.g. 12.py) by file path"""
+    spec = importlib.util.spec_from_file_location("zynapse_agent", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'mean': sum(values) / len(values) if values else 0.0
+    }
+
+def run_benchmark(args) -> Dict[str, Any]:
+    """Push args.commands commands through one agent and collect timings"""
+    module = load_agent_module(os.path.abspath(args.agent))
+
+    rtdb = FakeRealtimeDatabase(write_latency=args.rtdb_latency)
+    firestore = FakeFirestore(write_latency=args.firestore_latency)
+    gemini = FakeGeminiClient(first_token_latency=args.gemini_latency, chunk_delay=args.chunk_delay)
+    shell = FakeShellExecutor(latency=args.exec_latency, jitter=args.exec_jitter, output_lines=args.output_lines,
+                              failure_rate=args.failure_rate, seed=args.seed)
+
+    agent = module.ZynapseFirebase(gemini_client=gemini, firestore_client=firestore, realtime_db=rtdb)
+    agent.logger.setLevel('WARNING')
+    agent.analyzer_mode = args.analyzer
+    agent.max_concurrent_commands = args.workers
+    agent.command_queue.set_workers(args.workers)
+    agent.command_queue.max_queue_size = max(agent.command_queue.max_queue_size, args.commands)
+    if args.shell:
+        agent.shell_binary = args.shell
+    else:
+        agent.execute_powershell_with_monitoring = shell.execute
+
+    submitted = {}
+    result_at = {}
+    finished_at = {}
+    all_done = threading.Event()
+    lock = threading.Lock()
+
+    def on_result(event):
+        segments = split_path(event.path)
+        if len(segments) != 1 or not isinstance(event.data, dict):
+            return
+        command_id = segments[0]
+        now = time.monotonic()
+        with lock:
+            result_at.setdefault(command_id, now)
+            if not event.data.get('analysis_pending', False):
+                finished_at.setdefault(command_id, now)
+                if len(finished_at) >= args.commands:
+                    all_done.set()
+
+    results_listener = rtdb.reference('zynapse_results').listen(on_result)
+    # The agent subscribes itself on startup; move it to the partitioned layout once it has
+    agent.firebase_listener_thread.join()
+    agent.set_command_layout('partitioned')
+
+    start = time.monotonic()
+    for index in range(args.commands):
+        command_id = f"bench_{index:06d}"
+        variant = index % args.unique_requests
+        request = f"{REQUEST_TEMPLATES[variant % len(REQUEST_TEMPLATES)]} #{variant}"
+        with lock:
+            submitted[command_id] = time.monotonic()
+        rtdb.reference(f'zynapse_commands/{agent.device_id}/{command_id}').set({
+            'id': command_id,
+            'device_id': agent.device_id,
+            'command': request,
+            'status': 'pending',
+            'timestamp': datetime.now().isoformat()
+        })
+        if args.rate:
+            time.sleep(1 / args.rate)
+
+    completed = all_done.wait(args.max_wait)
+    elapsed = (max(finished_at.values()) if finished_at else time.monotonic()) - start
+
+    results_listener.close()
+    agent.stop_command_listeners()
+    agent.command_queue.shutdown()
+    agent.shutdown_pipeline()
+
+    phases = {name: [] for name in ('queue_wait', 'generation', 'execution', 'analysis',
+                                    'result_latency', 'end_to_end')}
+    for command_id, submitted_at in submitted.items():
+        command = rtdb.reference(f'zynapse_commands/{agent.device_id}/{command_id}').get() or {}
+        result = rtdb.reference(f'zynapse_results/{command_id}').get() or {}
+        timings = (result.get('metrics') or command.get('metrics') or {}).get('phase_timings') or {}
+        if 'queue_wait_seconds' in command:
+            phases['queue_wait'].append(command['queue_wait_seconds'])
+        for phase in ('generation', 'execution', 'analysis'):
+            if f'{phase}_seconds' in timings:
+                phases[phase].append(timings[f'{phase}_seconds'])
+        if command_id in result_at:
+            phases['result_latency'].append(result_at[command_id] - submitted_at)
+        if command_id in finished_at:
+            phases['end_to_end'].append(finished_at[command_id] - submitted_at)
+
+    return {
+        'agent': os.path.basename(args.agent),
+        'commands': args.commands,
+        'completed': len(finished_at),
+        'timed_out': not completed,
+        'elapsed_seconds': elapsed,
+        'commands_per_second': len(finished_at) / elapsed if elapsed > 0 else 0.0,
+        'phases': {name: summarize(values) for name, values in phases.items()},
+        'gemini_calls': dict(gemini.calls),
+        'rtdb_writes': rtdb.write_count,
+        'firestore_writes': firestore.write_count,
+        'rtdb_write_bytes': rtdb.write_bytes,
+        'firestore_write_bytes': firestore.write_bytes,
+        'settings': {
+            'workers': args.workers,
+            'analyzer': args.analyzer,
+            'unique_requests': args.unique_requests,
+            'executor': args.shell or 'fake',
+            'gemini_latency': args.gemini_latency,
+            'exec_latency': args.exec_latency,
+            'output_lines': args.output_lines
+        }
+    }
+
+def run_startup_benchmark(args) -> Dict[str, Any]:
+    """Start the agent script args.startup times and collect its startup timings
+
+    Each run is a fresh interpreter started with --startup-benchmark, which prints
+    the module import time, the time to the first prompt and the time until
+    Gemini and Firebase were set up, then exits.
+    """
+    command = [sys.executable, args.agent, '--startup-benchmark']
+    if args.no_connection_test:
+        command.append('--no-connection-test')
+
+    timings = {}
+    for _ in range(args.startup):
+        start = time.perf_counter()
+        completed = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True,
+                                   text=True, encoding='utf-8', errors='replace', timeout=args.max_wait)
+        wall = time.perf_counter() - start
+        marker = next((line for line in completed.stdout.splitlines() if line.startswith('ZYNAPSE_STARTUP ')), None)
+        if marker is None:
+            raise RuntimeError(f"Agent exited without startup timings:\n{completed.stdout[-2000:]}{completed.stderr[-2000:]}")
+        for name, seconds in json.loads(marker.split(' ', 1)[1]).items():
+            timings.setdefault(name, []).append(seconds)
+        timings.setdefault('process', []).append(wall)
+
+    return {
+        'agent': os.path.basename(args.agent),
+        'runs': args.startup,
+        'connection_test': not args.no_connection_test,
+        'phases': {name: summarize(values) for name, values in timings.items()}
+    }
+
+def print_startup_report(report: Dict[str, Any]):
+    print("\n" + "="*72)
+    print(f"ZYNAPSE STARTUP - {report['agent']} ({report['runs']} runs, "
+          f"connection test {'on' if report['connection_test'] else 'off'})")
+    print("="*72)
+    print(f"{'Phase':<16}{'count':>8}{'p50':>12}{'p95':>12}{'p99':>12}{'mean':>12}")
+    for name, stats in report['phases'].items():
+        print(f"{name:<16}{stats['count']:>8}{stats['p50']:>11.3f}s{stats['p95']:>11.3f}s"
+              f"{stats['p99']:>11.3f}s{stats['mean']:>11.3f}s")
+    print("="*72)
+
+def print_report(report: Dict[str, Any]):
+    print("\n" + "="*72)
+    print(f"ZYNAPSE BENCHMARK - {report['agent']}")
+    print("="*72)
+    print(f"Settings: {', '.join(f'{key}={value}' for key, value in report['settings'].items())}")
+    print(f"Completed: {report['completed']}/{report['commands']}"
+          f"{' (timed out waiting for results)' if report['timed_out'] else ''}")
+    print(f"Elapsed: {report['elapsed_seconds']:.2f}s")
+    print(f"Throughput: {report['commands_per_second']:.2f} commands/s")
+    print(f"Gemini Calls: {report['gemini_calls']['generation']} generation, "
+          f"{report['gemini_calls']['analysis']} analysis")
+    print(f"Writes: {report['rtdb_writes']} RTDB, {report['firestore_writes']} Firestore")
+    print(f"Write Volume: {report['rtdb_write_bytes'] / 1024:.1f} KiB RTDB, "
+          f"{report['firestore_write_bytes'] / 1024:.1f} KiB Firestore")
+    print("-"*72)
+    print(f"{'Phase':<16}{'count':>8}{'p50':>12}{'p95':>12}{'p99':>12}{'mean':>12}")
+    for name, stats in report['phases'].items():
+        print(f"{name:<16}{stats['count']:>8}{stats['p50']:>11.3f}s{stats['p95']:>11.3f}s"
+              f"{stats['p99']:>11.3f}s{stats['mean']:>11.3f}s")
+    print("="*72)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for the ZYNAPSE agent")
+    parser.add_argument('--agent', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '12.py'),
+                        help="Agent script to benchmark (default: 12.py)")
+    parser.add_argument('-n', '--commands', type=int, default=50, help="Number of synthetic commands")
+    parser.add_argument('--workers', type=int, default=2, help="Concurrent remote commands")
+    parser.add_argument('--analyzer', choices=('llm', 'heuristic', 'hybrid'), default='hybrid')
+    parser.add_argument('--unique-requests', type=int, default=10,
+                        help="Distinct request texts, lower values exercise the code cache")
+    parser.add_argument('--rate', type=float, default=0, help="Submission rate in commands/s (0 = all at once)")
+    parser.add_argument('--gemini-latency', type=float, default=0.4, help="Seconds to first Gemini chunk")
+    parser.add_argument('--chunk-delay', type=float, default=0.02, help="Seconds between Gemini chunks")
+    parser.add_argument('--exec-latency', type=float, default=0.2, help="Fake shell execution seconds")
+    parser.add_argument('--exec-jitter', type=float, default=0.1, help="Extra random execution seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of failed executions")
+    parser.add_argument('--output-lines', type=int, default=20, help="Lines of fake output per command")
+    parser.add_argument('--rtdb-latency', type=float, default=0.02, help="Seconds per RTDB write")
+    parser.add_argument('--firestore-latency', type=float, default=0.05, help="Seconds per Firestore write")
+    parser.add_argument('--shell', help="Run commands in a real shell (e.g. bash or pwsh) instead of the fake executor")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-wait', type=float, default=300, help="Seconds to wait for all results")
+    parser.add_argument('--json', help="Also write the report to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="Show the agent's console output")
+    parser.add_argument('--startup', type=int, default=0, metavar='RUNS',
+                        help="Measure agent startup (import, first prompt, connected) over RUNS processes instead")
+    parser.add_argument('--no-connection-test', action='store_true',
+                        help="With --startup, start the agent with --no-connection-test")
+    args = parser.parse_args()
+    args.unique_requests = max(1, args.unique_requests)
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    args.agent = os.path.abspath(args.agent)
+
+    # The agent writes its log file and session store into the working directory
+    workdir = tempfile.mkdtemp(prefix='zynapse_bench_')
+    os.chdir(workdir)
+
+    if args.startup > 0:
+        print(f"🚀 Measuring startup of {os.path.basename(args.agent)} over {args.startup} runs (workdir: {workdir})")
+        report = run_startup_benchmark(args)
+        print_startup_report(report)
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"📁 Report written to: {json_path}")
+        return
+
+    print(f"🚀 Benchmarking {os.path.basename(args.agent)} with {args.commands} commands (workdir: {workdir})")
+
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        report = run_benchmark(args)
+
+    print_report(report)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"📁 Report written to: {json_path}")
+
+if __name__ == "__main__":
+    main()